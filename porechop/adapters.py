@@ -32,6 +32,9 @@ class Adapter(object):
     def is_barcode(self):
         return self.name.startswith('Barcode ')
 
+    def is_repeat(self):
+        return self.name.startswith('GTG rep. ')
+
     def barcode_direction(self):
         if '_rev' in self.start_sequence[0]:
             return 'reverse'
@@ -1297,3 +1300,9 @@ def make_full_rapid_barcode_adapter(barcode_num):
 
     return Adapter('Rapid barcoding ' + str(barcode_num) + ' (full sequence)',
                    start_sequence=('RB' + '%02d' % barcode_num + '_full', start_full_seq))
+
+
+def make_gtg_repeat_adapter(repeat_count):
+    return Adapter('GTG rep. n={}'.format(repeat_count),
+                   start_sequence=('repGTG{}'.format(repeat_count), 'GTG' * repeat_count),
+                   end_sequence=('repGTG{}_rev'.format(repeat_count), 'CAC' * repeat_count))
@@ -3,7 +3,9 @@ Copyright 2017 Ryan Wick (rrwick@gmail.com)
 https://github.com/rrwick/Porechop
 
 Porechop makes use of C++ functions which are compiled in cpp_functions.so. This module uses ctypes
-to wrap them in similarly named Python functions.
+to wrap them in similarly named Python functions. If the cpp_extension module (a CPython extension
+built from the same C++ code) is available, the wrappers call it instead, which avoids the ctypes
+overhead and lets other threads run during alignment. Its results can be used in the same way.
 
 This file is part of Porechop. Porechop is free software: you can redistribute it and/or modify
 it under the terms of the GNU General Public License as published by the Free Software Foundation,
@@ -16,7 +18,9 @@ not, see <http://www.gnu.org/licenses/>.
 
 import os
 import sys
-from ctypes import CDLL, cast, c_char_p, c_int, c_void_p
+import threading
+from ctypes import CDLL, Structure, POINTER, byref, c_char_p, c_int, c_void_p, c_double, \
+    c_uint64
 
 SO_FILE = 'cpp_functions.so'
 SO_FILE_FULL = os.path.join(os.path.dirname(os.path.realpath(__file__)), SO_FILE)
@@ -24,40 +28,407 @@ if not os.path.isfile(SO_FILE_FULL):
     sys.exit('could not find ' + SO_FILE + ' - please reinstall')
 C_LIB = CDLL(SO_FILE_FULL)
 
-C_LIB.adapterAlignment.argtypes = [c_char_p,  # Read sequence
-                                   c_char_p,  # Adapter sequence
-                                   c_int,     # Match score
-                                   c_int,     # Mismatch score
-                                   c_int,     # Gap open score
-                                   c_int]     # Gap extension score
-C_LIB.adapterAlignment.restype = c_void_p     # String describing alignment
+try:
+    from . import cpp_extension as EXTENSION
+except ImportError:
+    EXTENSION = None
 
 
-# This function cleans up the heap memory for the C strings returned by the other C functions. It
-# must be called after them.
-C_LIB.freeCString.argtypes = [c_void_p]
-C_LIB.freeCString.restype = None
+class AlignmentResult(Structure):
+    """
+    Matches the AlignmentResult struct in alignment.h. The C++ functions write their results into
+    these, so nothing needs to be formatted, parsed or freed.
+    """
+    _fields_ = [('read_start', c_int),
+                ('read_end', c_int),
+                ('adapter_start', c_int),
+                ('adapter_end', c_int),
+                ('raw_score', c_int),
+                ('aligned_region_percent_identity', c_double),
+                ('full_adapter_percent_identity', c_double)]
+
+
+class ReadEndTrim(Structure):
+    """
+    Matches the ReadEndTrim struct in end_trim.h.
+    """
+    _fields_ = [('start_trim_amount', c_int),
+                ('end_trim_amount', c_int)]
+
+
+class EndAdapterHit(Structure):
+    """
+    Matches the EndAdapterHit struct in end_trim.h.
+    """
+    _fields_ = [('read_index', c_int),
+                ('adapter_index', c_int),
+                ('read_start', c_int),
+                ('read_end', c_int),
+                ('full_adapter_percent_identity', c_double),
+                ('aligned_region_percent_identity', c_double)]
+
+
+# The names of an alignment result's values, which both kinds of result have as attributes.
+ALIGNMENT_RESULT_FIELDS = [x[0] for x in AlignmentResult._fields_]
+
+
+class MiddleAdapterHit(Structure):
+    """
+    Matches the MiddleAdapterHit struct in middle_search.h.
+    """
+    _fields_ = [('adapter_index', c_int),
+                ('read_start', c_int),
+                ('read_end', c_int),
+                ('full_adapter_percent_identity', c_double)]
+
+
+C_LIB.adapterAlignment.argtypes = [c_char_p,                  # Read sequence
+                                   c_char_p,                  # Adapter sequence
+                                   c_int,                     # Match score
+                                   c_int,                     # Mismatch score
+                                   c_int,                     # Gap open score
+                                   c_int,                     # Gap extension score
+                                   POINTER(AlignmentResult)]  # Result
+C_LIB.adapterAlignment.restype = None
+
+C_LIB.scoreOnlyPanelAlignment.argtypes = [c_char_p,           # Read sequence
+                                          c_void_p,           # Adapter panel
+                                          c_int,              # Match score
+                                          c_int,              # Mismatch score
+                                          c_int,              # Gap open score
+                                          c_int,              # Gap extension score
+                                          POINTER(c_double)]  # Identities (one per adapter)
+C_LIB.scoreOnlyPanelAlignment.restype = None
+
+C_LIB.createAdapterPanel.argtypes = [POINTER(c_char_p),  # Adapter sequences
+                                     c_int,              # Adapter count
+                                     c_int]              # Alignment engine
+C_LIB.createAdapterPanel.restype = c_void_p              # Pointer to the adapter panel
+
+C_LIB.deleteAdapterPanel.argtypes = [c_void_p]
+C_LIB.deleteAdapterPanel.restype = None
+
+C_LIB.seededMiddleSearch.argtypes = [c_char_p,                   # Read sequence
+                                     c_void_p,                   # Middle adapter index
+                                     c_int,                      # Match score
+                                     c_int,                      # Mismatch score
+                                     c_int,                      # Gap open score
+                                     c_int,                      # Gap extension score
+                                     c_double,                   # Minimum identity
+                                     POINTER(MiddleAdapterHit),  # Hits
+                                     c_int]                      # Maximum hit count
+C_LIB.seededMiddleSearch.restype = c_int                         # Hit count
+
+C_LIB.fullMiddleSearch.argtypes = [c_char_p,                   # Read sequence
+                                   c_void_p,                   # Adapter panel
+                                   c_int,                      # Match score
+                                   c_int,                      # Mismatch score
+                                   c_int,                      # Gap open score
+                                   c_int,                      # Gap extension score
+                                   c_double,                   # Minimum identity
+                                   POINTER(MiddleAdapterHit),  # Hits
+                                   c_int,                      # Maximum hit count
+                                   POINTER(c_int)]             # Skipped alignment count
+C_LIB.fullMiddleSearch.restype = c_int                         # Hit count
+
+C_LIB.multiHitMiddleSearch.argtypes = [c_char_p,                   # Read sequence
+                                       c_void_p,                   # Adapter panel
+                                       c_int,                      # Match score
+                                       c_int,                      # Mismatch score
+                                       c_int,                      # Gap open score
+                                       c_int,                      # Gap extension score
+                                       c_double,                   # Minimum identity
+                                       POINTER(MiddleAdapterHit),  # Hits
+                                       c_int,                      # Maximum hit count
+                                       POINTER(c_int)]             # Skipped adapter count
+C_LIB.multiHitMiddleSearch.restype = c_int                         # Hit count
+
+C_LIB.trimReadEnds.argtypes = [POINTER(c_char_p),        # Read sequences
+                               c_int,                    # Read count
+                               c_void_p,                 # Start adapter panel
+                               c_void_p,                 # End adapter panel
+                               c_int,                    # End size
+                               c_int,                    # Extra trim size
+                               c_double,                 # End threshold
+                               c_int,                    # Minimum trim size
+                               c_int,                    # Match score
+                               c_int,                    # Mismatch score
+                               c_int,                    # Gap open score
+                               c_int,                    # Gap extension score
+                               c_int,                    # Thread count
+                               POINTER(ReadEndTrim),     # Trims (one per read)
+                               POINTER(EndAdapterHit),   # Start hits
+                               POINTER(c_int),           # Start hit count
+                               POINTER(EndAdapterHit),   # End hits
+                               POINTER(c_int),           # End hit count
+                               POINTER(c_double),        # Start identities (or null)
+                               POINTER(c_double)]        # End identities (or null)
+C_LIB.trimReadEnds.restype = None
+
+C_LIB.createMiddleAdapterIndex.argtypes = [POINTER(c_char_p),  # Adapter sequences
+                                           c_int,              # Adapter count
+                                           c_int,              # K-mer size
+                                           c_int]              # Alignment engine
+C_LIB.createMiddleAdapterIndex.restype = c_void_p              # Pointer to the index
+
+C_LIB.deleteMiddleAdapterIndex.argtypes = [c_void_p]
+C_LIB.deleteMiddleAdapterIndex.restype = None
+
+C_LIB.addToMinHashSketch.argtypes = [POINTER(c_char_p),  # Read sequences
+                                     c_int,              # Read count
+                                     c_int,              # K-mer size
+                                     c_int,              # Sketch size
+                                     POINTER(c_uint64),  # Sketch (in and out)
+                                     c_int]              # Hashes in the sketch so far
+C_LIB.addToMinHashSketch.restype = c_int                 # Hashes in the new sketch
 
 
 def adapter_alignment(read_sequence, adapter_sequence, scoring_scheme_vals):
     """
-    Python wrapper for adapterAlignment C++ function.
+    Python wrapper for adapterAlignment C++ function. Returns an AlignmentResult.
     """
+    if EXTENSION is not None:
+        return EXTENSION.adapter_alignment(read_sequence, adapter_sequence, *scoring_scheme_vals)
     match_score = scoring_scheme_vals[0]
     mismatch_score = scoring_scheme_vals[1]
     gap_open_score = scoring_scheme_vals[2]
     gap_extend_score = scoring_scheme_vals[3]
-    ptr = C_LIB.adapterAlignment(read_sequence.encode('utf-8'), adapter_sequence.encode('utf-8'),
-                                 match_score, mismatch_score, gap_open_score, gap_extend_score)
-    result_string = c_string_to_python_string(ptr)
-    return result_string
+    result = AlignmentResult()
+    C_LIB.adapterAlignment(read_sequence.encode('utf-8'), adapter_sequence.encode('utf-8'),
+                           match_score, mismatch_score, gap_open_score, gap_extend_score, result)
+    return result
+
+
+def score_only_panel_alignment(read_sequence, adapter_panel, scoring_scheme_vals):
+    """
+    Python wrapper for scoreOnlyPanelAlignment C++ function. Returns an array of full adapter
+    percent identities, one per adapter in the panel. The array is reused by the next call from the
+    same thread.
+    """
+    if EXTENSION is not None:
+        return EXTENSION.score_only_panel_alignment(read_sequence, adapter_panel.pointer,
+                                                    *scoring_scheme_vals)
+    match_score = scoring_scheme_vals[0]
+    mismatch_score = scoring_scheme_vals[1]
+    gap_open_score = scoring_scheme_vals[2]
+    gap_extend_score = scoring_scheme_vals[3]
+    identities = adapter_panel.get_identity_array()
+    C_LIB.scoreOnlyPanelAlignment(read_sequence.encode('utf-8'), adapter_panel.pointer,
+                                  match_score, mismatch_score, gap_open_score, gap_extend_score,
+                                  identities)
+    return identities
+
+
+def trim_read_ends(read_sequences, start_panel, end_panel, end_size, extra_trim_size,
+                   end_threshold, min_trim_size, scoring_scheme_vals, threads,
+                   get_identities=False):
+    """
+    Python wrapper for trimReadEnds C++ function, which finds the adapters at both ends of the
+    reads and decides how much to trim, using the given number of threads. Returns:
+      * a list of (start trim amount, end trim amount) tuples, one per read
+      * a list of the start alignments which met the trimming criteria, as (read index, adapter
+        index, read start, read end, full adapter identity, aligned region identity) tuples
+      * the same for the end alignments
+      * if get_identities is True, the full adapter identity of every start alignment (the
+        identities for read r starting at r * start panel size), otherwise None
+      * the same for the end alignments
+    """
+    if EXTENSION is not None:
+        return EXTENSION.trim_read_ends(read_sequences, start_panel.pointer, end_panel.pointer,
+                                        end_size, extra_trim_size, end_threshold, min_trim_size,
+                                        *scoring_scheme_vals, threads, get_identities)
+    match_score = scoring_scheme_vals[0]
+    mismatch_score = scoring_scheme_vals[1]
+    gap_open_score = scoring_scheme_vals[2]
+    gap_extend_score = scoring_scheme_vals[3]
+    read_count = len(read_sequences)
+    sequences = (c_char_p * max(read_count, 1))(*[x.encode('utf-8') for x in read_sequences])
+    trims = (ReadEndTrim * max(read_count, 1))()
+    start_hits = (EndAdapterHit * max(read_count * start_panel.size, 1))()
+    end_hits = (EndAdapterHit * max(read_count * end_panel.size, 1))()
+    start_hit_count, end_hit_count = c_int(), c_int()
+    if get_identities:
+        start_identities = (c_double * max(read_count * start_panel.size, 1))()
+        end_identities = (c_double * max(read_count * end_panel.size, 1))()
+    else:
+        start_identities, end_identities = None, None
+    C_LIB.trimReadEnds(sequences, read_count, start_panel.pointer, end_panel.pointer, end_size,
+                       extra_trim_size, end_threshold, min_trim_size, match_score,
+                       mismatch_score, gap_open_score, gap_extend_score, threads, trims,
+                       start_hits, byref(start_hit_count), end_hits, byref(end_hit_count),
+                       start_identities, end_identities)
+    hit_fields = [x[0] for x in EndAdapterHit._fields_]
+    return ([(x.start_trim_amount, x.end_trim_amount) for x in trims[:read_count]],
+            [tuple(getattr(x, f) for f in hit_fields) for x in start_hits[:start_hit_count.value]],
+            [tuple(getattr(x, f) for f in hit_fields) for x in end_hits[:end_hit_count.value]],
+            None if start_identities is None else
+            tuple(start_identities[:read_count * start_panel.size]),
+            None if end_identities is None else
+            tuple(end_identities[:read_count * end_panel.size]))
+
+
+# The engines which can align a read to an adapter panel, in the order of the C++ enum. They give
+# identical results: 'seqan' uses SeqAn's alignment, 'simd' uses a vectorised DP and 'trie' aligns
+# to a trie of the adapters, so the DP for a prefix shared by several adapters is only done once.
+ALIGNMENT_ENGINES = ['seqan', 'simd', 'trie']
+
+
+class AdapterPanel(object):
+    """
+    A list of adapter sequences which is given to the C++ code once, so a read sequence can then be
+    aligned to all of them with a single call. With the extension module, the pointer is a capsule
+    which deletes the C++ panel itself.
+    """
+    def __init__(self, adapter_sequences, alignment_engine='simd'):
+        self.size = len(adapter_sequences)
+        engine = ALIGNMENT_ENGINES.index(alignment_engine)
+        self.extension = EXTENSION
+        if EXTENSION is not None:
+            self.pointer = EXTENSION.create_adapter_panel(adapter_sequences, engine)
+            return
+        sequences = (c_char_p * max(self.size, 1))(*[x.encode('utf-8') for x in adapter_sequences])
+        self.pointer = C_LIB.createAdapterPanel(sequences, self.size, engine)
+        self.thread_data = threading.local()
+
+    def get_identity_array(self):
+        try:
+            return self.thread_data.identities
+        except AttributeError:
+            self.thread_data.identities = (c_double * max(self.size, 1))()
+            return self.thread_data.identities
+
+    def __del__(self):
+        if self.extension is None:
+            C_LIB.deleteAdapterPanel(self.pointer)
+
+
+def seeded_middle_search(read_sequence, middle_index, scoring_scheme_vals, min_identity,
+                         first_hit_only=False):
+    """
+    Python wrapper for seededMiddleSearch C++ function. Returns a list of the middle adapters found
+    in the read, as (adapter index, read start, read end, full adapter identity) tuples. If
+    first_hit_only is True, the search stops at the first hit.
+    """
+    if EXTENSION is not None:
+        return EXTENSION.seeded_middle_search(read_sequence, middle_index.pointer,
+                                              *scoring_scheme_vals, min_identity, first_hit_only)
+    match_score = scoring_scheme_vals[0]
+    mismatch_score = scoring_scheme_vals[1]
+    gap_open_score = scoring_scheme_vals[2]
+    gap_extend_score = scoring_scheme_vals[3]
+    read_sequence = read_sequence.encode('utf-8')
+    return get_middle_hits(lambda hits, max_hits:
+                           C_LIB.seededMiddleSearch(read_sequence, middle_index.pointer,
+                                                    match_score, mismatch_score, gap_open_score,
+                                                    gap_extend_score, min_identity, hits,
+                                                    max_hits),
+                           first_hit_only)
+
+
+def full_middle_search(read_sequence, adapter_panel, scoring_scheme_vals, min_identity,
+                       first_hit_only=False):
+    """
+    Python wrapper for fullMiddleSearch C++ function. Returns a list of the middle adapters found
+    in the read, as (adapter index, read start, read end, full adapter identity) tuples, and the
+    number of alignments which were skipped because the prefilter showed they couldn't reach the
+    minimum identity. If first_hit_only is True, the search stops at the first hit.
+    """
+    if EXTENSION is not None:
+        return EXTENSION.full_middle_search(read_sequence, adapter_panel.pointer,
+                                            *scoring_scheme_vals, min_identity, first_hit_only)
+    match_score = scoring_scheme_vals[0]
+    mismatch_score = scoring_scheme_vals[1]
+    gap_open_score = scoring_scheme_vals[2]
+    gap_extend_score = scoring_scheme_vals[3]
+    read_sequence = read_sequence.encode('utf-8')
+    skipped_count = c_int()
+    hits = get_middle_hits(lambda hits, max_hits:
+                           C_LIB.fullMiddleSearch(read_sequence, adapter_panel.pointer,
+                                                  match_score, mismatch_score, gap_open_score,
+                                                  gap_extend_score, min_identity, hits,
+                                                  max_hits, byref(skipped_count)),
+                           first_hit_only)
+    return hits, skipped_count.value
+
+
+def multi_hit_middle_search(read_sequence, adapter_panel, scoring_scheme_vals, min_identity,
+                            first_hit_only=False):
+    """
+    Python wrapper for multiHitMiddleSearch C++ function. Returns a list of the middle adapters
+    found in the read, as (adapter index, read start, read end, full adapter identity) tuples, and
+    the number of adapters which were skipped because they occur nowhere in the read. If
+    first_hit_only is True, the search stops at the first hit, so the adapters after its adapter
+    are neither searched nor skipped.
+    """
+    if EXTENSION is not None:
+        return EXTENSION.multi_hit_middle_search(read_sequence, adapter_panel.pointer,
+                                                 *scoring_scheme_vals, min_identity,
+                                                 first_hit_only)
+    match_score = scoring_scheme_vals[0]
+    mismatch_score = scoring_scheme_vals[1]
+    gap_open_score = scoring_scheme_vals[2]
+    gap_extend_score = scoring_scheme_vals[3]
+    read_sequence = read_sequence.encode('utf-8')
+    skipped_count = c_int()
+    hits = get_middle_hits(lambda hits, max_hits:
+                           C_LIB.multiHitMiddleSearch(read_sequence, adapter_panel.pointer,
+                                                      match_score, mismatch_score,
+                                                      gap_open_score, gap_extend_score,
+                                                      min_identity, hits, max_hits,
+                                                      byref(skipped_count)),
+                           first_hit_only)
+    return hits, skipped_count.value
+
+
+def get_middle_hits(search, first_hit_only=False):
+    """
+    Runs a middle adapter search (a function taking a hit array and its size, and returning the hit
+    count) and returns the hits as tuples. If the hit array fills up, the search is repeated with a
+    bigger one. The C++ searches stop when the array is full, so a one-hit array stops them at the
+    first hit.
+    """
+    max_hits = 1 if first_hit_only else 64
+    while True:
+        hits = (MiddleAdapterHit * max_hits)()
+        hit_count = search(hits, max_hits)
+        if hit_count < max_hits or first_hit_only:
+            return [(h.adapter_index, h.read_start, h.read_end, h.full_adapter_percent_identity)
+                    for h in hits[:hit_count]]
+        max_hits *= 4
+
+
+class MiddleAdapterIndex(object):
+    """
+    The adapters searched for in read middles, given to the C++ code once along with an index of
+    their k-mers, which seeded_middle_search uses to find where in a read to align them.
+    """
+    def __init__(self, adapter_sequences, kmer_size, alignment_engine='simd'):
+        self.size = len(adapter_sequences)
+        engine = ALIGNMENT_ENGINES.index(alignment_engine)
+        self.extension = EXTENSION
+        if EXTENSION is not None:
+            self.pointer = EXTENSION.create_middle_adapter_index(adapter_sequences, kmer_size,
+                                                                 engine)
+            return
+        sequences = (c_char_p * max(self.size, 1))(*[x.encode('utf-8') for x in adapter_sequences])
+        self.pointer = C_LIB.createMiddleAdapterIndex(sequences, self.size, kmer_size, engine)
+
+    def __del__(self):
+        if self.extension is None:
+            C_LIB.deleteMiddleAdapterIndex(self.pointer)
 
 
-def c_string_to_python_string(c_string):
+def add_to_minhash_sketch(read_sequences, kmer_size, sketch_size, sketch):
     """
-    This function casts a C string to a Python string and then calls a function to delete the C
-    string from the heap.
+    Python wrapper for addToMinHashSketch C++ function. Adds the canonical k-mers of the reads to a
+    bottom-k MinHash sketch (an ascending list of at most sketch_size hashes) and returns the new
+    sketch.
     """
-    python_string = cast(c_string, c_char_p).value.decode()
-    C_LIB.freeCString(c_string)
-    return python_string
+    if EXTENSION is not None:
+        return EXTENSION.add_to_minhash_sketch(read_sequences, kmer_size, sketch_size, sketch)
+    read_count = len(read_sequences)
+    sequences = (c_char_p * max(read_count, 1))(*[x.encode('utf-8') for x in read_sequences])
+    sketch_array = (c_uint64 * max(sketch_size, len(sketch), 1))(*sketch)
+    count = C_LIB.addToMinHashSketch(sequences, read_count, kmer_size, sketch_size, sketch_array,
+                                     len(sketch))
+    return sketch_array[:count]
@@ -2,20 +2,54 @@
 #define ADAPTER_ALIGN_H
 
 #include <seqan/sequence.h>
+#include <seqan/score.h>
 #include <string>
 #include <vector>
 #include "alignment.h"
+#include "trie_align.h"
 
 using namespace seqan;
 
+
+// The alignment engines an adapter panel can use. The trie engine aligns a read to the whole panel
+// at once, and uses the SIMD engine's aligner for single adapters.
+enum AlignmentEngine {SEQAN_ENGINE = 0, SIMD_ENGINE = 1, TRIE_ENGINE = 2};
+
+// A set of adapter sequences which are converted once and then reused for many alignments. The
+// trie is only built for the trie engine.
+struct AdapterPanel {
+    std::vector<Dna5String> adapters;
+    std::vector<int> adapterLengths;
+    AlignmentEngine engine;
+    AdapterTrie trie;
+};
+
+
 // Functions that are called by the Python script must have C linkage, not C++ linkage.
 extern "C" {
-    char * adapterAlignment(char * readSeq, char * adapterSeq,
-                            int matchScore, int mismatchScore, int gapOpenScore, int gapExtensionScore);
-    void freeCString(char * p);
+    void adapterAlignment(char * readSeq, char * adapterSeq,
+                          int matchScore, int mismatchScore, int gapOpenScore, int gapExtensionScore,
+                          AlignmentResult * result);
+    AdapterPanel * createAdapterPanel(char ** adapterSeqs, int adapterCount, int engine);
+    void deleteAdapterPanel(AdapterPanel * panel);
 }
 
-char * cppStringToCString(std::string cpp_string);
+void alignReadToPanel(Dna5String & readSeq, int readLength, AdapterPanel * panel,
+                      int matchScore, int mismatchScore, int gapOpenScore,
+                      int gapExtensionScore, AlignmentResult * results);
+
+void alignReadsToPanel(std::vector<Dna5String> & sequences, AdapterPanel * panel,
+                       int matchScore, int mismatchScore, int gapOpenScore,
+                       int gapExtensionScore, AlignmentResult * results);
+
+void alignReadToPanelAdapter(Dna5String & readSeq, int readLength,
+                             AdapterPanel * panel, int adapterIndex,
+                             int matchScore, int mismatchScore, int gapOpenScore,
+                             int gapExtensionScore, AlignmentResult * result);
+
+ScoredAlignment alignReadToAdapter(Dna5String & readSeq, int readLength,
+                                   Dna5String & adapterSeq, int adapterLength,
+                                   Score<int, Simple> & scoringScheme);
 
 
 #endif // ADAPTER_ALIGN_H
@@ -4,17 +4,36 @@
 
 
 #include <string>
+#include <limits>
 #include <seqan/basic.h>
 #include <seqan/align.h>
 
 using namespace seqan;
 
 
+// The results of one alignment, in a fixed layout which Python reads directly (via ctypes). If
+// readStart is -1, the alignment failed and the other values are meaningless.
+extern "C" {
+    struct AlignmentResult {
+        int readStart;
+        int readEnd;
+        int adapterStart;
+        int adapterEnd;
+        int rawScore;
+        double alignedRegionPercentIdentity;
+        double fullAdapterPercentIdentity;
+    };
+}
+
+
+// A minimum raw score for an alignment which every alignment reaches, i.e. no minimum at all.
+const int NO_MIN_SCORE = std::numeric_limits<int>::min();
+
+
 class ScoredAlignment {
 public:
-    ScoredAlignment(Align<Dna5String, ArrayGaps> & alignment,
-                    int readLength, int adapterLength, int score);
-    std::string getString();
+    ScoredAlignment(int readLength, int adapterLength, int score);
+    void getResult(AlignmentResult * result);
 
     int m_readLength;
     int m_adapterLength;
@@ -27,4 +46,36 @@ public:
     double m_fullAdapterPercentIdentity;
 };
 
+
+// The kinds of alignment column, by which of the two sequences has a base in the column.
+enum ColumnKind {READ_BASE_ONLY = 1, ADAPTER_BASE_ONLY = 2, BOTH_BASES = 3};
+
+// Works out an alignment's coordinates and identities while its traceback is followed, so no
+// gapped alignment rows are needed. The columns are given from the last to the first, in runs of
+// one kind, with the read and adapter bases before each run's first column and the run's matches.
+class TracebackWalk {
+public:
+    TracebackWalk();
+    void addRun(ColumnKind kind, int length, int readPos, int adapterPos, int matches);
+    ScoredAlignment finish(int readLength, int adapterLength, int score);
+
+private:
+    // A column, given by the read and adapter bases before it and by the number of columns from
+    // it to the end of the alignment (so 1 is the last column).
+    struct Column {
+        int readPos;
+        int adapterPos;
+        int tail;
+    };
+
+    int m_columns;
+    int m_matches;
+    bool m_readEnded;
+    bool m_adapterEnded;
+    Column m_alignmentEnd;
+    Column m_adapterEnd;
+    Column m_readStart;
+    Column m_adapterStart;
+};
+
 #endif // ALIGNMENT_H
@@ -0,0 +1,68 @@
+#ifndef END_TRIM_H
+#define END_TRIM_H
+
+#include <seqan/sequence.h>
+#include <vector>
+#include "adapter_align.h"
+
+using namespace seqan;
+
+
+// The number of reads a worker thread takes at a time when trimming read ends.
+const int END_TRIM_BLOCK_SIZE = 64;
+
+// How much to trim from each end of a read.
+extern "C" struct ReadEndTrim {
+    int startTrimAmount;
+    int endTrimAmount;
+};
+
+// An adapter alignment at a read end which met the trimming criteria. The read coordinates are in
+// the read end (the end position is exclusive). The identities are not rounded.
+extern "C" struct EndAdapterHit {
+    int readIndex;
+    int adapterIndex;
+    int readStart;
+    int readEnd;
+    double fullAdapterPercentIdentity;
+    double alignedRegionPercentIdentity;
+};
+
+// The settings which decide whether an alignment at a read end is trimmed.
+struct EndTrimSettings {
+    int endSize;
+    int extraTrimSize;
+    double endThreshold;
+    int minTrimSize;
+    int matchScore;
+    int mismatchScore;
+    int gapOpenScore;
+    int gapExtensionScore;
+};
+
+
+// Functions that are called by the Python script must have C linkage, not C++ linkage.
+extern "C" {
+    void trimReadEnds(char ** readSeqs, int readCount,
+                      AdapterPanel * startPanel, AdapterPanel * endPanel,
+                      int endSize, int extraTrimSize, double endThreshold, int minTrimSize,
+                      int matchScore, int mismatchScore, int gapOpenScore,
+                      int gapExtensionScore, int threadCount, ReadEndTrim * trims,
+                      EndAdapterHit * startHits, int * startHitCount,
+                      EndAdapterHit * endHits, int * endHitCount,
+                      double * startIdentities, double * endIdentities);
+}
+
+void trimReadEndBlock(char ** readSeqs, int blockStart, int blockEnd,
+                      AdapterPanel * startPanel, AdapterPanel * endPanel,
+                      EndTrimSettings const & settings, ReadEndTrim * trims,
+                      std::vector<EndAdapterHit> & startHits,
+                      std::vector<EndAdapterHit> & endHits,
+                      double * startIdentities, double * endIdentities);
+
+EndAdapterHit endAdapterHit(int readIndex, int adapterIndex, AlignmentResult const & result);
+
+double roundIdentity(double identity);
+
+
+#endif // END_TRIM_H
@@ -0,0 +1,72 @@
+#ifndef MIDDLE_SEARCH_H
+#define MIDDLE_SEARCH_H
+
+#include <seqan/sequence.h>
+#include <stdint.h>
+#include <unordered_map>
+#include <vector>
+#include "adapter_align.h"
+
+using namespace seqan;
+
+
+// The adapters searched for in read middles, with an index of their k-mers for finding seeds.
+struct MiddleAdapterIndex {
+    std::vector<Dna5String> adapters;
+    std::vector<int> adapterLengths;
+    int kmerSize;
+    AlignmentEngine engine;
+
+    // Each k-mer (2 bits per base) maps to the adapters and positions where it occurs.
+    std::unordered_map<uint32_t, std::vector<std::pair<int, int> > > kmerPositions;
+};
+
+// A middle adapter found in a read. The end position is exclusive.
+extern "C" struct MiddleAdapterHit {
+    int adapterIndex;
+    int readStart;
+    int readEnd;
+    double fullAdapterPercentIdentity;
+};
+
+// A k-mer match between the read and an adapter.
+struct Seed {
+    int diagonal;  // read position minus adapter position
+    int readPos;
+};
+
+
+// Functions that are called by the Python script must have C linkage, not C++ linkage.
+extern "C" {
+    MiddleAdapterIndex * createMiddleAdapterIndex(char ** adapterSeqs, int adapterCount,
+                                                  int kmerSize, int engine);
+    void deleteMiddleAdapterIndex(MiddleAdapterIndex * index);
+    int seededMiddleSearch(char * readSeq, MiddleAdapterIndex * index,
+                           int matchScore, int mismatchScore, int gapOpenScore,
+                           int gapExtensionScore, double minIdentity,
+                           MiddleAdapterHit * hits, int maxHits);
+    int fullMiddleSearch(char * readSeq, AdapterPanel * panel,
+                         int matchScore, int mismatchScore, int gapOpenScore,
+                         int gapExtensionScore, double minIdentity,
+                         MiddleAdapterHit * hits, int maxHits, int * skippedCount);
+    int multiHitMiddleSearch(char * readSeq, AdapterPanel * panel,
+                             int matchScore, int mismatchScore, int gapOpenScore,
+                             int gapExtensionScore, double minIdentity,
+                             MiddleAdapterHit * hits, int maxHits, int * skippedCount);
+}
+
+std::vector<std::pair<int, int> > seedWindows(std::vector<Seed> & seeds, int adapterLength,
+                                              int readLength, int kmerSize,
+                                              std::vector<char> & masked);
+
+std::vector<std::pair<int, int> > occurrenceWindows(Dna5String & readSeq, int readLength,
+                                                    Dna5String & adapterSeq, int adapterLength,
+                                                    int maxEdits);
+
+AlignmentResult alignAdapterInWindow(Dna5String & readSeq, int windowStart, int windowEnd,
+                                     Dna5String & adapterSeq, int adapterLength,
+                                     AlignmentEngine engine, int matchScore, int mismatchScore,
+                                     int gapOpenScore, int gapExtensionScore, int minScore);
+
+
+#endif // MIDDLE_SEARCH_H
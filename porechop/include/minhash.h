@@ -0,0 +1,20 @@
+#ifndef MINHASH_H
+#define MINHASH_H
+
+#include <stdint.h>
+
+
+// The longest k-mer which fits in a 64-bit integer (two bits per base).
+const int MAX_SKETCH_KMER_SIZE = 32;
+
+
+// Functions that are called by the Python script must have C linkage, not C++ linkage.
+extern "C" {
+    int addToMinHashSketch(char ** readSeqs, int readCount, int kmerSize, int sketchSize,
+                           uint64_t * sketch, int sketchCount);
+}
+
+uint64_t hashKmer(uint64_t kmer);
+
+
+#endif // MINHASH_H
@@ -0,0 +1,17 @@
+#ifndef PREFILTER_H
+#define PREFILTER_H
+
+#include <seqan/sequence.h>
+
+using namespace seqan;
+
+
+int maxEditsForIdentity(int adapterLength, double minIdentity);
+
+int minScoreForIdentity(int adapterLength, double minIdentity, int matchScore, int mismatchScore,
+                        int gapOpenScore, int gapExtensionScore);
+
+bool adapterWithinEditDistance(Dna5String & readSeq, Dna5String & adapterSeq, int maxEdits);
+
+
+#endif // PREFILTER_H
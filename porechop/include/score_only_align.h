@@ -0,0 +1,53 @@
+#ifndef SCORE_ONLY_ALIGN_H
+#define SCORE_ONLY_ALIGN_H
+
+#include <seqan/sequence.h>
+#include <seqan/score.h>
+#include <stdint.h>
+#include "adapter_align.h"
+
+using namespace seqan;
+
+
+// What is known about the alignment path which ends in a DP cell (in one of the three Gotoh
+// matrices), carried forward through the DP so no traceback is needed. These fields are packed
+// into one integer (21 bits each, plus a flag in the top bit):
+//   * matches: read and adapter bases aligned to each other and equal
+//   * read gaps: read bases aligned to gaps, since the first adapter base
+//   * trailing gaps: the same, but only since the last adapter base
+//   * adapter begun: whether an adapter base has been aligned yet
+typedef uint64_t PathStats;
+
+// One row of the DP column currently being filled.
+struct ColumnCell {
+    int score;
+    int horizontalScore;
+    PathStats stats;
+    PathStats horizontalStats;
+};
+
+// The best of the diagonal and horizontal gap for one cell, before the vertical gap is considered.
+struct PartialCell {
+    int score;
+    int comparisonScore;
+    PathStats stats;
+};
+
+
+// Functions that are called by the Python script must have C linkage, not C++ linkage.
+extern "C" {
+    void scoreOnlyPanelAlignment(char * readSeq, AdapterPanel * panel,
+                                 int matchScore, int mismatchScore, int gapOpenScore,
+                                 int gapExtensionScore, double * identities);
+}
+
+// fullAdapterIdentity returns this when the alignment's raw score is below the given minimum.
+const double BELOW_MIN_SCORE = -1.0;
+
+double fullAdapterIdentity(Dna5String & readSeq, int readLength,
+                           Dna5String & adapterSeq, int adapterLength,
+                           int matchScore, int mismatchScore, int gapOpenScore,
+                           int gapExtensionScore, int minScore);
+
+
+#endif // SCORE_ONLY_ALIGN_H
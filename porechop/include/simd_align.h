@@ -0,0 +1,122 @@
+#ifndef SIMD_ALIGN_H
+#define SIMD_ALIGN_H
+
+#include <seqan/sequence.h>
+#include <seqan/score.h>
+#include <stdint.h>
+#include <vector>
+#include "alignment.h"
+#include "trie_align.h"
+
+using namespace seqan;
+
+
+// Bits stored for each DP cell, which the traceback uses to follow the same path as SeqAn.
+const int16_t TRACE_DIAGONAL = 1;           // The main matrix score came from the diagonal
+const int16_t TRACE_FROM_HORIZONTAL = 2;    // Otherwise, it came from the horizontal gap matrix
+const int16_t TRACE_HORIZONTAL_EXTEND = 4;  // The horizontal gap matrix score extended a gap
+const int16_t TRACE_VERTICAL_EXTEND = 8;    // The vertical gap matrix score extended a gap
+const int16_t TRACE_VERTICAL_IS_MAX = 16;   // The vertical gap matrix score equals the cell score
+const int16_t TRACE_HORIZONTAL_IS_MAX = 32; // The horizontal gap matrix score equals the cell score
+
+
+bool simdAlignmentPossible(int readLength, int adapterLength,
+                           int matchScore, int mismatchScore, int gapOpenScore,
+                           int gapExtensionScore);
+
+ScoredAlignment simdAlignReadToAdapter(Dna5String & readSeq, int readLength,
+                                       Dna5String & adapterSeq, int adapterLength,
+                                       int matchScore, int mismatchScore, int gapOpenScore,
+                                       int gapExtensionScore, int minScore);
+
+int simdLaneCount();
+
+std::vector<ScoredAlignment> simdAlignReadsToAdapter(std::vector<Dna5String *> & readSeqs,
+                                                     int readLength,
+                                                     Dna5String & adapterSeq, int adapterLength,
+                                                     int matchScore, int mismatchScore,
+                                                     int gapOpenScore, int gapExtensionScore);
+
+void simdTrieAlignReadsToAdapters(std::vector<Dna5String *> & readSeqs, int readLength,
+                                  AdapterTrie & trie, std::vector<Dna5String> & adapters,
+                                  int matchScore, int mismatchScore, int gapOpenScore,
+                                  int gapExtensionScore, std::vector<AlignmentResult *> & results);
+
+
+// Finds the best cell and traces the alignment back from it, the same way SeqAn does. The lookup
+// functions give the trace bits of a cell and the scores along the last row and column, so this
+// works with any buffer layout. If the best score is below minScore, there is no traceback and a
+// failed alignment is returned.
+template <typename TTraceLookup, typename TLastRowLookup, typename TLastColumnLookup>
+ScoredAlignment traceBestAlignment(TTraceLookup traceAt, TLastRowLookup lastRowScore,
+                                   TLastColumnLookup lastColumnScore,
+                                   Dna5String & readSeq, int n,
+                                   Dna5String & adapterSeq, int m, int minScore) {
+    // SeqAn looks for the best score along the last row and then down the last column, keeping the
+    // first of equal scores.
+    int bestScore = lastRowScore(0), bestI = m, bestJ = 0;
+    for (int j = 1; j < n; ++j) {
+        if (lastRowScore(j) > bestScore) {
+            bestScore = lastRowScore(j);
+            bestJ = j;
+        }
+    }
+    for (int i = 0; i <= m; ++i) {
+        if (lastColumnScore(i) > bestScore) {
+            bestScore = lastColumnScore(i);
+            bestI = i;
+            bestJ = n;
+        }
+    }
+
+    if (bestScore < minScore)
+        return ScoredAlignment(n, m, bestScore);
+
+    // The traceback works like SeqAn's. At the best cell it starts in a gap matrix if that matrix
+    // has the cell's score, and within a gap it keeps going until the gap was opened. The columns
+    // are given to the walk as they're passed: first the free gaps at the end (the rest of the
+    // adapter, then the rest of the read), then the path and lastly the free gaps at the start.
+    TracebackWalk walk;
+    int i = bestI, j = bestJ;
+    walk.addRun(READ_BASE_ONLY, n - j, j, m, 0);
+    walk.addRun(ADAPTER_BASE_ONLY, m - i, j, i, 0);
+    enum {MAIN, VERTICAL, HORIZONTAL} state = MAIN;
+    if (i > 0 && j > 0) {
+        int16_t bits = traceAt(i, j);
+        if (bits & TRACE_VERTICAL_IS_MAX)
+            state = VERTICAL;
+        else if (bits & TRACE_HORIZONTAL_IS_MAX)
+            state = HORIZONTAL;
+    }
+    while (i > 0 && j > 0) {
+        int16_t bits = traceAt(i, j);
+        if (state == MAIN) {
+            if (bits & TRACE_DIAGONAL) {
+                --i;
+                --j;
+                walk.addRun(BOTH_BASES, 1, j, i, ordValue(readSeq[j]) == ordValue(adapterSeq[i]));
+            }
+            else
+                state = (bits & TRACE_FROM_HORIZONTAL) ? HORIZONTAL : VERTICAL;
+        }
+        else if (state == VERTICAL) {
+            --i;
+            walk.addRun(ADAPTER_BASE_ONLY, 1, j, i, 0);
+            if (!(bits & TRACE_VERTICAL_EXTEND))
+                state = MAIN;
+        }
+        else {
+            --j;
+            walk.addRun(READ_BASE_ONLY, 1, j, i, 0);
+            if (!(bits & TRACE_HORIZONTAL_EXTEND))
+                state = MAIN;
+        }
+    }
+    walk.addRun(READ_BASE_ONLY, j, 0, i, 0);
+    walk.addRun(ADAPTER_BASE_ONLY, i, 0, 0, 0);
+
+    return walk.finish(n, m, bestScore);
+}
+
+
+#endif // SIMD_ALIGN_H
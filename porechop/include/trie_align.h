@@ -0,0 +1,33 @@
+#ifndef TRIE_ALIGN_H
+#define TRIE_ALIGN_H
+
+#include <seqan/sequence.h>
+#include <vector>
+#include "alignment.h"
+
+using namespace seqan;
+
+
+// A trie of adapter sequences. Adapters with a common prefix share the nodes for it, so the DP
+// rows for the prefix only need to be filled once. The nodes (all but the root) are kept in
+// depth-first order, so a node always comes after its parent, and the last node seen at each
+// depth before a node is that node's ancestor at that depth.
+struct AdapterTrie {
+    std::vector<int> nodeBases;                   // The node's base (as a Dna5 value)
+    std::vector<int> nodeDepths;                  // The node's depth (1 for the root's children)
+    std::vector<std::vector<int> > nodeAdapters;  // The adapters which end at the node
+    int maxDepth;
+};
+
+
+AdapterTrie buildAdapterTrie(std::vector<Dna5String> & adapters);
+
+bool trieAlignmentPossible(int readLength, int gapOpenScore, int gapExtensionScore);
+
+void trieAlignReadToAdapters(Dna5String & readSeq, int readLength, AdapterTrie & trie,
+                             std::vector<Dna5String> & adapters,
+                             int matchScore, int mismatchScore, int gapOpenScore,
+                             int gapExtensionScore, AlignmentResult * results);
+
+
+#endif // TRIE_ALIGN_H
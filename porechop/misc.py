@@ -20,6 +20,13 @@ import re
 import textwrap
 import shutil
 import argparse
+import io
+import queue
+import subprocess
+import threading
+
+PARSE_BLOCK_SIZE = 256 * 1024
+WHITESPACE = b' \t\r\n'
 
 
 def float_to_str(num, decimals, max_num=0):
@@ -110,12 +117,26 @@ def load_fasta_or_fastq(filename):
     """
     Returns a list of tuples (header, seq) for each record in the fasta/fastq file.
     """
+    records, file_type = iterate_fasta_or_fastq(filename)
+    return list(records), file_type
+
+
+def iterate_fasta_or_fastq(filename):
+    """
+    Like load_fasta_or_fastq, but returns a generator of the records instead of a list, so the
+    whole file never needs to be held in memory.
+    """
+    file_type = get_sequence_file_type(filename)
+    if file_type == 'FASTA':
+        records = iterate_fasta(filename)
+    else:  # FASTQ
+        records = iterate_fastq(filename)
+    return exit_on_parse_error(records, filename), file_type
+
+
+def exit_on_parse_error(records, filename):
     try:
-        file_type = get_sequence_file_type(filename)
-        if file_type == 'FASTA':
-            return load_fasta(filename), 'FASTA'
-        else:  # FASTQ
-            return load_fastq(filename), 'FASTQ'
+        yield from records
     except IndexError:
         sys.exit('\nError: ' + filename + ' could not be parsed - is it formatted correctly?')
 
@@ -124,48 +145,163 @@ def load_fasta(fasta_filename):
     """
     Returns a list of tuples (header, seq) for each record in the fasta file.
     """
-    if get_compression_type(fasta_filename) == 'gz':
-        open_func = gzip.open
-    else:  # plain text
-        open_func = open
-    fasta_seqs = []
-    with open_func(fasta_filename, 'rt') as fasta_file:
-        name = ''
-        sequence = ''
-        for line in fasta_file:
-            line = line.strip()
-            if not line:
-                continue
-            if line[0] == '>':  # Header line = start of new contig
-                if name:
-                    fasta_seqs.append((name.split()[0], sequence, name))
-                    sequence = ''
-                name = line[1:]
+    return list(iterate_fasta(fasta_filename))
+
+
+def iterate_fasta(fasta_filename):
+    """
+    Yields a tuple (short name, seq, full name) for each record in the fasta file. The file is read
+    in large binary blocks which are split into records with bytes.find, instead of line by line.
+    Blocks of an unfinished record are kept in a list and only the newest block is searched for a
+    record start, so a record much longer than a block is still read in linear time.
+    """
+    with open_sequence_file(fasta_filename, 'rb') as fasta_file:
+        pending = []
+        while True:
+            block = fasta_file.read(PARSE_BLOCK_SIZE)
+            if block:
+                last_record_start = block.rfind(b'\n>')
+                if last_record_start != -1:
+                    complete = b''.join(pending) + block[:last_record_start]
+                    pending = [block[last_record_start + 1:]]
+                elif block.startswith(b'>') and pending and pending[-1].endswith(b'\n'):
+                    # The record start's newline ended the previous block.
+                    complete = b''.join(pending)[:-1]
+                    pending = [block]
+                else:
+                    pending.append(block)
+                    continue
             else:
-                sequence += line
-        if name:
-            fasta_seqs.append((name.split()[0], sequence, name))
-    return fasta_seqs
+                complete, pending = b''.join(pending), []
+            for record in complete[1:].split(b'\n>'):
+                header_end = record.find(b'\n')
+                if header_end == -1:
+                    header_end = len(record)
+                name = record[:header_end].rstrip().decode()
+                if name:
+                    sequence = record[header_end + 1:].translate(None, WHITESPACE).decode()
+                    yield name.split()[0], sequence, name
+            if not block:
+                break
 
 
 def load_fastq(fastq_filename):
     """
     Returns a list of tuples (header, seq) for each record in the fastq file.
     """
-    if get_compression_type(fastq_filename) == 'gz':
-        open_func = gzip.open
-    else:  # plain text
-        open_func = open
-    reads = []
-    with open_func(fastq_filename, 'rt') as fastq:
+    return list(iterate_fastq(fastq_filename))
+
+
+def iterate_fastq(fastq_filename):
+    """
+    Yields a tuple (short name, seq, spacer, quals, full name) for each record in the fastq file.
+    This stays line-based: in CPython, TextIOWrapper's line iteration beats splitting binary blocks
+    with bytes.find, because FASTQ records are always exactly four lines.
+    """
+    with open_sequence_file(fastq_filename, 'rt') as fastq:
         for line in fastq:
             full_name = line.strip()[1:]
-            short_name = full_name.split()[0]
-            sequence = next(fastq).strip()
-            spacer = next(fastq).strip()
-            qualities = next(fastq).strip()
-            reads.append((short_name, sequence, spacer, qualities, full_name))
-    return reads
+            try:
+                sequence = next(fastq).strip()
+                spacer = next(fastq).strip()
+                qualities = next(fastq).strip()
+            except StopIteration:
+                raise IndexError('truncated FASTQ record')
+            yield full_name.split(None, 1)[0], sequence, spacer, qualities, full_name
+
+
+def open_sequence_file(filename, mode):
+    """
+    Opens a FASTA/FASTQ file for reading in either text ('rt') or binary ('rb') mode. Gzipped files
+    are decompressed by pigz in a separate process when it is available, with a background thread
+    keeping a buffer of decompressed data ready for the parser. Without pigz, this falls back to
+    Python's gzip module.
+    """
+    if get_compression_type(filename) != 'gz':
+        return open(filename, mode)
+    decompress_command = get_decompress_command()
+    if decompress_command is None:
+        return gzip.open(filename, mode)
+    reader = io.BufferedReader(PrefetchDecompressor(filename, decompress_command),
+                               buffer_size=PARSE_BLOCK_SIZE)
+    if mode == 'rt':
+        return io.TextIOWrapper(reader)
+    return reader
+
+
+def get_decompress_command():
+    pigz_path = shutil.which('pigz')
+    if pigz_path is None:
+        return None
+    return [pigz_path, '-dc']
+
+
+class PrefetchDecompressor(io.RawIOBase):
+    """
+    A readable stream of a file decompressed by an external command (e.g. pigz -dc). A background
+    thread reads the command's output into a queue of blocks, so decompression carries on while the
+    parser works.
+    """
+    def __init__(self, filename, decompress_command, prefetch_blocks=16):
+        super().__init__()
+        self.filename = filename
+        self.process = subprocess.Popen(decompress_command + [filename], stdout=subprocess.PIPE,
+                                        stderr=subprocess.PIPE)
+        self.blocks = queue.Queue(prefetch_blocks)
+        self.block, self.block_pos = b'', 0
+        self.finished, self.stopped = False, False
+        self.thread = threading.Thread(target=self.prefetch, daemon=True)
+        self.thread.start()
+
+    def prefetch(self):
+        try:
+            while not self.stopped:
+                block = self.process.stdout.read(PARSE_BLOCK_SIZE)
+                self.blocks.put(block)
+                if not block:
+                    break
+        except (OSError, ValueError) as e:
+            self.blocks.put(e)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if self.block_pos >= len(self.block):
+            if self.finished:
+                return 0
+            block = self.blocks.get()
+            if isinstance(block, Exception):
+                raise block
+            if not block:
+                self.finished = True
+                self.check_exit_status()
+                return 0
+            self.block, self.block_pos = memoryview(block), 0
+        size = min(len(buffer), len(self.block) - self.block_pos)
+        buffer[:size] = self.block[self.block_pos:self.block_pos + size]
+        self.block_pos += size
+        return size
+
+    def check_exit_status(self):
+        if self.process.wait() != 0:
+            error = self.process.stderr.read().decode(errors='replace').strip()
+            raise OSError('could not decompress ' + self.filename + ': ' + error)
+
+    def close(self):
+        if not self.closed and not self.finished:
+            self.stopped = True
+            self.process.kill()
+            while self.thread.is_alive():  # unblock the prefetch thread if the queue is full
+                try:
+                    self.blocks.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            self.process.wait()
+        if not self.closed:
+            self.process.stdout.close()
+            self.process.stderr.close()
+        super().close()
 
 
 def print_table(table, print_dest, alignments='', max_col_width=30, col_separation=3, indent=2,
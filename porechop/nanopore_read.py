@@ -14,7 +14,8 @@ details. You should have received a copy of the GNU General Public License along
 not, see <http://www.gnu.org/licenses/>.
 """
 
-from .cpp_function_wrappers import adapter_alignment
+from .cpp_function_wrappers import score_only_panel_alignment, seeded_middle_search, \
+    full_middle_search, multi_hit_middle_search
 from .misc import yellow, red, add_line_breaks_to_sequence, END_FORMATTING, RED, YELLOW
 
 
@@ -36,6 +37,9 @@ class NanoporeRead(object):
         self.middle_adapter_positions = set()
         self.middle_trim_positions = set()
         self.middle_hit_str = ''
+        self.first_middle_adapter = None
+        self.middle_alignment_count = 0
+        self.middle_alignments_skipped = 0
 
         self.start_barcode_scores = {}
         self.end_barcode_scores = {}
@@ -132,98 +136,99 @@ class NanoporeRead(object):
                                       split_read_part[1], '\n'])
             return fastq_str
 
-    def align_adapter_set(self, adapter_set, end_size, scoring_scheme_vals):
+    def align_adapter_sets(self, adapter_sets, start_panel, end_panel, end_size,
+                           scoring_scheme_vals):
         """
-        This function aligns the adapter to the reads and updates the best score for the adapter.
+        This function aligns the adapter sets to the read's ends and updates their best scores.
         This is not to determine where to trim the reads, but rather to figure out which adapter
-        sets are present in the data.
+        sets are present in the data. Only the scores are needed, so no alignments are built. The
+        start panel must hold the start sequences of the adapter sets and the end panel the end
+        sequences of those adapter sets which have one (both in order).
         """
-        read_seq_start = self.seq[:end_size]
-        score, _, _, _ = align_adapter(read_seq_start, adapter_set.start_sequence[1],
-                                       scoring_scheme_vals)
-        adapter_set.best_start_score = max(adapter_set.best_start_score, score)
-        if adapter_set.end_sequence:
-            read_seq_end = self.seq[-end_size:]
-            score, _, _, _ = align_adapter(read_seq_end, adapter_set.end_sequence[1],
-                                           scoring_scheme_vals)
-            adapter_set.best_end_score = max(adapter_set.best_end_score, score)
-
-    def find_start_trim(self, adapters, end_size, extra_trim_size, end_threshold,
-                        scoring_scheme_vals, min_trim_size, check_barcodes, forward_or_reverse):
-        """
-        Aligns one or more adapter sequences and possibly adjusts the read's start trim amount based
-        on the result.
-        """
-        read_seq_start = self.seq[:end_size]
-        for adapter in adapters:
-            full_score, partial_score, read_start, read_end = \
-                align_adapter(read_seq_start, adapter.start_sequence[1], scoring_scheme_vals)
-            if partial_score > end_threshold and read_end != end_size and \
-                    read_end - read_start >= min_trim_size:
-                trim_amount = read_end + extra_trim_size
-                self.start_trim_amount = max(self.start_trim_amount, trim_amount)
-                self.start_adapter_alignments.append((adapter, full_score, partial_score,
-                                                      read_start, read_end))
-            if check_barcodes and adapter.is_barcode() and \
-                    adapter.barcode_direction() == forward_or_reverse:
-                self.start_barcode_scores[adapter.get_barcode_name()] = full_score
-
-    def find_end_trim(self, adapters, end_size, extra_trim_size, end_threshold,
-                      scoring_scheme_vals, min_trim_size, check_barcodes, forward_or_reverse):
-        """
-        Aligns one or more adapter sequences and possibly adjusts the read's end trim amount based
-        on the result.
-        """
-        read_seq_end = self.seq[-end_size:]
-        for adapter in adapters:
-            if not adapter.end_sequence:
-                continue
-            full_score, partial_score, read_start, read_end = \
-                align_adapter(read_seq_end, adapter.end_sequence[1], scoring_scheme_vals)
-            if partial_score > end_threshold and read_start != 0 and \
-                    read_end - read_start >= min_trim_size:
-                trim_amount = (end_size - read_start) + extra_trim_size
-                self.end_trim_amount = max(self.end_trim_amount, trim_amount)
-                self.end_adapter_alignments.append((adapter, full_score, partial_score,
-                                                    read_start, read_end))
-            if check_barcodes and adapter.is_barcode() and \
-                    adapter.barcode_direction() == forward_or_reverse:
-                self.end_barcode_scores[adapter.get_barcode_name()] = full_score
+        start_scores = score_only_panel_alignment(self.seq[:end_size], start_panel,
+                                                  scoring_scheme_vals)
+        for adapter_set, score in zip(adapter_sets, start_scores):
+            adapter_set.best_start_score = max(adapter_set.best_start_score, round(score, 6))
+        end_scores = score_only_panel_alignment(self.seq[-end_size:], end_panel,
+                                                scoring_scheme_vals)
+        for adapter_set, score in zip([x for x in adapter_sets if x.end_sequence], end_scores):
+            adapter_set.best_end_score = max(adapter_set.best_end_score, round(score, 6))
 
     def find_middle_adapters(self, adapters, middle_threshold, extra_middle_trim_good_side,
                              extra_middle_trim_bad_side, scoring_scheme_vals,
-                             start_sequence_names, end_sequence_names):
+                             start_sequence_names, end_sequence_names, middle_panel,
+                             middle_index=None, first_hit_only=False, multi_hit=False):
         """
-        Aligns an adapter sequence to the whole read to find places where the read should be split.
+        Searches the whole read for the adapters (which middle_panel holds, in the same order) to
+        find places where the read should be split. Each adapter is aligned to the whole read over
+        and over, masking each hit, until its alignment falls below the threshold. Alignments which
+        can't reach the threshold are skipped by a prefilter (and counted). If multi_hit is True,
+        each adapter is instead found at all of its places in the read in one pass, and adapters
+        which occur nowhere are skipped (and counted). If a middle adapter index (of the same
+        adapters) is given, the seeded search is used instead.
+
+        When first_hit_only is True (the read will be thrown out if it has any middle adapter and
+        the hits aren't displayed), the search stops at the first hit, and only that hit's position
+        is recorded (no trim margins or hit description).
         """
         masked_seq = self.get_seq_with_start_end_adapters_trimmed()
-        for adapter_name, adapter_seq in adapters:
-
-            # We keep aligning adapters as long we get strong hits, so we can find multiple
-            # occurrences in a single read.
-            while True:
-                full_score, _, read_start, read_end = align_adapter(masked_seq, adapter_seq,
-                                                                    scoring_scheme_vals)
-                if full_score >= middle_threshold:
-                    masked_seq = masked_seq[:read_start] + '-' * (read_end - read_start) + \
-                        masked_seq[read_end:]
-                    self.middle_adapter_positions.update(range(read_start, read_end))
-
-                    self.middle_hit_str += '  ' + adapter_name + ' (read coords: ' + \
-                                           str(read_start) + '-' + str(read_end) + ', ' + \
-                                           'identity: ' + '%.1f' % full_score + '%)\n'
-
-                    trim_start = read_start - extra_middle_trim_good_side
-                    if adapter_name in start_sequence_names:
-                        trim_start = read_start - extra_middle_trim_bad_side
-
-                    trim_end = read_end + extra_middle_trim_good_side
-                    if adapter_name in end_sequence_names:
-                        trim_end = read_end + extra_middle_trim_bad_side
-
-                    self.middle_trim_positions.update(range(trim_start, trim_end))
-                else:
-                    break
+        if middle_index is not None:
+            hits = seeded_middle_search(masked_seq, middle_index, scoring_scheme_vals,
+                                        middle_threshold, first_hit_only)
+        elif multi_hit:
+            hits, skipped_count = multi_hit_middle_search(masked_seq, middle_panel,
+                                                          scoring_scheme_vals, middle_threshold,
+                                                          first_hit_only)
+            searched_count = hits[0][0] + 1 if first_hit_only and hits else len(adapters)
+            self.middle_alignment_count += searched_count
+            self.middle_alignments_skipped += skipped_count
+        else:
+            hits, skipped_count = full_middle_search(masked_seq, middle_panel,
+                                                     scoring_scheme_vals, middle_threshold,
+                                                     first_hit_only)
+
+            # Each adapter is aligned once for each of its hits, and once more for the alignment
+            # that ends its search (when the search stops at the first hit, the adapters before it
+            # were each aligned once and its adapter just once).
+            if first_hit_only and hits:
+                alignment_count = hits[0][0] + 1
+            else:
+                alignment_count = len(hits) + len(adapters)
+            self.middle_alignment_count += alignment_count
+            self.middle_alignments_skipped += skipped_count
+        if first_hit_only:
+            if hits:
+                adapter_index, read_start, read_end, _ = hits[0]
+                self.first_middle_adapter = adapters[adapter_index][0]
+                self.middle_adapter_positions.update(range(read_start, read_end))
+                self.middle_trim_positions.update(range(read_start, read_end))
+            return
+        for adapter_index, read_start, read_end, full_score in hits:
+            self.add_middle_adapter_hit(adapters[adapter_index][0], read_start, read_end,
+                                        full_score, extra_middle_trim_good_side,
+                                        extra_middle_trim_bad_side, start_sequence_names,
+                                        end_sequence_names)
+
+    def add_middle_adapter_hit(self, adapter_name, read_start, read_end, full_score,
+                               extra_middle_trim_good_side, extra_middle_trim_bad_side,
+                               start_sequence_names, end_sequence_names):
+        if self.first_middle_adapter is None:
+            self.first_middle_adapter = adapter_name
+        self.middle_adapter_positions.update(range(read_start, read_end))
+
+        self.middle_hit_str += '  ' + adapter_name + ' (read coords: ' + \
+                               str(read_start) + '-' + str(read_end) + ', ' + \
+                               'identity: ' + '%.1f' % full_score + '%)\n'
+
+        trim_start = read_start - extra_middle_trim_good_side
+        if adapter_name in start_sequence_names:
+            trim_start = read_start - extra_middle_trim_bad_side
+
+        trim_end = read_end + extra_middle_trim_good_side
+        if adapter_name in end_sequence_names:
+            trim_end = read_end + extra_middle_trim_bad_side
+
+        self.middle_trim_positions.update(range(trim_start, trim_end))
 
     def formatted_start_seq(self, end_size, extra_trim_size):
         """
@@ -456,24 +461,6 @@ class NanoporeRead(object):
             self.barcode_call = 'none'
 
 
-def align_adapter(read_seq, adapter_seq, scoring_scheme_vals):
-    alignment_result = adapter_alignment(read_seq, adapter_seq, scoring_scheme_vals)
-    result_parts = alignment_result.split(',')
-    read_start = int(result_parts[0])
-
-    # If the read start is -1, that indicates that the alignment failed completely.
-    if read_start == -1:
-        read_end = 0
-        aligned_region_percent_identity = 0.0
-        full_adapter_percent_identity = 0.0
-    else:
-        read_end = int(result_parts[1]) + 1
-        aligned_region_percent_identity = float(result_parts[5])
-        full_adapter_percent_identity = float(result_parts[6])
-
-    return full_adapter_percent_identity, aligned_region_percent_identity, read_start, read_end
-
-
 def add_number_to_read_name(read_name, number):
     if ' ' not in read_name:
         return read_name + '_' + str(number)
@@ -17,40 +17,56 @@ not, see <http://www.gnu.org/licenses/>.
 import argparse
 import os
 import sys
-import subprocess
 import multiprocessing
-import shutil
 import re
+import itertools
+import copy
 from multiprocessing.dummy import Pool as ThreadPool
-from collections import defaultdict
-from .misc import load_fasta_or_fastq, print_table, red, bold_underline, MyHelpFormatter, int_to_str
-from .adapters import ADAPTERS, make_full_native_barcode_adapter, make_full_rapid_barcode_adapter, Adapter
+from .misc import load_fasta_or_fastq, iterate_fasta_or_fastq, print_table, red, bold_underline, \
+    MyHelpFormatter, int_to_str
+from .adapters import ADAPTERS, make_full_native_barcode_adapter, make_full_rapid_barcode_adapter, \
+    make_gtg_repeat_adapter
 from .nanopore_read import NanoporeRead
+from .cpp_function_wrappers import AdapterPanel, MiddleAdapterIndex, ALIGNMENT_ENGINES, \
+    trim_read_ends
+from .read_output import ReadOutput, BarcodeBinCollector, BinQuota, LengthProfile, BinSketches
 from .version import __version__
 
 DEFTRIMRANGE=(3,200)
 
+# The number of reads per thread whose ends are trimmed in one C++ call.
+READ_END_BLOCK_SIZE = 256
+
+# The chunk size used when --chunk_size isn't given but reads must be streamed (for bin quotas).
+DEFAULT_STREAMING_CHUNK_SIZE = 1000
+
+# The k-mer size used to find seeds for the seeded middle adapter search.
+MIDDLE_SEED_KMER_SIZE = 8
+
+
 def main():
     print("Porechop mod for fingerprinting. 2017",file=sys.stderr)
     args = get_arguments()
 
-    if args.trimgtgrange != (0,0):
-        ADAPTERS_GTGs=[Adapter('GTG rep. n={}'.format(n), 
-               start_sequence=('repGTG{}'.format(n),'GTG'*n),
-               end_sequence=('repGTG{}_rev'.format(n),'CAC'*n)) 
-               for n in reversed(range(max(args.trimgtgrange[0],1),max(args.trimgtgrange[1]+1,2)))
-              ]
-        ADAPTERS.extend(ADAPTERS_GTGs)
+    # With --fingerprint, the GTG repeats are only trimmed in the second phase, which starts again
+    # from unused adapter sets.
+    adapters = get_adapter_sets((0, 0) if args.fingerprint else args.trimgtgrange)
 
-    reads, check_reads, read_type = load_reads(args.input, args.verbosity, args.print_dest,
-                                               args.check_reads)
+    if args.chunk_size:
+        reads = None
+        check_reads, read_type = load_check_reads(args.input, args.verbosity, args.print_dest,
+                                                  args.check_reads)
+    else:
+        reads, check_reads, read_type = load_reads(args.input, args.verbosity, args.print_dest,
+                                                   args.check_reads)
 
-    matching_sets = find_matching_adapter_sets(check_reads, args.verbosity, args.end_size,
-                                               args.scoring_scheme_vals, args.print_dest,
-                                               args.adapter_threshold, args.threads)
+    matching_sets = find_matching_adapter_sets(check_reads, adapters, args.verbosity,
+                                               args.end_size, args.scoring_scheme_vals,
+                                               args.print_dest, args.adapter_threshold,
+                                               args.threads)
     matching_sets = exclude_end_adapters_for_rapid(matching_sets)
     matching_sets = fix_up_1d2_sets(matching_sets)
-    display_adapter_set_results(matching_sets, args.verbosity, args.print_dest)
+    display_adapter_set_results(matching_sets, adapters, args.verbosity, args.print_dest)
     matching_sets = add_full_barcode_adapter_sets(matching_sets)
 
     if args.barcode_dir:
@@ -62,6 +78,22 @@ def main():
         print('\n', file=args.print_dest)
     
 
+    quota = None
+    if args.bin_read_quota or args.bin_base_quota:
+        quota = make_bin_quota(args, matching_sets, forward_or_reverse_barcodes)
+
+    bin_collector = None
+    if args.fingerprint:
+        bin_collector = BarcodeBinCollector(args.format, read_type, args.barcode_dir, args.input,
+                                            args.untrimmed, args.discard_unassigned, quota)
+
+    if args.chunk_size:
+        process_reads_in_chunks(args, matching_sets, forward_or_reverse_barcodes, read_type,
+                                bin_collector, quota)
+        if args.fingerprint:
+            trim_fingerprint_bins(bin_collector, args, read_type)
+        return
+
     if matching_sets:
         check_barcodes = (args.barcode_dir is not None)
         find_adapters_at_read_ends(reads, matching_sets, args.verbosity, args.end_size,
@@ -69,24 +101,77 @@ def main():
                                    args.scoring_scheme_vals, args.print_dest, args.min_trim_size,
                                    args.threads, check_barcodes, args.barcode_threshold,
                                    args.barcode_diff, args.require_two_barcodes,
-                                   forward_or_reverse_barcodes)
+                                   forward_or_reverse_barcodes, args.alignment_engine)
         display_read_end_trimming_summary(reads, args.verbosity, args.print_dest)
 
         if not args.no_split:
             find_adapters_in_read_middles(reads, matching_sets, args.verbosity,
                                           args.middle_threshold, args.extra_middle_trim_good_side,
                                           args.extra_middle_trim_bad_side, args.scoring_scheme_vals,
-                                          args.print_dest, args.threads, args.discard_middle)
+                                          args.print_dest, args.threads, args.discard_middle,
+                                          args.middle_search, args.alignment_engine)
             display_read_middle_trimming_summary(reads, args.discard_middle, args.verbosity,
-                                                 args.print_dest)
+                                                 args.print_dest, args.middle_search)
     elif args.verbosity > 0:
         print('No adapters found - output reads are unchanged from input reads\n',
               file=args.print_dest)
 
+    if args.fingerprint:
+        bin_collector.write_reads(reads)
+        bin_collector.finish()
+        reads = None
+        trim_fingerprint_bins(bin_collector, args, read_type)
+        return
+
     output_reads(reads, args.format, args.output, read_type, args.verbosity,
                  args.discard_middle, args.min_split_read_size, args.print_dest,
                  args.barcode_dir, args.input, args.untrimmed, args.threads,
-                 args.discard_unassigned)
+                 args.discard_unassigned, make_length_profile(args), make_bin_sketches(args))
+
+
+def make_length_profile(args):
+    if args.length_profile is None:
+        return None
+    return LengthProfile(args.length_profile, args.length_profile_bin_size)
+
+
+def make_bin_sketches(args):
+    if not args.sketch_size:
+        return None
+    return BinSketches(args.sketch_kmer_size, args.sketch_size)
+
+
+def make_bin_quota(args, matching_sets, forward_or_reverse_barcodes):
+    """
+    Makes the barcode bin quota. The input stops being read once the bins named by
+    --quota_barcodes are full or, by default, the bins of all barcodes found in the reads.
+    """
+    if args.quota_barcodes:
+        expected_barcodes = [x.strip() for x in args.quota_barcodes.split(',') if x.strip()]
+    else:
+        expected_barcodes = [x.get_barcode_name() for x in matching_sets
+                             if x.is_barcode() and
+                             x.barcode_direction() == forward_or_reverse_barcodes]
+    return BinQuota(args.bin_read_quota, args.bin_base_quota, expected_barcodes)
+
+
+def get_adapter_sets(trim_range):
+    """
+    Returns new copies of the known adapter sets (so none have scores yet), followed by the GTG
+    repeat adapter sets for --trimgtgrange, if it is set.
+    """
+    adapter_sets = copy.deepcopy(ADAPTERS)
+    if trim_range != (0, 0):
+        adapter_sets += get_gtg_repeat_adapters(trim_range)
+    return adapter_sets
+
+
+def get_gtg_repeat_adapters(trim_range):
+    """
+    Returns the GTG repeat adapter sets for --trimgtgrange, longest first.
+    """
+    return [make_gtg_repeat_adapter(n)
+            for n in reversed(range(max(trim_range[0], 1), max(trim_range[1] + 1, 2)))]
 
 
 def get_arguments():
@@ -117,9 +202,17 @@ def get_arguments():
                                  'a file and stderr if reads are printed to stdout')
     main_group.add_argument('-t', '--threads', type=int, default=default_threads,
                             help='Number of threads to use for adapter alignment')
+    main_group.add_argument('--chunk_size', type=int, default=0,
+                            help='Process the reads in chunks of this many reads, writing each '
+                                 'chunk before loading the next, so memory use does not grow with '
+                                 'the input size (0 = load all reads at once)')
     main_group.add_argument('--fp2ndrun', action='store_true',
                                help='Fingerprinting 2nd run: sets --trimgtgrange {}-{} (if not set) '
                                     'and --no_split options.'.format(DEFTRIMRANGE[0],DEFTRIMRANGE[1]))
+    main_group.add_argument('--fingerprint', action='store_true',
+                            help='Fingerprinting in one run: bins reads by barcode (requires '
+                                 '--barcode_dir) into temporary files in the barcode directory, '
+                                 'then trims each bin as a --fp2ndrun run on its file would')
 
     barcode_group = parser.add_argument_group('Barcode binning settings',
                                               'Control the binning of reads based on barcodes '
@@ -144,6 +237,27 @@ def get_arguments():
                                help='Bin reads but do not trim them (default: trim the reads)')
     barcode_group.add_argument('--discard_unassigned', action='store_true',
                                help='Discard unassigned reads (instead of creating a "none" bin)')
+    barcode_group.add_argument('--bin_read_quota', type=int, default=0,
+                               help='A barcode bin takes no more reads once it has this many '
+                                    '(0 = no limit)')
+    barcode_group.add_argument('--bin_base_quota', type=int, default=0,
+                               help='A barcode bin takes no more reads once it has this many '
+                                    'bases (0 = no limit)')
+    barcode_group.add_argument('--quota_barcodes',
+                               help='Comma-delimited barcode bins (e.g. BC01,BC02) which, once '
+                                    'full, stop the reading of input reads (default: the bins of '
+                                    'all barcodes found)')
+    barcode_group.add_argument('--length_profile',
+                               help='Save a histogram of the read lengths in each barcode bin to '
+                                    'this file (JSON if it ends with .json, otherwise TSV)')
+    barcode_group.add_argument('--length_profile_bin_size', type=int, default=10,
+                               help='Read lengths in the length profile are counted in ranges of '
+                                    'this many bases')
+    barcode_group.add_argument('--sketch_size', type=int, default=0,
+                               help='Save a bottom-k MinHash sketch of this many k-mer hashes '
+                                    'next to each barcode bin file (0 = no sketches)')
+    barcode_group.add_argument('--sketch_kmer_size', type=int, default=21,
+                               help='K-mer size for the barcode bin sketches (1 to 32)')
 
     def validate_trimgtg_range(s):
         try:
@@ -181,6 +295,11 @@ def get_arguments():
     end_trim_group.add_argument('--end_threshold', type=float, default=75.0,
                                 help='Adapters at the ends of reads must have at least this '
                                      'percent identity to be removed (0 to 100)')
+    end_trim_group.add_argument('--alignment_engine', choices=ALIGNMENT_ENGINES, default='simd',
+                                help='How read ends are aligned to adapters: simd = vectorised '
+                                     'alignment, seqan = SeqAn alignment, trie = alignment to a '
+                                     'trie of the adapters, sharing the work for common prefixes '
+                                     '(all give the same results)')
 
     middle_trim_group = parser.add_argument_group('Middle adapter settings',
                                                   'Control the splitting of read from middle '
@@ -206,6 +325,15 @@ def get_arguments():
     middle_trim_group.add_argument('--min_split_read_size', type=int, default=1000,
                                    help='Post-split read pieces smaller than this many base pairs '
                                         'will not be outputted')
+    middle_trim_group.add_argument('--middle_search', choices=['full', 'multi_hit', 'seeded'],
+                                   default='full',
+                                   help='How reads are searched for middle adapters: full = align '
+                                        'each adapter to the whole read, once per hit, multi_hit = '
+                                        'find all of an adapter\'s hits in one pass (faster, but '
+                                        'can find more hits and place some a base differently), '
+                                        'seeded = only align adapters near k-mers they share with '
+                                        'the read (faster for long reads, but can miss adapters '
+                                        'with many errors)')
 
     help_args = parser.add_argument_group('Help')
     help_args.add_argument('-h', '--help', action='help', default=argparse.SUPPRESS,
@@ -229,6 +357,15 @@ def get_arguments():
         sys.exit('Error: incorrectly formatted scoring scheme')
     args.scoring_scheme_vals = scoring_scheme
 
+    if args.fingerprint:
+        if args.fp2ndrun:
+            sys.exit('Error: only one of the following options may be used: --fp2ndrun, '
+                     '--fingerprint')
+        if args.barcode_dir is None:
+            sys.exit('Error: --fingerprint can only be used with --barcode_dir')
+        if args.trimgtgrange == (0,0):
+            args.trimgtgrange = DEFTRIMRANGE
+
     if args.barcode_dir is not None and args.output is not None:
         sys.exit('Error: only one of the following options may be used: --output, --barcode_dir')
 
@@ -246,6 +383,34 @@ def get_arguments():
     if args.threads < 1:
         sys.exit('Error: at least one thread required')
 
+    if args.chunk_size < 0:
+        sys.exit('Error: --chunk_size cannot be negative')
+
+    if args.length_profile is not None and args.barcode_dir is None:
+        sys.exit('Error: --length_profile can only be used with --barcode_dir')
+    if args.length_profile_bin_size < 1:
+        sys.exit('Error: --length_profile_bin_size must be at least 1')
+
+    if args.sketch_size < 0:
+        sys.exit('Error: --sketch_size cannot be negative')
+    if args.sketch_size and args.barcode_dir is None:
+        sys.exit('Error: --sketch_size can only be used with --barcode_dir')
+    if not 1 <= args.sketch_kmer_size <= 32:
+        sys.exit('Error: --sketch_kmer_size must be from 1 to 32')
+
+    if args.bin_read_quota < 0 or args.bin_base_quota < 0:
+        sys.exit('Error: bin quotas cannot be negative')
+    if args.bin_read_quota or args.bin_base_quota:
+        if args.barcode_dir is None:
+            sys.exit('Error: bin quotas can only be used with --barcode_dir')
+
+        # The reads are streamed in chunks, so the input can stop being read when the bins are
+        # full.
+        if not args.chunk_size:
+            args.chunk_size = DEFAULT_STREAMING_CHUNK_SIZE
+    elif args.quota_barcodes:
+        sys.exit('Error: --quota_barcodes requires --bin_read_quota or --bin_base_quota')
+
     return args
 
 
@@ -258,10 +423,7 @@ def load_reads(input_file_or_directory, verbosity, print_dest, check_read_count)
             print('\n' + bold_underline('Loading reads'), flush=True, file=print_dest)
             print(input_file_or_directory, flush=True, file=print_dest)
         reads, read_type = load_fasta_or_fastq(input_file_or_directory)
-        if read_type == 'FASTA':
-            reads = [NanoporeRead(x[2], x[1], '') for x in reads]
-        else:  # FASTQ
-            reads = [NanoporeRead(x[4], x[1], x[3]) for x in reads]
+        reads = [make_nanopore_read(x, read_type) for x in reads]
         check_reads = reads[:check_read_count]
 
     # If the input is a directory, assume it's an Albacore directory and search it recursively for
@@ -269,12 +431,7 @@ def load_reads(input_file_or_directory, verbosity, print_dest, check_read_count)
     elif os.path.isdir(input_file_or_directory):
         if verbosity > 0:
             print('\n' + bold_underline('Searching for FASTQ files'), flush=True, file=print_dest)
-        fastqs = sorted([os.path.join(dir_path, f)
-                         for dir_path, _, filenames in os.walk(input_file_or_directory)
-                         for f in filenames
-                         if f.lower().endswith('.fastq') or f.lower().endswith('.fastq.gz')])
-        if not fastqs:
-            sys.exit('Error: could not find fastq files in ' + input_file_or_directory)
+        fastqs = find_fastq_files(input_file_or_directory)
         reads = []
         read_type = 'FASTQ'
         check_reads = []
@@ -283,7 +440,7 @@ def load_reads(input_file_or_directory, verbosity, print_dest, check_read_count)
             if verbosity > 0:
                 print(fastq_file, flush=True, file=print_dest)
             file_reads, _ = load_fasta_or_fastq(fastq_file)
-            file_reads = [NanoporeRead(x[4], x[1], x[3]) for x in file_reads]
+            file_reads = [make_nanopore_read(x, 'FASTQ') for x in file_reads]
 
             albacore_barcode = get_albacore_barcode_from_path(fastq_file)
             for read in file_reads:
@@ -301,6 +458,91 @@ def load_reads(input_file_or_directory, verbosity, print_dest, check_read_count)
     return reads, check_reads, read_type
 
 
+def load_check_reads(input_file_or_directory, verbosity, print_dest, check_read_count):
+    """
+    Used in chunked mode: loads only the reads needed for adapter set discovery (the same reads
+    that load_reads would have chosen). The input will be read again from the start when the
+    reads are processed.
+    """
+    if os.path.isfile(input_file_or_directory):
+        if verbosity > 0:
+            print('\n' + bold_underline('Loading check reads'), flush=True, file=print_dest)
+            print(input_file_or_directory, flush=True, file=print_dest)
+        records, read_type = iterate_fasta_or_fastq(input_file_or_directory)
+        check_reads = [make_nanopore_read(x, read_type)
+                       for x in itertools.islice(records, check_read_count)]
+        records.close()
+    elif os.path.isdir(input_file_or_directory):
+        if verbosity > 0:
+            print('\n' + bold_underline('Searching for FASTQ files'), flush=True, file=print_dest)
+        fastqs = find_fastq_files(input_file_or_directory)
+        read_type = 'FASTQ'
+        check_reads = []
+        check_reads_per_file = int(round(check_read_count / len(fastqs)))
+        for fastq_file in fastqs:
+            if verbosity > 0:
+                print(fastq_file, flush=True, file=print_dest)
+            records, _ = iterate_fasta_or_fastq(fastq_file)
+            check_reads += [make_nanopore_read(x, 'FASTQ')
+                            for x in itertools.islice(records, check_reads_per_file)]
+            records.close()
+        if verbosity > 0:
+            print('', flush=True, file=print_dest)
+    else:
+        sys.exit('Error: could not find ' + input_file_or_directory)
+
+    if verbosity > 0:
+        print(int_to_str(len(check_reads)) + ' check reads loaded\n\n', flush=True,
+              file=print_dest)
+    return check_reads, read_type
+
+
+def iterate_read_chunks(input_file_or_directory, chunk_size):
+    """
+    Yields the input reads in lists of (at most) chunk_size reads.
+    """
+    chunk = []
+    for read in iterate_reads(input_file_or_directory):
+        chunk.append(read)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def iterate_reads(input_file_or_directory):
+    if os.path.isfile(input_file_or_directory):
+        records, read_type = iterate_fasta_or_fastq(input_file_or_directory)
+        for record in records:
+            yield make_nanopore_read(record, read_type)
+    else:
+        for fastq_file in find_fastq_files(input_file_or_directory):
+            albacore_barcode = get_albacore_barcode_from_path(fastq_file)
+            records, _ = iterate_fasta_or_fastq(fastq_file)
+            for record in records:
+                read = make_nanopore_read(record, 'FASTQ')
+                read.albacore_barcode_call = albacore_barcode
+                yield read
+
+
+def make_nanopore_read(record, read_type):
+    if read_type == 'FASTA':
+        return NanoporeRead(record[2], record[1], '')
+    else:  # FASTQ
+        return NanoporeRead(record[4], record[1], record[3])
+
+
+def find_fastq_files(directory):
+    fastqs = sorted([os.path.join(dir_path, f)
+                     for dir_path, _, filenames in os.walk(directory)
+                     for f in filenames
+                     if f.lower().endswith('.fastq') or f.lower().endswith('.fastq.gz')])
+    if not fastqs:
+        sys.exit('Error: could not find fastq files in ' + directory)
+    return fastqs
+
+
 def get_albacore_barcode_from_path(albacore_path):
     if '/unclassified/' in albacore_path:
         return 'none'
@@ -311,43 +553,43 @@ def get_albacore_barcode_from_path(albacore_path):
     return None
 
 
-def find_matching_adapter_sets(check_reads, verbosity, end_size, scoring_scheme_vals, print_dest,
-                               adapter_threshold, threads):
+def find_matching_adapter_sets(check_reads, adapters, verbosity, end_size, scoring_scheme_vals,
+                               print_dest, adapter_threshold, threads):
     """
-    Aligns all of the adapter sets to the start/end of reads to see which (if any) matches best.
+    Aligns all of the given adapter sets to the start/end of reads to see which (if any) matches
+    best.
     """
     read_count = len(check_reads)
     if verbosity > 0:
         print(bold_underline('Looking for known adapter sets'), flush=True, file=print_dest)
         output_progress_line(0, read_count, print_dest)
 
-    search_adapters = [a for a in ADAPTERS if '(full sequence)' not in a.name]
-    search_adapter_count = len(search_adapters)
+    search_adapters = [a for a in adapters if '(full sequence)' not in a.name]
+    adapter_sets, repeat_sets, panels = make_partitioned_adapter_panels(search_adapters)
+
+    def align_adapter_sets(r):
+        r.align_adapter_sets(adapter_sets, panels[0], panels[1], end_size, scoring_scheme_vals)
+        if repeat_sets:
+            r.align_adapter_sets(repeat_sets, panels[2], panels[3], end_size,
+                                 scoring_scheme_vals)
 
     # If single-threaded, do the work in a simple loop.
     if threads == 1:
         for read_num, read in enumerate(check_reads):
-            for adapter_set in search_adapters:
-                read.align_adapter_set(adapter_set, end_size, scoring_scheme_vals)
+            align_adapter_sets(read)
             if verbosity > 0:
                 output_progress_line(read_num+1, read_count, print_dest)
 
     # If multi-threaded, use a thread pool.
     else:
-        def align_adapter_set_one_arg(all_args):
-            r, a, b, c = all_args
-            r.align_adapter_set(a, b, c)
+        def align_adapter_sets_one_arg(r):
+            align_adapter_sets(r)
         with ThreadPool(threads) as pool:
-            arg_list = []
-            for read in check_reads:
-                for adapter_set in search_adapters:
-                    arg_list.append((read, adapter_set, end_size, scoring_scheme_vals))
             finished_count = 0
-            for _ in pool.imap(align_adapter_set_one_arg, arg_list):
+            for _ in pool.imap(align_adapter_sets_one_arg, check_reads):
                 finished_count += 1
-                if verbosity > 0 and finished_count % search_adapter_count == 0:
-                    output_progress_line(finished_count // search_adapter_count,
-                                         read_count, print_dest)
+                if verbosity > 0:
+                    output_progress_line(finished_count, read_count, print_dest)
 
     if verbosity > 0:
         output_progress_line(read_count, read_count, print_dest, end_newline=True)
@@ -355,6 +597,32 @@ def find_matching_adapter_sets(check_reads, verbosity, end_size, scoring_scheme_
     return [x for x in search_adapters if x.best_start_or_end_score() >= adapter_threshold]
 
 
+def make_adapter_panels(adapter_sets, alignment_engine='simd'):
+    """
+    Returns a panel of the adapter sets' start sequences and a panel of their end sequences (for
+    those which have one), so each read end can be aligned to all of them in one C++ call.
+    """
+    start_panel = AdapterPanel([x.start_sequence[1] for x in adapter_sets], alignment_engine)
+    end_panel = AdapterPanel([x.end_sequence[1] for x in adapter_sets if x.end_sequence],
+                             alignment_engine)
+    return start_panel, end_panel
+
+
+def make_partitioned_adapter_panels(adapter_sets, alignment_engine='simd'):
+    """
+    Splits the adapter sets into the GTG repeats (from --trimgtgrange) and the rest, and makes
+    panels for each: (start panel, end panel) for the rest using the given engine, then the same
+    for the repeats. The repeats are each a prefix of the longest one, so their panels always use
+    the trie engine, which aligns a read end to all of them in a single pass, sharing the DP for
+    the common prefix. There can be hundreds of repeats, so this is much faster than aligning each.
+    """
+    repeat_sets = [x for x in adapter_sets if x.is_repeat()]
+    adapter_sets = [x for x in adapter_sets if not x.is_repeat()]
+    panels = make_adapter_panels(adapter_sets, alignment_engine) + \
+        make_adapter_panels(repeat_sets, 'trie')
+    return adapter_sets, repeat_sets, panels
+
+
 def choose_barcoding_kit(adapter_sets, verbosity, print_dest):
     """
     If the user is sorting reads by barcode bin, choose one barcode configuration (rev comp
@@ -410,13 +678,13 @@ def fix_up_1d2_sets(matching_sets):
     return matching_sets
 
 
-def display_adapter_set_results(matching_sets, verbosity, print_dest):
+def display_adapter_set_results(matching_sets, adapters, verbosity, print_dest):
     if verbosity < 1:
         return
     table = [['Set', 'Best read start %ID', 'Best read end %ID']]
     row_colours = {}
     matching_set_names = [x.name for x in matching_sets]
-    search_adapters = [a for a in ADAPTERS if '(full sequence)' not in a.name]
+    search_adapters = [a for a in adapters if '(full sequence)' not in a.name]
     for adapter_set in search_adapters:
         start_score = '%.1f' % adapter_set.best_start_score
         end_score = '%.1f' % adapter_set.best_end_score
@@ -455,102 +723,161 @@ def add_full_barcode_adapter_sets(matching_sets):
 def find_adapters_at_read_ends(reads, matching_sets, verbosity, end_size, extra_trim_size,
                                end_threshold, scoring_scheme_vals, print_dest, min_trim_size,
                                threads, check_barcodes, barcode_threshold, barcode_diff,
-                               require_two_barcodes, forward_or_reverse_barcodes):
-    if verbosity > 0:
-        print(bold_underline('Trimming adapters from read ends'),
-              file=print_dest)
-        name_len = max(max(len(x.start_sequence[0]) for x in matching_sets),
-                       max(len(x.end_sequence[0]) if x.end_sequence else 0 for x in matching_sets))
-        for matching_set in matching_sets:
-            print('  ' + matching_set.start_sequence[0].rjust(name_len) + ': ' +
-                  red(matching_set.start_sequence[1]), file=print_dest)
-            if matching_set.end_sequence:
-                print('  ' + matching_set.end_sequence[0].rjust(name_len) + ': ' +
-                      red(matching_set.end_sequence[1]), file=print_dest)
-        print('', file=print_dest)
-
+                               require_two_barcodes, forward_or_reverse_barcodes,
+                               alignment_engine='simd', in_chunks=False):
+    """
+    Trims adapters from the start and end of each read. When in_chunks is True, this is being
+    called for one chunk of a larger read set, so the header and progress lines are left to the
+    caller.
+    """
+    if verbosity > 0 and not in_chunks:
+        display_read_end_adapters(matching_sets, print_dest)
+    if in_chunks and verbosity == 1:
+        verbosity = 0
+
+    # The GTG repeats are trimmed with their own (trie engine) panels. The hits from both sets of
+    # panels are put back in the order of matching_sets, as if they had all been in one panel.
+    adapter_sets, repeat_sets, panels = make_partitioned_adapter_panels(matching_sets,
+                                                                        alignment_engine)
+    start_panel, end_panel, repeat_start_panel, repeat_end_panel = panels
+    end_adapters = [x for x in matching_sets if x.end_sequence]
+    end_sets = [x for x in adapter_sets if x.end_sequence]
+    repeat_end_sets = [x for x in repeat_sets if x.end_sequence]
+    start_order = {id(x): i for i, x in enumerate(matching_sets)}
+    end_order = {id(x): i for i, x in enumerate(end_adapters)}
+    start_barcodes, end_barcodes = [], []
+    if check_barcodes:
+        def is_barcode(adapter):
+            return adapter.is_barcode() and \
+                adapter.barcode_direction() == forward_or_reverse_barcodes
+        start_barcodes = [(i, x.get_barcode_name()) for i, x in enumerate(adapter_sets)
+                          if is_barcode(x)]
+        end_barcodes = [(i, x.get_barcode_name()) for i, x in enumerate(end_sets)
+                        if is_barcode(x)]
     read_count = len(reads)
     if verbosity == 1:
         output_progress_line(0, read_count, print_dest)
 
-    # If single-threaded, do the work in a simple loop.
-    if threads == 1:
-        for read_num, read in enumerate(reads):
-            read.find_start_trim(matching_sets, end_size, extra_trim_size, end_threshold,
-                                 scoring_scheme_vals, min_trim_size, check_barcodes,
-                                 forward_or_reverse_barcodes)
-            read.find_end_trim(matching_sets, end_size, extra_trim_size, end_threshold,
-                               scoring_scheme_vals, min_trim_size, check_barcodes,
-                               forward_or_reverse_barcodes)
+    # Reads are trimmed in blocks, each with one C++ call which does all of the aligning and
+    # trimming decisions, sharing the block's reads among its own threads. The blocks are only so
+    # the progress line and verbose output can be updated along the way.
+    block_size = READ_END_BLOCK_SIZE * threads
+    for block_start in range(0, read_count, block_size):
+        block = reads[block_start:block_start + block_size]
+        block_seqs = [r.seq for r in block]
+        trims, start_hits, end_hits, start_identities, end_identities = \
+            trim_read_ends(block_seqs, start_panel, end_panel, end_size, extra_trim_size,
+                           end_threshold, min_trim_size, scoring_scheme_vals, threads,
+                           bool(start_barcodes or end_barcodes))
+        start_hits = [(r, adapter_sets[i], *hit) for r, i, *hit in start_hits]
+        end_hits = [(r, end_sets[i], *hit) for r, i, *hit in end_hits]
+        if repeat_sets:
+            repeat_trims, repeat_start_hits, repeat_end_hits, _, _ = \
+                trim_read_ends(block_seqs, repeat_start_panel, repeat_end_panel, end_size,
+                               extra_trim_size, end_threshold, min_trim_size,
+                               scoring_scheme_vals, threads)
+            trims = [(max(a[0], b[0]), max(a[1], b[1])) for a, b in zip(trims, repeat_trims)]
+            start_hits += [(r, repeat_sets[i], *hit) for r, i, *hit in repeat_start_hits]
+            end_hits += [(r, repeat_end_sets[i], *hit) for r, i, *hit in repeat_end_hits]
+            start_hits.sort(key=lambda x: (x[0], start_order[id(x[1])]))
+            end_hits.sort(key=lambda x: (x[0], end_order[id(x[1])]))
+
+        # The hits are stored in each read as (adapter, full score, partial score, read start,
+        # read end), with identities rounded to six decimal places.
+        for read, trim in zip(block, trims):
+            read.start_trim_amount, read.end_trim_amount = trim
+        for r, adapter, read_start, read_end, full_score, partial_score in start_hits:
+            block[r].start_adapter_alignments.append((adapter, round(full_score, 6),
+                                                      round(partial_score, 6), read_start,
+                                                      read_end))
+        for r, adapter, read_start, read_end, full_score, partial_score in end_hits:
+            block[r].end_adapter_alignments.append((adapter, round(full_score, 6),
+                                                    round(partial_score, 6), read_start,
+                                                    read_end))
+        for r, read in enumerate(block):
+            for i, barcode_name in start_barcodes:
+                read.start_barcode_scores[barcode_name] = \
+                    round(start_identities[r * start_panel.size + i], 6)
+            for i, barcode_name in end_barcodes:
+                read.end_barcode_scores[barcode_name] = \
+                    round(end_identities[r * end_panel.size + i], 6)
             if check_barcodes:
                 read.determine_barcode(barcode_threshold, barcode_diff, require_two_barcodes)
-            if verbosity == 1:
-                output_progress_line(read_num+1, read_count, print_dest)
-            elif verbosity == 2:
+            if verbosity == 2:
                 print(read.formatted_start_and_end_seq(end_size, extra_trim_size, check_barcodes),
-                      file=print_dest)
+                      file=print_dest, flush=True)
             elif verbosity > 2:
                 print(read.full_start_end_output(end_size, extra_trim_size, check_barcodes),
-                      file=print_dest)
-
-    # If multi-threaded, use a thread pool.
-    else:
-        def start_end_trim_one_arg(all_args):
-            r, a, b, c, d, e, f, g, h, i, j, k, v = all_args
-            r.find_start_trim(a, b, c, d, e, f, g, k)
-            r.find_end_trim(a, b, c, d, e, f, g, k)
-            if check_barcodes:
-                r.determine_barcode(h, i, j)
-            if v == 2:
-                return r.formatted_start_and_end_seq(b, c, g)
-            if v > 2:
-                return r.full_start_end_output(b, c, g)
-            else:
-                return ''
-        with ThreadPool(threads) as pool:
-            arg_list = []
-            for read in reads:
-                arg_list.append((read, matching_sets, end_size, extra_trim_size, end_threshold,
-                                 scoring_scheme_vals, min_trim_size, check_barcodes,
-                                 barcode_threshold, barcode_diff, require_two_barcodes,
-                                 forward_or_reverse_barcodes, verbosity))
-            finished_count = 0
-            for out in pool.imap(start_end_trim_one_arg, arg_list):
-                finished_count += 1
-                if verbosity == 1:
-                    output_progress_line(finished_count, read_count, print_dest)
-                elif verbosity > 1:
-                    print(out, file=print_dest, flush=True)
+                      file=print_dest, flush=True)
+        if verbosity == 1:
+            output_progress_line(block_start + len(block), read_count, print_dest, step=1)
 
     if verbosity == 1:
         output_progress_line(read_count, read_count, print_dest, end_newline=True)
-    if verbosity > 0:
+    if verbosity > 0 and not in_chunks:
         print('', file=print_dest)
 
 
-def display_read_end_trimming_summary(reads, verbosity, print_dest):
+def display_read_end_adapters(matching_sets, print_dest):
+    print(bold_underline('Trimming adapters from read ends'),
+          file=print_dest)
+    name_len = max(max(len(x.start_sequence[0]) for x in matching_sets),
+                   max(len(x.end_sequence[0]) if x.end_sequence else 0 for x in matching_sets))
+    for matching_set in matching_sets:
+        print('  ' + matching_set.start_sequence[0].rjust(name_len) + ': ' +
+              red(matching_set.start_sequence[1]), file=print_dest)
+        if matching_set.end_sequence:
+            print('  ' + matching_set.end_sequence[0].rjust(name_len) + ': ' +
+                  red(matching_set.end_sequence[1]), file=print_dest)
+    print('', file=print_dest)
+
+
+def get_read_end_trimming_counts(reads):
+    """
+    Returns [read count, start trim count, start bp trimmed, end trim count, end bp trimmed].
+    """
+    return [len(reads),
+            sum(1 if x.start_trim_amount else 0 for x in reads),
+            sum(x.start_trim_amount for x in reads),
+            sum(1 if x.end_trim_amount else 0 for x in reads),
+            sum(x.end_trim_amount for x in reads)]
+
+
+def display_read_end_trimming_summary(reads, verbosity, print_dest, counts=None):
     if verbosity < 1:
         return
-    start_trim_total = sum(x.start_trim_amount for x in reads)
-    start_trim_count = sum(1 if x.start_trim_amount else 0 for x in reads)
-    end_trim_count = sum(1 if x.end_trim_amount else 0 for x in reads)
-    end_trim_total = sum(x.end_trim_amount for x in reads)
-    print(int_to_str(start_trim_count).rjust(len(int_to_str(len(reads)))) + ' / ' +
-          int_to_str(len(reads)) + ' reads had adapters trimmed from their start (' +
+    if counts is None:
+        counts = get_read_end_trimming_counts(reads)
+    read_count, start_trim_count, start_trim_total, end_trim_count, end_trim_total = counts
+    print(int_to_str(start_trim_count).rjust(len(int_to_str(read_count))) + ' / ' +
+          int_to_str(read_count) + ' reads had adapters trimmed from their start (' +
           int_to_str(start_trim_total) + ' bp removed)', file=print_dest)
-    print(int_to_str(end_trim_count).rjust(len(int_to_str(len(reads)))) + ' / ' +
-          int_to_str(len(reads)) + ' reads had adapters trimmed from their end (' +
+    print(int_to_str(end_trim_count).rjust(len(int_to_str(read_count))) + ' / ' +
+          int_to_str(read_count) + ' reads had adapters trimmed from their end (' +
           int_to_str(end_trim_total) + ' bp removed)', file=print_dest)
     print('\n', file=print_dest)
 
 
 def find_adapters_in_read_middles(reads, matching_sets, verbosity, middle_threshold,
                                   extra_trim_good_side, extra_trim_bad_side, scoring_scheme_vals,
-                                  print_dest, threads, discard_middle):
-    if verbosity > 0:
-        verb = 'Discarding' if discard_middle else 'Splitting'
-        print(bold_underline(verb + ' reads containing middle adapters'),
-              file=print_dest)
+                                  print_dest, threads, discard_middle, middle_search='full',
+                                  alignment_engine='simd', in_chunks=False,
+                                  middle_hit_counts=None):
+    """
+    Searches each whole read for adapters, marking where it should be split. When in_chunks is
+    True, this is being called for one chunk of a larger read set, so the header and progress lines
+    are left to the caller. With the seeded middle search, adapters are only aligned near k-mers
+    they share with the read.
+
+    When discarding reads with middle adapters, each read's search stops at its first hit, so the
+    adapters are tried most frequent first. middle_hit_counts (adapter name to the number of reads
+    it was found in the middle of) carries this over from earlier chunks and is updated here. At
+    verbosity 2 and up, every hit is still found, so each read's hits can be displayed.
+    """
+    if verbosity > 0 and not in_chunks:
+        display_read_middle_header(discard_middle, print_dest)
+    if in_chunks and verbosity == 1:
+        verbosity = 0
 
     adapters = []
     for matching_set in matching_sets:
@@ -566,6 +893,20 @@ def find_adapters_in_read_middles(reads, matching_sets, verbosity, middle_thresh
         if matching_set.end_sequence:
             end_sequence_names.add(matching_set.end_sequence[0])
 
+    if middle_hit_counts is None:
+        middle_hit_counts = {}
+    first_hit_only = discard_middle and verbosity < 2
+    if first_hit_only:
+        adapters = order_adapters_by_frequency(adapters, reads, middle_hit_counts)
+
+    middle_panel = AdapterPanel([x[1] for x in adapters], alignment_engine)
+    if middle_search == 'seeded':
+        middle_index = MiddleAdapterIndex([x[1] for x in adapters], MIDDLE_SEED_KMER_SIZE,
+                                          alignment_engine)
+    else:
+        middle_index = None
+    multi_hit = (middle_search == 'multi_hit')
+
     read_count = len(reads)
     if verbosity == 1:
         output_progress_line(0, read_count, print_dest)
@@ -575,7 +916,8 @@ def find_adapters_in_read_middles(reads, matching_sets, verbosity, middle_thresh
         for read_num, read in enumerate(reads):
             read.find_middle_adapters(adapters, middle_threshold, extra_trim_good_side,
                                       extra_trim_bad_side, scoring_scheme_vals,
-                                      start_sequence_names, end_sequence_names)
+                                      start_sequence_names, end_sequence_names, middle_panel,
+                                      middle_index, first_hit_only, multi_hit)
             if verbosity == 1:
                 output_progress_line(read_num+1, read_count, print_dest)
             if read.middle_adapter_positions and verbosity > 1:
@@ -585,7 +927,8 @@ def find_adapters_in_read_middles(reads, matching_sets, verbosity, middle_thresh
     else:
         def find_middle_adapters_one_arg(all_args):
             r, a, b, c, d, e, f, g, v = all_args
-            r.find_middle_adapters(a, b, c, d, e, f, g)
+            r.find_middle_adapters(a, b, c, d, e, f, g, middle_panel, middle_index,
+                                   first_hit_only, multi_hit)
             return r.middle_adapter_results(v)
         with ThreadPool(threads) as pool:
             arg_list = []
@@ -601,148 +944,219 @@ def find_adapters_in_read_middles(reads, matching_sets, verbosity, middle_thresh
                 if verbosity > 1 and out:
                     print(out, file=print_dest, flush=True)
 
+    for read in reads:
+        if read.first_middle_adapter is not None:
+            middle_hit_counts[read.first_middle_adapter] = \
+                middle_hit_counts.get(read.first_middle_adapter, 0) + 1
+
     if verbosity == 1:
         output_progress_line(read_count, read_count, print_dest, end_newline=True)
         print('', flush=True, file=print_dest)
 
 
-def display_read_middle_trimming_summary(reads, discard_middle, verbosity, print_dest):
+def order_adapters_by_frequency(adapters, reads, middle_hit_counts):
+    """
+    Sorts the middle adapters (name, sequence) so those seen most often come first: first by how
+    many reads they were found in the middle of (in earlier chunks), then by how many of these
+    reads had them trimmed from their ends. Ties keep their original order.
+    """
+    end_hit_counts = {}
+    for read in reads:
+        for adapter_set in [x[0] for x in read.start_adapter_alignments]:
+            name = adapter_set.start_sequence[0]
+            end_hit_counts[name] = end_hit_counts.get(name, 0) + 1
+        for adapter_set in [x[0] for x in read.end_adapter_alignments]:
+            name = adapter_set.end_sequence[0]
+            end_hit_counts[name] = end_hit_counts.get(name, 0) + 1
+    return sorted(adapters, key=lambda x: (-middle_hit_counts.get(x[0], 0),
+                                           -end_hit_counts.get(x[0], 0)))
+
+
+def display_read_middle_header(discard_middle, print_dest):
+    verb = 'Discarding' if discard_middle else 'Splitting'
+    print(bold_underline(verb + ' reads containing middle adapters'),
+          file=print_dest)
+
+
+def get_read_middle_trimming_counts(reads):
+    """
+    Returns [read count, middle adapter count, adapter alignment count, skipped alignment count].
+    """
+    return [len(reads), sum(1 if x.middle_adapter_positions else 0 for x in reads),
+            sum(x.middle_alignment_count for x in reads),
+            sum(x.middle_alignments_skipped for x in reads)]
+
+
+def display_read_middle_trimming_summary(reads, discard_middle, verbosity, print_dest,
+                                         middle_search='full', counts=None):
+    """
+    The full middle search counts adapter alignments and those skipped by the prefilter. The
+    multi-hit search counts adapters searched for and those which occur nowhere in the read.
+    """
     if verbosity < 1:
         return
-    middle_trim_count = sum(1 if x.middle_adapter_positions else 0 for x in reads)
+    if counts is None:
+        counts = get_read_middle_trimming_counts(reads)
+    read_count, middle_trim_count, alignment_count, skipped_count = counts
     verb = 'discarded' if discard_middle else 'split'
-    print(int_to_str(middle_trim_count) + ' / ' + int_to_str(len(reads)) + ' reads were ' + verb +
-          ' based on middle adapters\n\n', file=print_dest)
+    print(int_to_str(middle_trim_count) + ' / ' + int_to_str(read_count) + ' reads were ' + verb +
+          ' based on middle adapters', file=print_dest)
+    if alignment_count > 0:
+        skip_percent = '%.1f' % (100.0 * skipped_count / alignment_count)
+        if middle_search == 'multi_hit':
+            print(int_to_str(skipped_count) + ' / ' + int_to_str(alignment_count) + ' adapter '
+                  'searches (' + skip_percent + '%) found no occurrence in the read',
+                  file=print_dest)
+        else:
+            print(int_to_str(skipped_count) + ' / ' + int_to_str(alignment_count) + ' adapter '
+                  'alignments (' + skip_percent + '%) were skipped by the prefilter',
+                  file=print_dest)
+    print('\n', file=print_dest)
 
 
 def output_reads(reads, out_format, output, read_type, verbosity, discard_middle,
                  min_split_size, print_dest, barcode_dir, input_filename,
-                 untrimmed, threads, discard_unassigned):
-    if verbosity > 0:
-        trimmed_or_untrimmed = 'untrimmed' if untrimmed else 'trimmed'
-        if barcode_dir is not None:
-            verb = 'Saving '
-            destination = 'barcode-specific files'
-        elif output is None:
-            verb = 'Outputting '
-            destination = 'stdout'
-        else:
-            verb = 'Saving '
-            destination = 'file'
-        print(bold_underline(verb + trimmed_or_untrimmed + ' reads to ' + destination),
-              flush=True, file=print_dest)
-
-    if out_format == 'auto':
-        if output is None:
-            out_format = read_type.lower()
-            if barcode_dir is not None and input_filename.lower().endswith('.gz'):
-                out_format += '.gz'
-        elif '.fasta.gz' in output.lower():
-            out_format = 'fasta.gz'
-        elif '.fastq.gz' in output.lower():
-            out_format = 'fastq.gz'
-        elif '.fasta' in output.lower():
-            out_format = 'fasta'
-        elif '.fastq' in output.lower():
-            out_format = 'fastq'
-        else:
-            out_format = read_type.lower()
-
-    gzipped_out = False
-    gzip_command = 'gzip'
-    if out_format.endswith('.gz') and (barcode_dir is not None or output is not None):
-        gzipped_out = True
-        out_format = out_format[:-3]
-        if shutil.which('pigz'):
-            if verbosity > 0:
-                print('pigz found - using it to compress instead of gzip')
-            gzip_command = 'pigz -p ' + str(threads)
+                 untrimmed, threads, discard_unassigned, length_profile=None, sketches=None):
+    read_output = ReadOutput(out_format, output, read_type, verbosity, discard_middle,
+                             min_split_size, print_dest, barcode_dir, input_filename, untrimmed,
+                             threads, discard_unassigned, length_profile=length_profile,
+                             sketches=sketches)
+    read_output.display_header()
+    read_output.write_reads(reads)
+    read_output.finish()
+
+
+def process_reads_in_chunks(args, matching_sets, forward_or_reverse_barcodes, read_type,
+                            read_output=None, quota=None):
+    """
+    Loads, trims and writes the reads one chunk at a time, so peak memory depends on the chunk
+    size, not the input size. The results are the same as processing all reads at once. The reads
+    can be given to another read output (e.g. a BarcodeBinCollector) instead of being written.
+    With a bin quota, no more chunks are loaded once the expected bins are full.
+    """
+    if read_output is None:
+        read_output = ReadOutput(args.format, args.output, read_type, args.verbosity,
+                                 args.discard_middle, args.min_split_read_size, args.print_dest,
+                                 args.barcode_dir, args.input, args.untrimmed, args.threads,
+                                 args.discard_unassigned, quota, make_length_profile(args),
+                                 make_bin_sketches(args))
+    check_barcodes = (args.barcode_dir is not None)
+    split_reads = matching_sets and not args.no_split
+
+    if args.verbosity > 0:
+        if matching_sets:
+            display_read_end_adapters(matching_sets, args.print_dest)
         else:
-            if verbosity > 0:
-                print('pigz not found - using gzip to compress')
-
-    # Output reads to barcode bins.
-    if barcode_dir is not None:
-        if not os.path.isdir(barcode_dir):
-            os.makedirs(barcode_dir)
-        barcode_files = {}
-        barcode_read_counts, barcode_base_counts = defaultdict(int), defaultdict(int)
-        for read in reads:
-            barcode_name = read.barcode_call
-            if discard_unassigned and barcode_name == 'none':
-                continue
-            if out_format == 'fasta':
-                read_str = read.get_fasta(min_split_size, discard_middle, untrimmed)
-            else:
-                read_str = read.get_fastq(min_split_size, discard_middle, untrimmed)
-            if not read_str:
-                continue
-            if barcode_name not in barcode_files:
-                barcode_files[barcode_name] = \
-                    open(os.path.join(barcode_dir, barcode_name + '.' + out_format), 'wt')
-            barcode_files[barcode_name].write(read_str)
-            barcode_read_counts[barcode_name] += 1
-            if untrimmed:
-                seq_length = len(read.seq)
-            else:
-                seq_length = read.seq_length_with_start_end_adapters_trimmed()
-            barcode_base_counts[barcode_name] += seq_length
-        table = [['Barcode', 'Reads', 'Bases', 'File']]
-
-        for barcode_name in sorted(barcode_files.keys()):
-            barcode_files[barcode_name].close()
-            bin_filename = os.path.join(barcode_dir, barcode_name + '.' + out_format)
-
-            if gzipped_out:
-                if not os.path.isfile(bin_filename):
-                    continue
-                bin_filename_gz = bin_filename + '.gz'
-                if os.path.isfile(bin_filename_gz):
-                    os.remove(bin_filename_gz)
-                try:
-                    subprocess.check_output(gzip_command + ' ' + bin_filename,
-                                            stderr=subprocess.STDOUT, shell=True)
-                except subprocess.CalledProcessError:
-                    pass
-                bin_filename = bin_filename_gz
-
-            table_row = [barcode_name, int_to_str(barcode_read_counts[barcode_name]),
-                         int_to_str(barcode_base_counts[barcode_name]), bin_filename]
-            table.append(table_row)
+            print('No adapters found - output reads are unchanged from input reads\n',
+                  file=args.print_dest)
+        print(bold_underline('Processing reads in chunks of ' + int_to_str(args.chunk_size)),
+              flush=True, file=args.print_dest)
+
+    read_count, end_counts, middle_counts = 0, [0] * 5, [0] * 4
+    middle_hit_counts = {}
+    for reads in iterate_read_chunks(args.input, args.chunk_size):
+        if matching_sets:
+            find_adapters_at_read_ends(reads, matching_sets, args.verbosity, args.end_size,
+                                       args.extra_end_trim, args.end_threshold,
+                                       args.scoring_scheme_vals, args.print_dest,
+                                       args.min_trim_size, args.threads, check_barcodes,
+                                       args.barcode_threshold, args.barcode_diff,
+                                       args.require_two_barcodes, forward_or_reverse_barcodes,
+                                       args.alignment_engine, in_chunks=True)
+            end_counts = [a + b for a, b in zip(end_counts, get_read_end_trimming_counts(reads))]
+        if split_reads:
+            find_adapters_in_read_middles(reads, matching_sets, args.verbosity,
+                                          args.middle_threshold, args.extra_middle_trim_good_side,
+                                          args.extra_middle_trim_bad_side,
+                                          args.scoring_scheme_vals, args.print_dest, args.threads,
+                                          args.discard_middle, args.middle_search,
+                                          args.alignment_engine, in_chunks=True,
+                                          middle_hit_counts=middle_hit_counts)
+            middle_counts = [a + b for a, b in
+                             zip(middle_counts, get_read_middle_trimming_counts(reads))]
+        read_output.write_reads(reads)
+        read_count += len(reads)
+        if args.verbosity == 1:
+            print('\r' + int_to_str(read_count) + ' reads processed',
+                  end='', flush=True, file=args.print_dest)
+        if quota is not None and quota.expected_bins_full():
+            if args.verbosity > 0:
+                print('\nBarcode bins are full - no more reads will be loaded',
+                      end='', flush=True, file=args.print_dest)
+            break
 
-        if verbosity > 0:
-            print('')
-            print_table(table, print_dest, alignments='LRRL', max_col_width=60, col_separation=2)
-
-    # Output to all reads to stdout.
-    elif output is None:
-        for read in reads:
-            read_str = read.get_fasta(min_split_size, discard_middle) if out_format == 'fasta' \
-                else read.get_fastq(min_split_size, discard_middle)
-            print(read_str, end='')
-        if verbosity > 0:
-            print('Done', flush=True, file=print_dest)
+    if args.verbosity > 0:
+        print('\n', file=args.print_dest)
+    if matching_sets:
+        display_read_end_trimming_summary(None, args.verbosity, args.print_dest, end_counts)
+    if split_reads:
+        display_read_middle_trimming_summary(None, args.discard_middle, args.verbosity,
+                                             args.print_dest, args.middle_search, middle_counts)
+    read_output.display_header()
+    read_output.finish()
 
-    # Output to all reads to file.
-    else:
-        if gzipped_out:
-            out_filename = 'TEMP_' + str(os.getpid()) + '.fastq'
-        else:
-            out_filename = output
-        with open(out_filename, 'wt') as out:
-            for read in reads:
-                read_str = read.get_fasta(min_split_size, discard_middle) if out_format == 'fasta' \
-                    else read.get_fastq(min_split_size, discard_middle)
-                out.write(read_str)
-        if gzipped_out:
-            subprocess.check_output(gzip_command + ' -c ' + out_filename + ' > ' + output,
-                                    stderr=subprocess.STDOUT, shell=True)
-            os.remove(out_filename)
-        if verbosity > 0:
-            print('\nSaved result to ' + os.path.abspath(output), file=print_dest)
 
-    if verbosity > 0:
-        print('', flush=True, file=print_dest)
+def trim_fingerprint_bins(bin_collector, args, read_type):
+    """
+    The second phase of --fingerprint. Each barcode bin's reads are trimmed as a --fp2ndrun run
+    given the bin's file would trim them: adapter sets (now including the GTG repeats) are found
+    again, starting from unused ones, and then trimmed from the read ends, with no splitting and no
+    barcode binning. The bins are then saved, so the files are the same as those of the two runs.
+    Each bin is read back from its temporary file, in chunks if --chunk_size is given (otherwise
+    one whole bin is in memory at a time), and the file is deleted once the bin is saved.
+    """
+    read_output = ReadOutput(args.format, None, read_type, args.verbosity, True,
+                             args.min_split_read_size, args.print_dest, args.barcode_dir,
+                             args.input, False, args.threads, args.discard_unassigned,
+                             length_profile=make_length_profile(args),
+                             sketches=make_bin_sketches(args))
+    in_chunks = bool(args.chunk_size)
+    for barcode_name in sorted(bin_collector.bin_filenames):
+        bin_filename = bin_collector.bin_filenames[barcode_name]
+        read_count = bin_collector.read_counts[barcode_name]
+        if args.verbosity > 0:
+            print(bold_underline('Trimming barcode bin ' + barcode_name), flush=True,
+                  file=args.print_dest)
+            print(int_to_str(read_count) + ' reads\n\n', flush=True, file=args.print_dest)
+        adapters = get_adapter_sets(args.trimgtgrange)
+        check_reads, _ = load_check_reads(bin_filename, 0, args.print_dest, args.check_reads)
+        matching_sets = find_matching_adapter_sets(check_reads, adapters, args.verbosity,
+                                                   args.end_size, args.scoring_scheme_vals,
+                                                   args.print_dest, args.adapter_threshold,
+                                                   args.threads)
+        matching_sets = exclude_end_adapters_for_rapid(matching_sets)
+        matching_sets = fix_up_1d2_sets(matching_sets)
+        display_adapter_set_results(matching_sets, adapters, args.verbosity, args.print_dest)
+        matching_sets = add_full_barcode_adapter_sets(matching_sets)
+        if args.verbosity > 0:
+            print('\n', file=args.print_dest)
+            if matching_sets and in_chunks:
+                display_read_end_adapters(matching_sets, args.print_dest)
+
+        end_counts = [0] * 5
+        for reads in iterate_read_chunks(bin_filename, args.chunk_size or read_count):
+            if matching_sets:
+                find_adapters_at_read_ends(reads, matching_sets, args.verbosity, args.end_size,
+                                           args.extra_end_trim, args.end_threshold,
+                                           args.scoring_scheme_vals, args.print_dest,
+                                           args.min_trim_size, args.threads, False,
+                                           args.barcode_threshold, args.barcode_diff,
+                                           args.require_two_barcodes, None,
+                                           args.alignment_engine, in_chunks=in_chunks)
+                end_counts = [a + b for a, b in
+                              zip(end_counts, get_read_end_trimming_counts(reads))]
+            for read in reads:
+                read.barcode_call = barcode_name
+            read_output.write_reads(reads)
+        if matching_sets:
+            display_read_end_trimming_summary(None, args.verbosity, args.print_dest, end_counts)
+        elif args.verbosity > 0:
+            print('No adapters found - reads are unchanged\n', file=args.print_dest)
+        os.remove(bin_filename)
+
+    bin_collector.remove_bin_files()
+    read_output.display_header()
+    read_output.finish()
 
 
 def output_progress_line(completed, total, print_dest, end_newline=False, step=10):
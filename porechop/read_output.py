@@ -0,0 +1,521 @@
+"""
+Copyright 2017 Ryan Wick (rrwick@gmail.com)
+https://github.com/rrwick/Porechop
+
+This module contains the class which writes trimmed reads to their destination (stdout, a single
+file or barcode bins). Reads can be written in multiple batches, so they do not all need to be in
+memory at once.
+
+This file is part of Porechop. Porechop is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. Porechop is distributed in
+the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with Porechop. If
+not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import sys
+import gzip
+import subprocess
+import shutil
+import json
+import tempfile
+from collections import defaultdict, deque, Counter
+from concurrent.futures import ThreadPoolExecutor
+from .misc import print_table, bold_underline, int_to_str
+from .nanopore_read import NanoporeRead
+from .cpp_function_wrappers import add_to_minhash_sketch
+
+GZIP_LEVEL = 6
+GZIP_BLOCK_SIZE = 1024 * 1024
+SKETCH_BATCH_BASES = 256 * 1024
+
+
+class ReadOutput(object):
+
+    def __init__(self, out_format, output, read_type, verbosity, discard_middle, min_split_size,
+                 print_dest, barcode_dir, input_filename, untrimmed, threads, discard_unassigned,
+                 quota=None, length_profile=None, sketches=None):
+        self.output = output
+        self.verbosity = verbosity
+        self.discard_middle = discard_middle
+        self.min_split_size = min_split_size
+        self.print_dest = print_dest
+        self.barcode_dir = barcode_dir
+        self.untrimmed = untrimmed
+        self.discard_unassigned = discard_unassigned
+        self.quota = quota
+        self.length_profile = length_profile
+        self.sketches = sketches
+
+        if out_format == 'auto':
+            out_format = get_auto_out_format(output, read_type, barcode_dir, input_filename)
+
+        # A single output file can be piped through pigz, but barcode bins (there can be hundreds)
+        # are each compressed in process, sharing one pool of worker threads with the sketches.
+        self.gzipped_out = False
+        self.pigz_found = False
+        if out_format.endswith('.gz') and (barcode_dir is not None or output is not None):
+            self.gzipped_out = True
+            out_format = out_format[:-3]
+            if barcode_dir is None and shutil.which('pigz'):
+                self.pigz_found = True
+        self.out_format = out_format
+
+        self.barcode_files = {}
+        self.barcode_read_counts = defaultdict(int)
+        self.barcode_base_counts = defaultdict(int)
+        self.out_file = None
+        self.worker_pool = None
+
+        if threads > 1 and ((self.gzipped_out and not self.pigz_found) or sketches is not None):
+            self.worker_pool = ThreadPoolExecutor(threads)
+        if sketches is not None:
+            sketches.executor = self.worker_pool
+
+        if barcode_dir is not None:
+            if not os.path.isdir(barcode_dir):
+                os.makedirs(barcode_dir)
+        elif output is not None:
+            if not self.gzipped_out:
+                self.out_file = open(output, 'wt')
+            elif self.pigz_found:
+                self.out_file = PigzWriter(output, threads)
+            else:
+                self.out_file = BlockGzipWriter(output, self.worker_pool)
+
+    def display_header(self):
+        if self.verbosity > 0:
+            trimmed_or_untrimmed = 'untrimmed' if self.untrimmed else 'trimmed'
+            if self.barcode_dir is not None:
+                verb = 'Saving '
+                destination = 'barcode-specific files'
+            elif self.output is None:
+                verb = 'Outputting '
+                destination = 'stdout'
+            else:
+                verb = 'Saving '
+                destination = 'file'
+            print(bold_underline(verb + trimmed_or_untrimmed + ' reads to ' + destination),
+                  flush=True, file=self.print_dest)
+        if self.gzipped_out and self.verbosity > 0:
+            if self.pigz_found:
+                print('pigz found - using it to compress instead of gzip')
+            elif self.barcode_dir is not None:
+                print('compressing barcode bins with zlib as they are written')
+            else:
+                print('pigz not found - compressing with zlib')
+
+    def write_reads(self, reads):
+        """
+        Writes a batch of reads. This can be called any number of times before finish.
+        """
+        if self.barcode_dir is not None:
+            self.write_reads_to_barcode_bins(reads)
+        else:
+            for read in reads:
+                read_str = read.get_fasta(self.min_split_size, self.discard_middle) \
+                    if self.out_format == 'fasta' \
+                    else read.get_fastq(self.min_split_size, self.discard_middle)
+                if self.out_file is None:
+                    print(read_str, end='')
+                else:
+                    self.out_file.write(read_str)
+
+    def write_reads_to_barcode_bins(self, reads):
+        for read in reads:
+            barcode_name = read.barcode_call
+            if self.discard_unassigned and barcode_name == 'none':
+                continue
+            if self.out_format == 'fasta':
+                read_str = read.get_fasta(self.min_split_size, self.discard_middle,
+                                          self.untrimmed)
+            else:
+                read_str = read.get_fastq(self.min_split_size, self.discard_middle,
+                                          self.untrimmed)
+            if not read_str:
+                continue
+            if self.untrimmed:
+                seq_length = len(read.seq)
+            else:
+                seq_length = read.seq_length_with_start_end_adapters_trimmed()
+            if self.quota is not None and not self.quota.accept(barcode_name, seq_length):
+                continue
+            if barcode_name not in self.barcode_files:
+                self.barcode_files[barcode_name] = self.open_bin_file(barcode_name)
+            self.barcode_files[barcode_name].write(read_str)
+            self.barcode_read_counts[barcode_name] += 1
+            self.barcode_base_counts[barcode_name] += seq_length
+            if self.length_profile is not None:
+                self.length_profile.add_read(barcode_name, seq_length)
+            if self.sketches is not None:
+                self.sketches.add_read(barcode_name, self.get_written_seqs(read))
+
+    def get_written_seqs(self, read):
+        """
+        Returns the sequences of a read as they are written to its bin (the parts, for a read split
+        at middle adapters).
+        """
+        if read.middle_trim_positions:
+            return [x[0] for x in read.get_split_read_parts(self.min_split_size)]
+        if self.untrimmed:
+            return [read.seq]
+        return [read.get_seq_with_start_end_adapters_trimmed()]
+
+    def get_bin_filename(self, barcode_name):
+        bin_filename = os.path.join(self.barcode_dir, barcode_name + '.' + self.out_format)
+        if self.gzipped_out:
+            bin_filename += '.gz'
+        return bin_filename
+
+    def open_bin_file(self, barcode_name):
+        if not self.gzipped_out:
+            return open(self.get_bin_filename(barcode_name), 'wt')
+
+        # Bins use smaller blocks than a single output file, to bound the memory held in buffers
+        # when there are many bins.
+        return BlockGzipWriter(self.get_bin_filename(barcode_name), self.worker_pool,
+                               block_size=GZIP_BLOCK_SIZE // 4, max_pending=4)
+
+    def finish(self):
+        """
+        Closes all output files (compressing them if necessary) and displays the final summary.
+        """
+        if self.barcode_dir is not None:
+            self.finish_barcode_bins()
+        elif self.output is None:
+            if self.verbosity > 0:
+                print('Done', flush=True, file=self.print_dest)
+        else:
+            self.out_file.close()
+            if self.verbosity > 0:
+                print('\nSaved result to ' + os.path.abspath(self.output), file=self.print_dest)
+
+        if self.worker_pool is not None:
+            self.worker_pool.shutdown()
+        if self.verbosity > 0:
+            print('', flush=True, file=self.print_dest)
+
+    def finish_barcode_bins(self):
+        table = [['Barcode', 'Reads', 'Bases', 'File']]
+
+        for barcode_name in sorted(self.barcode_files.keys()):
+            self.barcode_files[barcode_name].close()
+            bin_filename = self.get_bin_filename(barcode_name)
+            table_row = [barcode_name, int_to_str(self.barcode_read_counts[barcode_name]),
+                         int_to_str(self.barcode_base_counts[barcode_name]), bin_filename]
+            table.append(table_row)
+
+        if self.verbosity > 0:
+            print('')
+            print_table(table, self.print_dest, alignments='LRRL', max_col_width=60,
+                        col_separation=2)
+
+        if self.length_profile is not None:
+            self.length_profile.save()
+            if self.verbosity > 0:
+                print('\nSaved read length profile to ' +
+                      os.path.abspath(self.length_profile.filename), file=self.print_dest)
+
+        if self.sketches is not None:
+            self.sketches.finish()
+            self.sketches.save(self.barcode_dir)
+            if self.verbosity > 0:
+                print('\nSaved MinHash sketches (k=' + str(self.sketches.kmer_size) + ', ' +
+                      str(self.sketches.sketch_size) + ' hashes) to ' +
+                      os.path.abspath(self.barcode_dir), file=self.print_dest)
+
+
+class BarcodeBinCollector(object):
+    """
+    Takes the place of ReadOutput in the first phase of --fingerprint. Instead of being written to
+    barcode bin files, the reads are written, as they would be loaded from the bin files, to
+    uncompressed temporary files (one per bin) in a hidden directory in the barcode directory. The
+    bins can then be read back and trimmed again before they are saved, without the whole read set
+    being held in memory.
+    """
+    def __init__(self, out_format, read_type, barcode_dir, input_filename, untrimmed,
+                 discard_unassigned, quota=None):
+        if out_format == 'auto':
+            out_format = get_auto_out_format(None, read_type, barcode_dir, input_filename)
+        self.read_type = 'FASTA' if out_format.startswith('fasta') else 'FASTQ'
+        self.untrimmed = untrimmed
+        self.discard_unassigned = discard_unassigned
+        self.quota = quota
+        if not os.path.isdir(barcode_dir):
+            os.makedirs(barcode_dir)
+        self.temp_dir = tempfile.mkdtemp(prefix='.porechop_bins_', dir=barcode_dir)
+        self.bin_filenames = {}
+        self.bin_files = {}
+        self.read_counts = defaultdict(int)
+
+    def display_header(self):
+        pass
+
+    def write_reads(self, reads):
+        """
+        Saves the reads that write_reads_to_barcode_bins would have written. Reads with middle
+        adapters are always discarded when binning.
+        """
+        for read in reads:
+            barcode_name = read.barcode_call
+            if self.discard_unassigned and barcode_name == 'none':
+                continue
+            if read.middle_trim_positions:
+                continue
+            if self.untrimmed:
+                seq, quals = read.seq, read.quals
+            else:
+                seq = read.get_seq_with_start_end_adapters_trimmed()
+                quals = read.get_quals_with_start_end_adapters_trimmed()
+            if not seq:
+                continue
+            if self.quota is not None and not self.quota.accept(barcode_name, len(seq)):
+                continue
+            if barcode_name not in self.bin_files:
+                self.bin_filenames[barcode_name] = os.path.join(self.temp_dir, barcode_name)
+                self.bin_files[barcode_name] = open(self.bin_filenames[barcode_name], 'wt')
+            if self.read_type == 'FASTA':
+                read_str = ''.join(['>', read.name, '\n', seq, '\n'])
+            else:
+                read_str = ''.join(['@', read.name, '\n', seq, '\n+\n', quals, '\n'])
+            self.bin_files[barcode_name].write(read_str)
+            self.read_counts[barcode_name] += 1
+
+    def finish(self):
+        for bin_file in self.bin_files.values():
+            bin_file.close()
+
+    def remove_bin_files(self):
+        shutil.rmtree(self.temp_dir)
+
+
+class LengthProfile(object):
+    """
+    A histogram of read lengths for each barcode bin, built as the bins are written. Lengths are
+    counted in ranges of bin_size bases, so memory depends on the read lengths, not the read count.
+    The profile is saved as JSON if the filename ends with .json, otherwise as TSV.
+    """
+    def __init__(self, filename, bin_size):
+        self.filename = filename
+        self.bin_size = bin_size
+        self.histograms = defaultdict(Counter)
+
+    def add_read(self, barcode_name, seq_length):
+        self.histograms[barcode_name][seq_length // self.bin_size] += 1
+
+    def get_rows(self, barcode_name):
+        """
+        Returns (range start, read count) for each range with reads, in order.
+        """
+        histogram = self.histograms[barcode_name]
+        return [(x * self.bin_size, histogram[x]) for x in sorted(histogram)]
+
+    def save(self):
+        with open(self.filename, 'wt') as profile_file:
+            if self.filename.lower().endswith('.json'):
+                profile = {'bin_size': self.bin_size,
+                           'barcodes': {x: {'reads': sum(self.histograms[x].values()),
+                                            'lengths': self.get_rows(x)}
+                                        for x in sorted(self.histograms)}}
+                json.dump(profile, profile_file, separators=(',', ':'))
+                profile_file.write('\n')
+            else:
+                profile_file.write('barcode\tlength\treads\n')
+                for barcode_name in sorted(self.histograms):
+                    for range_start, read_count in self.get_rows(barcode_name):
+                        profile_file.write(barcode_name + '\t' + str(range_start) + '\t' +
+                                           str(read_count) + '\n')
+
+
+class BinSketches(object):
+    """
+    A bottom-k MinHash sketch of the canonical k-mers in each barcode bin, built as the bins are
+    written, so bins can be compared (e.g. for contamination) without reading them again. Each
+    bin's sequences are batched and each batch is sketched in C++. If a thread pool executor is
+    given, batches are sketched by its workers (which release the GIL) and merged into the bin's
+    sketch in order as they finish. Memory is bounded by the sketch size and the batch size, not
+    the bin size.
+    """
+    def __init__(self, kmer_size, sketch_size, executor=None, max_pending=8):
+        self.kmer_size = kmer_size
+        self.sketch_size = sketch_size
+        self.executor = executor
+        self.max_pending = max_pending
+        self.sketches = defaultdict(list)
+        self.batches = defaultdict(list)
+        self.batch_sizes = defaultdict(int)
+        self.pending = deque()
+
+    def add_read(self, barcode_name, seqs):
+        batch = self.batches[barcode_name]
+        for seq in seqs:
+            batch.append(seq)
+            self.batch_sizes[barcode_name] += len(seq)
+        if self.batch_sizes[barcode_name] >= SKETCH_BATCH_BASES:
+            self.sketch_batch(barcode_name)
+
+    def sketch_batch(self, barcode_name):
+        batch = self.batches.pop(barcode_name)
+        del self.batch_sizes[barcode_name]
+        if self.executor is None:
+            self.sketches[barcode_name] = add_to_minhash_sketch(batch, self.kmer_size,
+                                                                self.sketch_size,
+                                                                self.sketches[barcode_name])
+            return
+        self.pending.append((barcode_name, self.executor.submit(add_to_minhash_sketch, batch,
+                                                                self.kmer_size, self.sketch_size,
+                                                                [])))
+        while self.pending and (self.pending[0][1].done() or len(self.pending) > self.max_pending):
+            self.merge_pending()
+
+    def merge_pending(self):
+        barcode_name, future = self.pending.popleft()
+        sketch = self.sketches[barcode_name]
+        self.sketches[barcode_name] = sorted(set(sketch).union(future.result()))[:self.sketch_size]
+
+    def finish(self):
+        """
+        Sketches the remaining batches and waits for them.
+        """
+        for barcode_name in list(self.batches):
+            self.sketch_batch(barcode_name)
+        while self.pending:
+            self.merge_pending()
+
+    def save(self, barcode_dir):
+        """
+        Saves each bin's sketch next to its bin file, as <barcode>.sketch.json.
+        """
+        for barcode_name in sorted(self.sketches):
+            sketch = {'kmer_size': self.kmer_size, 'sketch_size': self.sketch_size,
+                      'hash': 'murmur3_fmix64_2bit_canonical',
+                      'hashes': self.sketches[barcode_name]}
+            sketch_filename = os.path.join(barcode_dir, barcode_name + '.sketch.json')
+            with open(sketch_filename, 'wt') as sketch_file:
+                json.dump(sketch, sketch_file, separators=(',', ':'))
+                sketch_file.write('\n')
+
+
+class BinQuota(object):
+    """
+    Limits the reads and/or bases (of the reads as written) that each barcode bin takes: a bin
+    takes reads, in the order they are written, until either limit is reached, and then takes no
+    more. The expected barcodes are the bins which must all be full before the input can stop
+    being read.
+    """
+    def __init__(self, max_reads, max_bases, expected_barcodes):
+        self.max_reads = max_reads
+        self.max_bases = max_bases
+        self.expected_barcodes = set(expected_barcodes)
+        self.read_counts = defaultdict(int)
+        self.base_counts = defaultdict(int)
+
+    def is_full(self, barcode_name):
+        return bool(self.max_reads and self.read_counts[barcode_name] >= self.max_reads) or \
+            bool(self.max_bases and self.base_counts[barcode_name] >= self.max_bases)
+
+    def accept(self, barcode_name, seq_length):
+        """
+        Returns whether the bin takes a read of the given length, counting it if so.
+        """
+        if self.is_full(barcode_name):
+            return False
+        self.read_counts[barcode_name] += 1
+        self.base_counts[barcode_name] += seq_length
+        return True
+
+    def expected_bins_full(self):
+        return bool(self.expected_barcodes) and \
+            all(self.is_full(x) for x in self.expected_barcodes)
+
+
+def get_auto_out_format(output, read_type, barcode_dir, input_filename):
+    """
+    Chooses the output format based on the output filename or (if that doesn't help) the input
+    read format.
+    """
+    if output is None:
+        out_format = read_type.lower()
+        if barcode_dir is not None and input_filename.lower().endswith('.gz'):
+            out_format += '.gz'
+    elif '.fasta.gz' in output.lower():
+        out_format = 'fasta.gz'
+    elif '.fastq.gz' in output.lower():
+        out_format = 'fastq.gz'
+    elif '.fasta' in output.lower():
+        out_format = 'fasta'
+    elif '.fastq' in output.lower():
+        out_format = 'fastq'
+    else:
+        out_format = read_type.lower()
+    return out_format
+
+
+class PigzWriter(object):
+    """
+    A writable text file which is compressed on the fly by piping it through pigz.
+    """
+    def __init__(self, filename, threads):
+        self.filename = filename
+        self.out_file = open(filename, 'wb')
+        self.process = subprocess.Popen(['pigz', '-p', str(threads), '-c'],
+                                        stdin=subprocess.PIPE, stdout=self.out_file,
+                                        universal_newlines=True)
+
+    def write(self, text):
+        self.process.stdin.write(text)
+
+    def close(self):
+        self.process.stdin.close()
+        return_code = self.process.wait()
+        self.out_file.close()
+        if return_code != 0:
+            sys.exit('Error: pigz failed to compress ' + self.filename)
+
+
+class BlockGzipWriter(object):
+    """
+    A writable text file which is compressed on the fly, in blocks that are each a complete gzip
+    member (concatenated members are still a valid gzip file). If a thread pool executor is given,
+    blocks are compressed by its workers (zlib releases the GIL) and written in order as they
+    finish, so compression runs in parallel with trimming.
+    """
+    def __init__(self, filename, executor=None, block_size=GZIP_BLOCK_SIZE, max_pending=8):
+        self.out_file = open(filename, 'wb')
+        self.executor = executor
+        self.block_size = block_size
+        self.max_pending = max_pending
+        self.buffer, self.buffer_size = [], 0
+        self.pending = deque()
+        self.written = False
+
+    def write(self, text):
+        self.buffer.append(text)
+        self.buffer_size += len(text)
+        if self.buffer_size >= self.block_size:
+            self.compress_buffer()
+
+    def compress_buffer(self):
+        data = ''.join(self.buffer).encode()
+        self.buffer, self.buffer_size = [], 0
+        self.written = True
+        if self.executor is None:
+            self.out_file.write(compress_block(data))
+            return
+        self.pending.append(self.executor.submit(compress_block, data))
+        while self.pending and (self.pending[0].done() or len(self.pending) > self.max_pending):
+            self.out_file.write(self.pending.popleft().result())
+
+    def close(self):
+        if self.buffer or not self.written:
+            self.compress_buffer()
+        while self.pending:
+            self.out_file.write(self.pending.popleft().result())
+        self.out_file.close()
+
+
+def compress_block(data):
+    return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
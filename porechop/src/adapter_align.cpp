@@ -1,4 +1,5 @@
 #include "adapter_align.h"
+#include "simd_align.h"
 
 #include <seqan/align.h>
 #include <iostream>
@@ -6,39 +7,252 @@
 #include <limits>
 #include <algorithm>
 #include <utility>
+#include <map>
 
 
-char * adapterAlignment(char * readSeq, char * adapterSeq,
-                        int matchScore, int mismatchScore, int gapOpenScore, int gapExtensionScore) {
-    std::string output;
+void adapterAlignment(char * readSeq, char * adapterSeq,
+                      int matchScore, int mismatchScore, int gapOpenScore, int gapExtensionScore,
+                      AlignmentResult * result) {
+    static thread_local Dna5String sequenceH, sequenceV;
+    sequenceH = readSeq;
+    sequenceV = adapterSeq;
+    Score<int, Simple> scoringScheme(matchScore, mismatchScore, gapExtensionScore, gapOpenScore);
+    ScoredAlignment scoredAlignment = alignReadToAdapter(sequenceH, length(readSeq),
+                                                         sequenceV, length(adapterSeq),
+                                                         scoringScheme);
+    scoredAlignment.getResult(result);
+}
 
-    Dna5String sequenceH = readSeq;
-    Dna5String sequenceV = adapterSeq;
-    std::string readName = "";
-    std::string refName = "";
 
-    Align<Dna5String, ArrayGaps> alignment;
-    resize(rows(alignment), 2);
-    assignSource(row(alignment, 0), sequenceH);
-    assignSource(row(alignment, 1), sequenceV);
-    Score<int, Simple> scoringScheme(matchScore, mismatchScore, gapExtensionScore, gapOpenScore);
+// Aligns a converted read sequence against every adapter in the panel. Panels using the trie
+// engine align to all their adapters at once (apart from empty ones), and other panels align to
+// each adapter in turn.
+void alignReadToPanel(Dna5String & readSeq, int readLength, AdapterPanel * panel,
+                      int matchScore, int mismatchScore, int gapOpenScore,
+                      int gapExtensionScore, AlignmentResult * results) {
+    int adapterCount = panel->adapters.size();
+    if (panel->engine == TRIE_ENGINE &&
+            trieAlignmentPossible(readLength, gapOpenScore, gapExtensionScore)) {
+        trieAlignReadToAdapters(readSeq, readLength, panel->trie, panel->adapters, matchScore,
+                                mismatchScore, gapOpenScore, gapExtensionScore, results);
+        for (int a = 0; a < adapterCount; ++a) {
+            if (panel->adapterLengths[a] == 0)
+                alignReadToPanelAdapter(readSeq, readLength, panel, a, matchScore, mismatchScore,
+                                        gapOpenScore, gapExtensionScore, results + a);
+        }
+        return;
+    }
+    for (int a = 0; a < adapterCount; ++a)
+        alignReadToPanelAdapter(readSeq, readLength, panel, a, matchScore, mismatchScore,
+                                gapOpenScore, gapExtensionScore, results + a);
+}
+
+
+// Aligns a group of reads of the same length (with indices given by group) to a trie engine
+// panel, one read per SIMD lane, and writes the results like alignReadsToPanel. A lone read (or a
+// group the SIMD code can't do) is aligned one read at a time.
+static void alignGroupToTrie(std::vector<Dna5String *> & groupSequences, std::vector<int> & group,
+                             int readLength, AdapterPanel * panel,
+                             int matchScore, int mismatchScore, int gapOpenScore,
+                             int gapExtensionScore, AlignmentResult * results) {
+    int adapterCount = panel->adapters.size();
+    if (group.size() == 1 ||
+            !trieAlignmentPossible(readLength, gapOpenScore, gapExtensionScore) ||
+            !simdAlignmentPossible(readLength, panel->trie.maxDepth, matchScore, mismatchScore,
+                                   gapOpenScore, gapExtensionScore)) {
+        for (size_t k = 0; k < group.size(); ++k)
+            alignReadToPanel(*groupSequences[k], readLength, panel, matchScore, mismatchScore,
+                             gapOpenScore, gapExtensionScore, results + group[k] * adapterCount);
+        return;
+    }
+    std::vector<AlignmentResult *> groupResults;
+    for (int r : group)
+        groupResults.push_back(results + r * adapterCount);
+    simdTrieAlignReadsToAdapters(groupSequences, readLength, panel->trie, panel->adapters,
+                                 matchScore, mismatchScore, gapOpenScore, gapExtensionScore,
+                                 groupResults);
+    for (int a = 0; a < adapterCount; ++a) {
+        if (panel->adapterLengths[a] == 0) {
+            for (size_t k = 0; k < group.size(); ++k)
+                alignReadToPanelAdapter(*groupSequences[k], readLength, panel, a, matchScore,
+                                        mismatchScore, gapOpenScore, gapExtensionScore,
+                                        groupResults[k] + a);
+        }
+    }
+}
+
+
+// Aligns many converted read sequences against every adapter in the panel, writing the results to
+// the given array read by read (the results for read r start at index r * adapter count). With the
+// SIMD and trie engines, reads of the same length (usually all of them, as read ends are cut to the
+// same size) are aligned in groups, one read per SIMD lane.
+void alignReadsToPanel(std::vector<Dna5String> & sequences, AdapterPanel * panel,
+                       int matchScore, int mismatchScore, int gapOpenScore,
+                       int gapExtensionScore, AlignmentResult * results) {
+    int readCount = sequences.size();
+    int adapterCount = panel->adapters.size();
+    if (panel->engine == SEQAN_ENGINE) {
+        for (int r = 0; r < readCount; ++r)
+            alignReadToPanel(sequences[r], length(sequences[r]), panel, matchScore, mismatchScore,
+                             gapOpenScore, gapExtensionScore, results + r * adapterCount);
+        return;
+    }
+
+    std::map<int, std::vector<int> > readsByLength;
+    for (int r = 0; r < readCount; ++r)
+        readsByLength[length(sequences[r])].push_back(r);
+
+    int lanes = simdLaneCount();
+    for (auto const & lengthAndReads : readsByLength) {
+        int readLength = lengthAndReads.first;
+        std::vector<int> const & sameLengthReads = lengthAndReads.second;
+        for (size_t groupStart = 0; groupStart < sameLengthReads.size(); groupStart += lanes) {
+            std::vector<int> group(sameLengthReads.begin() + groupStart,
+                                   sameLengthReads.begin() + std::min(groupStart + lanes,
+                                                                      sameLengthReads.size()));
+            std::vector<Dna5String *> groupSequences;
+            for (int r : group)
+                groupSequences.push_back(&sequences[r]);
+            if (panel->engine == TRIE_ENGINE) {
+                alignGroupToTrie(groupSequences, group, readLength, panel, matchScore,
+                                 mismatchScore, gapOpenScore, gapExtensionScore, results);
+                continue;
+            }
+            for (int a = 0; a < adapterCount; ++a) {
+                int adapterLength = panel->adapterLengths[a];
+
+                // A lone read (or an alignment the SIMD code can't do) is aligned on its own.
+                if (group.size() == 1 ||
+                        !simdAlignmentPossible(readLength, adapterLength, matchScore,
+                                               mismatchScore, gapOpenScore, gapExtensionScore)) {
+                    for (int r : group)
+                        alignReadToPanelAdapter(sequences[r], readLength, panel, a, matchScore,
+                                                mismatchScore, gapOpenScore, gapExtensionScore,
+                                                results + r * adapterCount + a);
+                    continue;
+                }
+                std::vector<ScoredAlignment> alignments =
+                        simdAlignReadsToAdapter(groupSequences, readLength, panel->adapters[a],
+                                                adapterLength, matchScore, mismatchScore,
+                                                gapOpenScore, gapExtensionScore);
+                for (size_t k = 0; k < group.size(); ++k)
+                    alignments[k].getResult(results + group[k] * adapterCount + a);
+            }
+        }
+    }
+}
+
+
+// Aligns a read sequence to one adapter in the panel, using the panel's engine. Panels using the
+// SIMD or trie engine fall back to SeqAn for alignments the SIMD aligner can't do.
+void alignReadToPanelAdapter(Dna5String & readSeq, int readLength,
+                             AdapterPanel * panel, int adapterIndex,
+                             int matchScore, int mismatchScore, int gapOpenScore,
+                             int gapExtensionScore, AlignmentResult * result) {
+    Dna5String & adapterSeq = panel->adapters[adapterIndex];
+    int adapterLength = panel->adapterLengths[adapterIndex];
+    if (panel->engine != SEQAN_ENGINE &&
+            simdAlignmentPossible(readLength, adapterLength, matchScore, mismatchScore,
+                                  gapOpenScore, gapExtensionScore)) {
+        ScoredAlignment scoredAlignment = simdAlignReadToAdapter(readSeq, readLength, adapterSeq,
+                                                                 adapterLength, matchScore,
+                                                                 mismatchScore, gapOpenScore,
+                                                                 gapExtensionScore,
+                                                                 NO_MIN_SCORE);
+        scoredAlignment.getResult(result);
+    }
+    else {
+        Score<int, Simple> scoringScheme(matchScore, mismatchScore, gapExtensionScore,
+                                         gapOpenScore);
+        ScoredAlignment scoredAlignment = alignReadToAdapter(readSeq, readLength, adapterSeq,
+                                                             adapterLength, scoringScheme);
+        scoredAlignment.getResult(result);
+    }
+}
+
+
+// Scratch space for SeqAn alignments. Each thread keeps one, so the DP matrices and the traceback
+// are only reallocated when a bigger alignment than any before comes along.
+struct SeqanScratch {
+    typedef TraceSegment_<Position<Dna5String>::Type, Size<Dna5String>::Type> TTraceSegment;
+
+    DPContext<int, AffineGaps> affineContext;
+    DPContext<int, LinearGaps> linearContext;
+    String<TTraceSegment> traceSegments;
+};
+
+
+// This runs the DP of SeqAn's globalAlignment (with free end gaps), but with the thread's scratch
+// space instead of new allocations. The result comes straight from the trace segments, without
+// building an Align object and its gapped rows.
+ScoredAlignment alignReadToAdapter(Dna5String & readSeq, int readLength,
+                                   Dna5String & adapterSeq, int adapterLength,
+                                   Score<int, Simple> & scoringScheme) {
+    typedef SubstituteAlignConfig_<AlignConfig<true, true, true, true> >::Type TFreeEndGaps;
+    typedef AlignConfig2<DPGlobal, DPBandConfig<BandOff>, TFreeEndGaps> TAlignConfig;
+    static thread_local SeqanScratch scratch;
+    String<SeqanScratch::TTraceSegment> & traceSegments = scratch.traceSegments;
 
-    AlignConfig<true, true, true, true> alignConfig;
-    int score = globalAlignment(alignment, scoringScheme, alignConfig);
+    // SeqAn only initialises some of the score column's values (the rest keep those of newly
+    // constructed cells), so the column is emptied first. Its memory is kept.
+    clear(traceSegments);
+    clear(getDpScoreMatrix(scratch.affineContext));
+    clear(getDpScoreMatrix(scratch.linearContext));
+    DPScoutState_<Default> dpScoutState;
+    int score;
+    if (_usesAffineGaps(scoringScheme, readSeq, adapterSeq))
+        score = _setUpAndRunAlignment(scratch.affineContext, traceSegments, dpScoutState,
+                                      readSeq, adapterSeq, scoringScheme, TAlignConfig());
+    else
+        score = _setUpAndRunAlignment(scratch.linearContext, traceSegments, dpScoutState,
+                                      readSeq, adapterSeq, scoringScheme, TAlignConfig());
 
-    ScoredAlignment scoredAlignment(alignment, length(readSeq), length(adapterSeq), score);
-    return cppStringToCString(scoredAlignment.getString());
+    // The segments are stored from the last to the first. A horizontal segment has only read
+    // bases and a vertical one only adapter bases. Positions are counted from the alignment's
+    // start, like the rows of the Align object which globalAlignment would make.
+    TracebackWalk walk;
+    int segmentCount = length(traceSegments);
+    if (segmentCount > 0) {
+        int readOffset = _getBeginHorizontal(traceSegments[segmentCount - 1]);
+        int adapterOffset = _getBeginVertical(traceSegments[segmentCount - 1]);
+        for (int s = 0; s < segmentCount; ++s) {
+            SeqanScratch::TTraceSegment const & segment = traceSegments[s];
+            int readPos = _getBeginHorizontal(segment);
+            int adapterPos = _getBeginVertical(segment);
+            int segmentLength = segment._length;
+            if (segment._traceValue == TraceBitMap_<>::DIAGONAL) {
+                int matches = 0;
+                for (int k = 0; k < segmentLength; ++k)
+                    matches += (ordValue(readSeq[readPos + k]) ==
+                                ordValue(adapterSeq[adapterPos + k]));
+                walk.addRun(BOTH_BASES, segmentLength, readPos - readOffset,
+                            adapterPos - adapterOffset, matches);
+            }
+            else if (segment._traceValue == TraceBitMap_<>::HORIZONTAL)
+                walk.addRun(READ_BASE_ONLY, segmentLength, readPos - readOffset,
+                            adapterPos - adapterOffset, 0);
+            else if (segment._traceValue == TraceBitMap_<>::VERTICAL)
+                walk.addRun(ADAPTER_BASE_ONLY, segmentLength, readPos - readOffset,
+                            adapterPos - adapterOffset, 0);
+        }
+    }
+    return walk.finish(readLength, adapterLength, score);
 }
 
 
-void freeCString(char * p) {
-    free(p);
+AdapterPanel * createAdapterPanel(char ** adapterSeqs, int adapterCount, int engine) {
+    AdapterPanel * panel = new AdapterPanel;
+    panel->engine = AlignmentEngine(engine);
+    for (int i = 0; i < adapterCount; ++i) {
+        panel->adapters.push_back(Dna5String(adapterSeqs[i]));
+        panel->adapterLengths.push_back(length(adapterSeqs[i]));
+    }
+    if (panel->engine == TRIE_ENGINE)
+        panel->trie = buildAdapterTrie(panel->adapters);
+    return panel;
 }
 
 
-char * cppStringToCString(std::string cpp_string) {
-    char * c_string = (char*)malloc(sizeof(char) * (cpp_string.size() + 1));
-    std::copy(cpp_string.begin(), cpp_string.end(), c_string);
-    c_string[cpp_string.size()] = '\0';
-    return c_string;
+void deleteAdapterPanel(AdapterPanel * panel) {
+    delete panel;
 }
@@ -1,121 +1,82 @@
-
 #include "alignment.h"
 
 #include <iostream>
 
-ScoredAlignment::ScoredAlignment(Align<Dna5String, ArrayGaps> & alignment,
-                                 int readLength, int adapterLength, int score):
+
+// An alignment which failed or hasn't been filled in yet.
+ScoredAlignment::ScoredAlignment(int readLength, int adapterLength, int score):
     m_readLength(readLength), m_adapterLength(adapterLength),
-    m_readStartPos(-1), m_adapterStartPos(-1), m_rawScore(score)
+    m_readStartPos(-1), m_readEndPos(-1), m_adapterStartPos(-1), m_adapterEndPos(-1),
+    m_rawScore(score), m_alignedRegionPercentIdentity(0.0), m_fullAdapterPercentIdentity(0.0)
 {
-    // Extract the alignment sequences into C++ strings for constant time random access.
-    std::ostringstream stream1;
-    stream1 << row(alignment, 0);
-    std::string readAlignment =  stream1.str();
-    std::ostringstream stream2;
-    stream2 << row(alignment, 1);
-    std::string adapterAlignment =  stream2.str();
-
-    int alignmentLength = std::max(readAlignment.size(), adapterAlignment.size());
-    if (alignmentLength == 0)
-        return;
+}
 
+void ScoredAlignment::getResult(AlignmentResult * result) {
+    result->readStart = m_readStartPos;
+    result->readEnd = m_readEndPos;
+    result->adapterStart = m_adapterStartPos;
+    result->adapterEnd = m_adapterEndPos;
+    result->rawScore = m_rawScore;
+    result->alignedRegionPercentIdentity = m_alignedRegionPercentIdentity;
+    result->fullAdapterPercentIdentity = m_fullAdapterPercentIdentity;
+}
 
-    // We consider the alignment to have started when we've encountered a base in both
-    // sequences (though not necessarily at the same time).
-    int alignmentStartPos = -1;
-    bool readStarted = false;
-    bool adapterStarted = false;
-    for (int i = 0; i < alignmentLength; ++i) {
-        if (readAlignment[i] != '-')
-            readStarted = true;
-        if (adapterAlignment[i] != '-')
-            adapterStarted = true;
-        if (readStarted && adapterStarted) {
-            alignmentStartPos = i;
-            break;
-        }
-    }
 
-    // We use the same logic to see when the alignment has ended.
-    int alignmentEndPos = -1;
-    bool readEnded = false;
-    bool adapterEnded = false;
-    for (int i = alignmentLength - 1; i >= 0; --i) {
-        if (readAlignment[i] != '-')
-            readEnded = true;
-        if (adapterAlignment[i] != '-')
-            adapterEnded = true;
-        if (readEnded && adapterEnded) {
-            alignmentEndPos = i;
-            break;
-        }
-    }
+TracebackWalk::TracebackWalk():
+    m_columns(0), m_matches(0), m_readEnded(false), m_adapterEnded(false),
+    m_alignmentEnd({-1, -1, 0}), m_adapterEnd({-1, -1, 0}), m_readStart({-1, -1, 0}),
+    m_adapterStart({-1, -1, 0})
+{
+}
 
-    if (alignmentStartPos == -1 || alignmentEndPos == -1)
+// We consider the alignment to have started at the first column by which we've encountered a base
+// in both sequences (though not necessarily at the same time), and to have ended at the last
+// such column counting from the end. As the walk goes backwards, the end is the last column of
+// the run in which both sequences have first been seen. The starts of the read and adapter are
+// the first columns of the earliest runs with their bases, so they are updated by every run.
+void TracebackWalk::addRun(ColumnKind kind, int length, int readPos, int adapterPos,
+                           int matches) {
+    if (length <= 0)
         return;
+    bool hasRead = (kind & READ_BASE_ONLY), hasAdapter = (kind & ADAPTER_BASE_ONLY);
+    Column lastColumn = {readPos + (hasRead ? length - 1 : 0),
+                         adapterPos + (hasAdapter ? length - 1 : 0), m_columns + 1};
+    Column firstColumn = {readPos, adapterPos, m_columns + length};
 
-    // We also determine the start and end of the adapter in the alignment.
-    int adapterAlignmentStartPos = -1;
-    for (int i = 0; i < alignmentLength; ++i) {
-        if (adapterAlignment[i] != '-') {
-            adapterAlignmentStartPos = i;
-            break;
-        }
-    }
-    int adapterAlignmentEndPos = -1;
-    for (int i = alignmentLength - 1; i >= 0; --i) {
-        if (adapterAlignment[i] != '-') {
-            adapterAlignmentEndPos = i;
-            break;
-        }
-    }
-
-    // Now get the percent identity of the alignment using both the full alignment range and the
-    // adapter alignment range.
-    int alignedMatchCount = 0;
-    for (int i = alignmentStartPos; i < alignmentEndPos+1; ++i) {
-        if (adapterAlignment[i] == readAlignment[i])
-            ++alignedMatchCount;
-    }
-    int alignedRegionLength = alignmentEndPos - alignmentStartPos + 1;
-    m_alignedRegionPercentIdentity = 100.0 * alignedMatchCount / alignedRegionLength;
+    bool alignmentEnded = m_readEnded && m_adapterEnded;
+    if (hasAdapter && !m_adapterEnded)
+        m_adapterEnd = lastColumn;
+    m_readEnded = m_readEnded || hasRead;
+    m_adapterEnded = m_adapterEnded || hasAdapter;
+    if (!alignmentEnded && m_readEnded && m_adapterEnded)
+        m_alignmentEnd = lastColumn;
 
-    int fullAdapterMatchCount = 0;
-    for (int i = adapterAlignmentStartPos; i < adapterAlignmentEndPos+1; ++i) {
-        if (adapterAlignment[i] == readAlignment[i])
-            ++fullAdapterMatchCount;
-    }
-    int fullAdapterLength = adapterAlignmentEndPos - adapterAlignmentStartPos + 1;
-    m_fullAdapterPercentIdentity = 100.0 * fullAdapterMatchCount / fullAdapterLength;
-
-    int readBases = 0, adapterBases = 0;
-    for (int i = 0; i < alignmentLength; ++i) {
-        char base1 = readAlignment[i];
-        char base2 = adapterAlignment[i];
+    if (hasRead)
+        m_readStart = firstColumn;
+    if (hasAdapter)
+        m_adapterStart = firstColumn;
+    m_columns += length;
+    m_matches += matches;
+}
 
-        if (i == alignmentStartPos) {
-            m_readStartPos = readBases;
-            m_adapterStartPos = adapterBases;
-        }
-        if (i == alignmentEndPos) {
-            m_readEndPos = readBases;
-            m_adapterEndPos = adapterBases;
-        }
+// Gets the percent identity of the alignment using both the full alignment range and the adapter
+// alignment range. Matches are only in columns with both bases, which are within both ranges.
+ScoredAlignment TracebackWalk::finish(int readLength, int adapterLength, int score) {
+    ScoredAlignment alignment(readLength, adapterLength, score);
+    if (!m_readEnded || !m_adapterEnded)
+        return alignment;
 
-        if (base1 != '-')
-            ++readBases;
-        if (base2 != '-')
-            ++adapterBases;
-    }
-}
+    // The alignment starts at whichever of the read and adapter starts later.
+    Column alignmentStart = (m_readStart.tail < m_adapterStart.tail) ? m_readStart :
+                                                                        m_adapterStart;
+    int alignedRegionLength = alignmentStart.tail - m_alignmentEnd.tail + 1;
+    alignment.m_alignedRegionPercentIdentity = 100.0 * m_matches / alignedRegionLength;
+    int fullAdapterLength = m_adapterStart.tail - m_adapterEnd.tail + 1;
+    alignment.m_fullAdapterPercentIdentity = 100.0 * m_matches / fullAdapterLength;
 
-std::string ScoredAlignment::getString() {
-    return std::to_string(m_readStartPos) + "," + 
-           std::to_string(m_readEndPos) + "," + 
-           std::to_string(m_adapterStartPos) + "," + 
-           std::to_string(m_adapterEndPos) + "," + 
-           std::to_string(m_rawScore) + "," +
-           std::to_string(m_alignedRegionPercentIdentity) + "," +
-           std::to_string(m_fullAdapterPercentIdentity);
+    alignment.m_readStartPos = alignmentStart.readPos;
+    alignment.m_adapterStartPos = alignmentStart.adapterPos;
+    alignment.m_readEndPos = m_alignmentEnd.readPos;
+    alignment.m_adapterEndPos = m_alignmentEnd.adapterPos;
+    return alignment;
 }
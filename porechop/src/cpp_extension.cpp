@@ -0,0 +1,462 @@
+// This is a CPython extension module which gives Python direct access to the C++ functions. It is
+// used in place of loading cpp_functions.so with ctypes when it has been built, as it takes Python
+// strings as they are (no encoding or copying), gives up the GIL while aligning and returns Python
+// objects directly.
+
+#define PY_SSIZE_T_CLEAN
+#include <Python.h>
+
+#include <vector>
+#include "adapter_align.h"
+#include "end_trim.h"
+#include "middle_search.h"
+#include "minhash.h"
+#include "prefilter.h"
+#include "score_only_align.h"
+
+
+static PyTypeObject * alignmentResultType = NULL;
+
+static PyStructSequence_Field alignmentResultFields[] = {
+    {(char *)"read_start", NULL},
+    {(char *)"read_end", NULL},
+    {(char *)"adapter_start", NULL},
+    {(char *)"adapter_end", NULL},
+    {(char *)"raw_score", NULL},
+    {(char *)"aligned_region_percent_identity", NULL},
+    {(char *)"full_adapter_percent_identity", NULL},
+    {NULL, NULL}
+};
+
+// Alignment results are returned as struct sequences: tuples whose values can also be read by
+// name, like the fields of the AlignmentResult struct in ctypes.
+static PyStructSequence_Desc alignmentResultDesc = {
+    (char *)"porechop.cpp_extension.AlignmentResult",
+    NULL,
+    alignmentResultFields,
+    7
+};
+
+static const char * ADAPTER_PANEL_CAPSULE = "porechop.AdapterPanel";
+static const char * MIDDLE_ADAPTER_INDEX_CAPSULE = "porechop.MiddleAdapterIndex";
+
+
+// Sequences can be given as str or bytes. Either way, the object's own null-terminated buffer is
+// used (for an ASCII str, its UTF-8 form is its data), so nothing is copied.
+static char * getSequence(PyObject * object) {
+    if (PyBytes_Check(object))
+        return PyBytes_AS_STRING(object);
+    if (PyUnicode_Check(object))
+        return const_cast<char *>(PyUnicode_AsUTF8(object));
+    PyErr_SetString(PyExc_TypeError, "sequences must be str or bytes");
+    return NULL;
+}
+
+
+// Gets the sequences from a list (or other sequence) of str/bytes objects. The returned fast
+// sequence must be kept (and released by the caller) while the pointers are in use.
+static PyObject * getSequences(PyObject * object, std::vector<char *> & sequences) {
+    PyObject * fastSequence = PySequence_Fast(object, "sequences must be given in a list");
+    if (fastSequence == NULL)
+        return NULL;
+    Py_ssize_t count = PySequence_Fast_GET_SIZE(fastSequence);
+    PyObject ** items = PySequence_Fast_ITEMS(fastSequence);
+    for (Py_ssize_t i = 0; i < count; ++i) {
+        char * sequence = getSequence(items[i]);
+        if (sequence == NULL) {
+            Py_DECREF(fastSequence);
+            return NULL;
+        }
+        sequences.push_back(sequence);
+    }
+    return fastSequence;
+}
+
+
+static PyObject * makeAlignmentResult(AlignmentResult & result) {
+    PyObject * object = PyStructSequence_New(alignmentResultType);
+    if (object == NULL)
+        return NULL;
+    PyStructSequence_SET_ITEM(object, 0, PyLong_FromLong(result.readStart));
+    PyStructSequence_SET_ITEM(object, 1, PyLong_FromLong(result.readEnd));
+    PyStructSequence_SET_ITEM(object, 2, PyLong_FromLong(result.adapterStart));
+    PyStructSequence_SET_ITEM(object, 3, PyLong_FromLong(result.adapterEnd));
+    PyStructSequence_SET_ITEM(object, 4, PyLong_FromLong(result.rawScore));
+    PyStructSequence_SET_ITEM(object, 5, PyFloat_FromDouble(result.alignedRegionPercentIdentity));
+    PyStructSequence_SET_ITEM(object, 6, PyFloat_FromDouble(result.fullAdapterPercentIdentity));
+    return object;
+}
+
+
+static PyObject * makeHitList(std::vector<MiddleAdapterHit> & hits, int hitCount) {
+    PyObject * list = PyList_New(hitCount);
+    if (list == NULL)
+        return NULL;
+    for (int i = 0; i < hitCount; ++i) {
+        MiddleAdapterHit & hit = hits[i];
+        PyObject * tuple = Py_BuildValue("(iiid)", hit.adapterIndex, hit.readStart, hit.readEnd,
+                                         hit.fullAdapterPercentIdentity);
+        if (tuple == NULL) {
+            Py_DECREF(list);
+            return NULL;
+        }
+        PyList_SET_ITEM(list, i, tuple);
+    }
+    return list;
+}
+
+
+static void deleteAdapterPanelCapsule(PyObject * capsule) {
+    deleteAdapterPanel((AdapterPanel *)PyCapsule_GetPointer(capsule, ADAPTER_PANEL_CAPSULE));
+}
+
+
+static void deleteMiddleAdapterIndexCapsule(PyObject * capsule) {
+    deleteMiddleAdapterIndex((MiddleAdapterIndex *)PyCapsule_GetPointer(
+            capsule, MIDDLE_ADAPTER_INDEX_CAPSULE));
+}
+
+
+static PyObject * pyAdapterAlignment(PyObject *, PyObject * args) {
+    PyObject * readObject, * adapterObject;
+    int matchScore, mismatchScore, gapOpenScore, gapExtensionScore;
+    if (!PyArg_ParseTuple(args, "OOiiii", &readObject, &adapterObject, &matchScore,
+                          &mismatchScore, &gapOpenScore, &gapExtensionScore))
+        return NULL;
+    char * readSeq = getSequence(readObject);
+    char * adapterSeq = readSeq == NULL ? NULL : getSequence(adapterObject);
+    if (adapterSeq == NULL)
+        return NULL;
+    AlignmentResult result;
+    Py_BEGIN_ALLOW_THREADS
+    adapterAlignment(readSeq, adapterSeq, matchScore, mismatchScore, gapOpenScore,
+                     gapExtensionScore, &result);
+    Py_END_ALLOW_THREADS
+    return makeAlignmentResult(result);
+}
+
+
+static PyObject * pyScoreOnlyPanelAlignment(PyObject *, PyObject * args) {
+    PyObject * readObject, * panelCapsule;
+    int matchScore, mismatchScore, gapOpenScore, gapExtensionScore;
+    if (!PyArg_ParseTuple(args, "OOiiii", &readObject, &panelCapsule, &matchScore,
+                          &mismatchScore, &gapOpenScore, &gapExtensionScore))
+        return NULL;
+    char * readSeq = getSequence(readObject);
+    if (readSeq == NULL)
+        return NULL;
+    AdapterPanel * panel = (AdapterPanel *)PyCapsule_GetPointer(panelCapsule,
+                                                                ADAPTER_PANEL_CAPSULE);
+    if (panel == NULL)
+        return NULL;
+    std::vector<double> identities(panel->adapters.size());
+    Py_BEGIN_ALLOW_THREADS
+    scoreOnlyPanelAlignment(readSeq, panel, matchScore, mismatchScore, gapOpenScore,
+                            gapExtensionScore, identities.data());
+    Py_END_ALLOW_THREADS
+    PyObject * tuple = PyTuple_New(identities.size());
+    if (tuple == NULL)
+        return NULL;
+    for (size_t i = 0; i < identities.size(); ++i)
+        PyTuple_SET_ITEM(tuple, i, PyFloat_FromDouble(identities[i]));
+    return tuple;
+}
+
+
+static PyObject * pyCreateAdapterPanel(PyObject *, PyObject * args) {
+    PyObject * adaptersObject;
+    int engine;
+    if (!PyArg_ParseTuple(args, "Oi", &adaptersObject, &engine))
+        return NULL;
+    std::vector<char *> adapterSeqs;
+    PyObject * adapters = getSequences(adaptersObject, adapterSeqs);
+    if (adapters == NULL)
+        return NULL;
+    AdapterPanel * panel = createAdapterPanel(adapterSeqs.data(), adapterSeqs.size(), engine);
+    Py_DECREF(adapters);
+    return PyCapsule_New(panel, ADAPTER_PANEL_CAPSULE, deleteAdapterPanelCapsule);
+}
+
+
+static PyObject * pyCreateMiddleAdapterIndex(PyObject *, PyObject * args) {
+    PyObject * adaptersObject;
+    int kmerSize, engine;
+    if (!PyArg_ParseTuple(args, "Oii", &adaptersObject, &kmerSize, &engine))
+        return NULL;
+    std::vector<char *> adapterSeqs;
+    PyObject * adapters = getSequences(adaptersObject, adapterSeqs);
+    if (adapters == NULL)
+        return NULL;
+    MiddleAdapterIndex * index = createMiddleAdapterIndex(adapterSeqs.data(), adapterSeqs.size(),
+                                                          kmerSize, engine);
+    Py_DECREF(adapters);
+    return PyCapsule_New(index, MIDDLE_ADAPTER_INDEX_CAPSULE, deleteMiddleAdapterIndexCapsule);
+}
+
+
+// Like get_middle_hits in Python, the middle searches are given a one-hit array to stop them at the
+// first hit, and are otherwise repeated with a bigger array if theirs fills up.
+static PyObject * pySeededMiddleSearch(PyObject *, PyObject * args) {
+    PyObject * readObject, * indexCapsule;
+    int matchScore, mismatchScore, gapOpenScore, gapExtensionScore, firstHitOnly;
+    double minIdentity;
+    if (!PyArg_ParseTuple(args, "OOiiiidp", &readObject, &indexCapsule, &matchScore,
+                          &mismatchScore, &gapOpenScore, &gapExtensionScore, &minIdentity,
+                          &firstHitOnly))
+        return NULL;
+    char * readSeq = getSequence(readObject);
+    if (readSeq == NULL)
+        return NULL;
+    MiddleAdapterIndex * index = (MiddleAdapterIndex *)PyCapsule_GetPointer(
+            indexCapsule, MIDDLE_ADAPTER_INDEX_CAPSULE);
+    if (index == NULL)
+        return NULL;
+    int maxHits = firstHitOnly ? 1 : 64;
+    std::vector<MiddleAdapterHit> hits;
+    int hitCount;
+    Py_BEGIN_ALLOW_THREADS
+    while (true) {
+        hits.resize(maxHits);
+        hitCount = seededMiddleSearch(readSeq, index, matchScore, mismatchScore, gapOpenScore,
+                                      gapExtensionScore, minIdentity, hits.data(), maxHits);
+        if (hitCount < maxHits || firstHitOnly)
+            break;
+        maxHits *= 4;
+    }
+    Py_END_ALLOW_THREADS
+    return makeHitList(hits, hitCount);
+}
+
+
+// The full and multi-hit middle searches take the same arguments, so they share this.
+typedef int (*PanelMiddleSearch)(char *, AdapterPanel *, int, int, int, int, double,
+                                 MiddleAdapterHit *, int, int *);
+
+static PyObject * runPanelMiddleSearch(PyObject * args, PanelMiddleSearch search) {
+    PyObject * readObject, * panelCapsule;
+    int matchScore, mismatchScore, gapOpenScore, gapExtensionScore, firstHitOnly;
+    double minIdentity;
+    if (!PyArg_ParseTuple(args, "OOiiiidp", &readObject, &panelCapsule, &matchScore,
+                          &mismatchScore, &gapOpenScore, &gapExtensionScore, &minIdentity,
+                          &firstHitOnly))
+        return NULL;
+    char * readSeq = getSequence(readObject);
+    if (readSeq == NULL)
+        return NULL;
+    AdapterPanel * panel = (AdapterPanel *)PyCapsule_GetPointer(panelCapsule,
+                                                                ADAPTER_PANEL_CAPSULE);
+    if (panel == NULL)
+        return NULL;
+    int maxHits = firstHitOnly ? 1 : 64;
+    std::vector<MiddleAdapterHit> hits;
+    int hitCount, skippedCount;
+    Py_BEGIN_ALLOW_THREADS
+    while (true) {
+        hits.resize(maxHits);
+        hitCount = search(readSeq, panel, matchScore, mismatchScore, gapOpenScore,
+                          gapExtensionScore, minIdentity, hits.data(), maxHits, &skippedCount);
+        if (hitCount < maxHits || firstHitOnly)
+            break;
+        maxHits *= 4;
+    }
+    Py_END_ALLOW_THREADS
+    PyObject * hitList = makeHitList(hits, hitCount);
+    if (hitList == NULL)
+        return NULL;
+    return Py_BuildValue("(Ni)", hitList, skippedCount);
+}
+
+
+static PyObject * pyFullMiddleSearch(PyObject *, PyObject * args) {
+    return runPanelMiddleSearch(args, fullMiddleSearch);
+}
+
+
+static PyObject * pyMultiHitMiddleSearch(PyObject *, PyObject * args) {
+    return runPanelMiddleSearch(args, multiHitMiddleSearch);
+}
+
+
+static PyObject * makeEndHitList(std::vector<EndAdapterHit> & hits, int hitCount) {
+    PyObject * list = PyList_New(hitCount);
+    if (list == NULL)
+        return NULL;
+    for (int i = 0; i < hitCount; ++i) {
+        EndAdapterHit & hit = hits[i];
+        PyObject * tuple = Py_BuildValue("(iiiidd)", hit.readIndex, hit.adapterIndex,
+                                         hit.readStart, hit.readEnd,
+                                         hit.fullAdapterPercentIdentity,
+                                         hit.alignedRegionPercentIdentity);
+        if (tuple == NULL) {
+            Py_DECREF(list);
+            return NULL;
+        }
+        PyList_SET_ITEM(list, i, tuple);
+    }
+    return list;
+}
+
+
+static PyObject * makeIdentityTuple(std::vector<double> & identities, bool wanted) {
+    if (!wanted)
+        Py_RETURN_NONE;
+    PyObject * tuple = PyTuple_New(identities.size());
+    if (tuple == NULL)
+        return NULL;
+    for (size_t i = 0; i < identities.size(); ++i)
+        PyTuple_SET_ITEM(tuple, i, PyFloat_FromDouble(identities[i]));
+    return tuple;
+}
+
+
+static PyObject * pyTrimReadEnds(PyObject *, PyObject * args) {
+    PyObject * readsObject, * startPanelCapsule, * endPanelCapsule;
+    int endSize, extraTrimSize, minTrimSize, threadCount, getIdentities;
+    int matchScore, mismatchScore, gapOpenScore, gapExtensionScore;
+    double endThreshold;
+    if (!PyArg_ParseTuple(args, "OOOiidiiiiiip", &readsObject, &startPanelCapsule,
+                          &endPanelCapsule, &endSize, &extraTrimSize, &endThreshold,
+                          &minTrimSize, &matchScore, &mismatchScore, &gapOpenScore,
+                          &gapExtensionScore, &threadCount, &getIdentities))
+        return NULL;
+    AdapterPanel * startPanel = (AdapterPanel *)PyCapsule_GetPointer(startPanelCapsule,
+                                                                     ADAPTER_PANEL_CAPSULE);
+    AdapterPanel * endPanel = startPanel == NULL ? NULL :
+            (AdapterPanel *)PyCapsule_GetPointer(endPanelCapsule, ADAPTER_PANEL_CAPSULE);
+    if (endPanel == NULL)
+        return NULL;
+    std::vector<char *> readSeqs;
+    PyObject * reads = getSequences(readsObject, readSeqs);
+    if (reads == NULL)
+        return NULL;
+    size_t readCount = readSeqs.size();
+    std::vector<ReadEndTrim> trims(readCount);
+    std::vector<EndAdapterHit> startHits(readCount * startPanel->adapters.size());
+    std::vector<EndAdapterHit> endHits(readCount * endPanel->adapters.size());
+    std::vector<double> startIdentities, endIdentities;
+    if (getIdentities) {
+        startIdentities.resize(startHits.size());
+        endIdentities.resize(endHits.size());
+    }
+    int startHitCount, endHitCount;
+    Py_BEGIN_ALLOW_THREADS
+    trimReadEnds(readSeqs.data(), readCount, startPanel, endPanel, endSize, extraTrimSize,
+                 endThreshold, minTrimSize, matchScore, mismatchScore, gapOpenScore,
+                 gapExtensionScore, threadCount, trims.data(), startHits.data(), &startHitCount,
+                 endHits.data(), &endHitCount, getIdentities ? startIdentities.data() : NULL,
+                 getIdentities ? endIdentities.data() : NULL);
+    Py_END_ALLOW_THREADS
+    Py_DECREF(reads);
+
+    PyObject * trimList = PyList_New(readCount);
+    if (trimList == NULL)
+        return NULL;
+    for (size_t i = 0; i < readCount; ++i) {
+        PyObject * tuple = Py_BuildValue("(ii)", trims[i].startTrimAmount,
+                                         trims[i].endTrimAmount);
+        if (tuple == NULL) {
+            Py_DECREF(trimList);
+            return NULL;
+        }
+        PyList_SET_ITEM(trimList, i, tuple);
+    }
+    return Py_BuildValue("(NNNNN)", trimList, makeEndHitList(startHits, startHitCount),
+                         makeEndHitList(endHits, endHitCount),
+                         makeIdentityTuple(startIdentities, getIdentities),
+                         makeIdentityTuple(endIdentities, getIdentities));
+}
+
+
+static PyObject * pyAddToMinHashSketch(PyObject *, PyObject * args) {
+    PyObject * readsObject, * sketchObject;
+    int kmerSize, sketchSize;
+    if (!PyArg_ParseTuple(args, "OiiO", &readsObject, &kmerSize, &sketchSize, &sketchObject))
+        return NULL;
+    PyObject * sketchSequence = PySequence_Fast(sketchObject, "the sketch must be given in a list");
+    if (sketchSequence == NULL)
+        return NULL;
+    Py_ssize_t sketchCount = PySequence_Fast_GET_SIZE(sketchSequence);
+    std::vector<uint64_t> sketch(std::max(Py_ssize_t(sketchSize), sketchCount));
+    for (Py_ssize_t i = 0; i < sketchCount; ++i) {
+        sketch[i] = PyLong_AsUnsignedLongLong(PySequence_Fast_GET_ITEM(sketchSequence, i));
+        if (PyErr_Occurred()) {
+            Py_DECREF(sketchSequence);
+            return NULL;
+        }
+    }
+    Py_DECREF(sketchSequence);
+    std::vector<char *> readSeqs;
+    PyObject * reads = getSequences(readsObject, readSeqs);
+    if (reads == NULL)
+        return NULL;
+    int count;
+    Py_BEGIN_ALLOW_THREADS
+    count = addToMinHashSketch(readSeqs.data(), readSeqs.size(), kmerSize, sketchSize,
+                               sketch.data(), sketchCount);
+    Py_END_ALLOW_THREADS
+    Py_DECREF(reads);
+
+    PyObject * sketchList = PyList_New(count);
+    if (sketchList == NULL)
+        return NULL;
+    for (int i = 0; i < count; ++i) {
+        PyObject * hash = PyLong_FromUnsignedLongLong(sketch[i]);
+        if (hash == NULL) {
+            Py_DECREF(sketchList);
+            return NULL;
+        }
+        PyList_SET_ITEM(sketchList, i, hash);
+    }
+    return sketchList;
+}
+
+
+static PyMethodDef moduleMethods[] = {
+    {"adapter_alignment", pyAdapterAlignment, METH_VARARGS,
+     "Aligns an adapter to a read, returning an AlignmentResult."},
+    {"score_only_panel_alignment", pyScoreOnlyPanelAlignment, METH_VARARGS,
+     "Returns a tuple of full adapter identities in a read, one per adapter in a panel."},
+    {"create_adapter_panel", pyCreateAdapterPanel, METH_VARARGS,
+     "Makes an adapter panel from a list of adapter sequences and an alignment engine."},
+    {"create_middle_adapter_index", pyCreateMiddleAdapterIndex, METH_VARARGS,
+     "Makes a middle adapter index from a list of adapter sequences, a k-mer size and an engine."},
+    {"seeded_middle_search", pySeededMiddleSearch, METH_VARARGS,
+     "Returns the middle adapter hits in a read, found with a middle adapter index."},
+    {"full_middle_search", pyFullMiddleSearch, METH_VARARGS,
+     "Returns the middle adapter hits in a read and the number of alignments skipped."},
+    {"multi_hit_middle_search", pyMultiHitMiddleSearch, METH_VARARGS,
+     "Returns the middle adapter hits in a read and the number of adapters skipped."},
+    {"trim_read_ends", pyTrimReadEnds, METH_VARARGS,
+     "Decides how much to trim from both ends of many reads, using its own threads."},
+    {"add_to_minhash_sketch", pyAddToMinHashSketch, METH_VARARGS,
+     "Adds the canonical k-mers of reads to a bottom-k MinHash sketch, returning the new sketch."},
+    {NULL, NULL, 0, NULL}
+};
+
+static struct PyModuleDef moduleDef = {
+    PyModuleDef_HEAD_INIT,
+    "cpp_extension",
+    "Porechop's C++ functions, called directly from Python.",
+    -1,
+    moduleMethods,
+    NULL, NULL, NULL, NULL
+};
+
+
+PyMODINIT_FUNC PyInit_cpp_extension(void) {
+    if (alignmentResultType == NULL) {
+        alignmentResultType = PyStructSequence_NewType(&alignmentResultDesc);
+        if (alignmentResultType == NULL)
+            return NULL;
+    }
+    PyObject * module = PyModule_Create(&moduleDef);
+    if (module == NULL)
+        return NULL;
+    Py_INCREF(alignmentResultType);
+    if (PyModule_AddObject(module, "AlignmentResult", (PyObject *)alignmentResultType) < 0) {
+        Py_DECREF(alignmentResultType);
+        Py_DECREF(module);
+        return NULL;
+    }
+    return module;
+}
@@ -0,0 +1,138 @@
+#include "end_trim.h"
+
+#include <algorithm>
+#include <atomic>
+#include <cmath>
+#include <cstring>
+#include <string>
+#include <thread>
+
+
+// Finds the adapters at the start and end of many reads and decides how much to trim from each
+// end. An adapter alignment is a hit if its aligned region identity is above endThreshold, it
+// covers at least minTrimSize read bases and it doesn't run to the inner edge of the read end
+// (the last base of the read start, or the first base of the read end). Each hit would trim the
+// read up to the far side of the adapter plus extraTrimSize bases, and the largest of these is the
+// end's trim amount. The reads are shared among the given number of threads (this one included)
+// in blocks, and each block's read ends are aligned to the adapter panels together.
+//
+// The trim amounts are written to trims (one per read). The alignments which met the trimming
+// criteria are written to startHits and endHits, in read order, with their counts. These arrays
+// must have room for read count * adapter count hits. If startIdentities and endIdentities aren't
+// null, every alignment's full adapter identity is written to them (for barcode scores), the
+// identities for read r starting at r * adapter count.
+void trimReadEnds(char ** readSeqs, int readCount,
+                  AdapterPanel * startPanel, AdapterPanel * endPanel,
+                  int endSize, int extraTrimSize, double endThreshold, int minTrimSize,
+                  int matchScore, int mismatchScore, int gapOpenScore,
+                  int gapExtensionScore, int threadCount, ReadEndTrim * trims,
+                  EndAdapterHit * startHits, int * startHitCount,
+                  EndAdapterHit * endHits, int * endHitCount,
+                  double * startIdentities, double * endIdentities) {
+    EndTrimSettings settings = {endSize, extraTrimSize, endThreshold, minTrimSize,
+                                matchScore, mismatchScore, gapOpenScore, gapExtensionScore};
+    int blockCount = (readCount + END_TRIM_BLOCK_SIZE - 1) / END_TRIM_BLOCK_SIZE;
+    std::vector<std::vector<EndAdapterHit> > blockStartHits(blockCount), blockEndHits(blockCount);
+
+    std::atomic<int> nextBlock(0);
+    auto trimBlocks = [&]() {
+        int b;
+        while ((b = nextBlock++) < blockCount) {
+            int blockStart = b * END_TRIM_BLOCK_SIZE;
+            int blockEnd = std::min(readCount, blockStart + END_TRIM_BLOCK_SIZE);
+            trimReadEndBlock(readSeqs, blockStart, blockEnd, startPanel, endPanel, settings,
+                             trims, blockStartHits[b], blockEndHits[b], startIdentities,
+                             endIdentities);
+        }
+    };
+    std::vector<std::thread> threads;
+    for (int t = 1; t < std::min(threadCount, blockCount); ++t)
+        threads.push_back(std::thread(trimBlocks));
+    trimBlocks();
+    for (auto & thread : threads)
+        thread.join();
+
+    *startHitCount = 0;
+    *endHitCount = 0;
+    for (int b = 0; b < blockCount; ++b) {
+        for (EndAdapterHit const & hit : blockStartHits[b])
+            startHits[(*startHitCount)++] = hit;
+        for (EndAdapterHit const & hit : blockEndHits[b])
+            endHits[(*endHitCount)++] = hit;
+    }
+}
+
+
+// Trims the ends of the reads from blockStart to blockEnd (exclusive). The start (and end) of a
+// read is its first (and last) endSize bases, or the whole read if it's shorter.
+void trimReadEndBlock(char ** readSeqs, int blockStart, int blockEnd,
+                      AdapterPanel * startPanel, AdapterPanel * endPanel,
+                      EndTrimSettings const & settings, ReadEndTrim * trims,
+                      std::vector<EndAdapterHit> & startHits,
+                      std::vector<EndAdapterHit> & endHits,
+                      double * startIdentities, double * endIdentities) {
+    int blockReadCount = blockEnd - blockStart;
+    std::vector<Dna5String> readStarts(blockReadCount), readEnds(blockReadCount);
+    for (int i = 0; i < blockReadCount; ++i) {
+        char * readSeq = readSeqs[blockStart + i];
+        int readLength = strlen(readSeq);
+        int endLength = std::min(readLength, settings.endSize);
+        readStarts[i] = std::string(readSeq, endLength).c_str();
+        readEnds[i] = std::string(readSeq + readLength - endLength, endLength).c_str();
+    }
+
+    int startAdapterCount = startPanel->adapters.size();
+    int endAdapterCount = endPanel->adapters.size();
+    std::vector<AlignmentResult> startResults(blockReadCount * startAdapterCount);
+    std::vector<AlignmentResult> endResults(blockReadCount * endAdapterCount);
+    alignReadsToPanel(readStarts, startPanel, settings.matchScore, settings.mismatchScore,
+                      settings.gapOpenScore, settings.gapExtensionScore, startResults.data());
+    alignReadsToPanel(readEnds, endPanel, settings.matchScore, settings.mismatchScore,
+                      settings.gapOpenScore, settings.gapExtensionScore, endResults.data());
+
+    // A failed alignment (read start -1) counts as ending at 0 with no identity, so it is never a
+    // hit. Identities are rounded to six decimal places before comparing to the threshold.
+    for (int i = 0; i < blockReadCount; ++i) {
+        int r = blockStart + i;
+        trims[r] = {0, 0};
+        for (int a = 0; a < startAdapterCount; ++a) {
+            EndAdapterHit hit = endAdapterHit(r, a, startResults[i * startAdapterCount + a]);
+            if (startIdentities != NULL)
+                startIdentities[r * startAdapterCount + a] = hit.fullAdapterPercentIdentity;
+            if (roundIdentity(hit.alignedRegionPercentIdentity) > settings.endThreshold &&
+                    hit.readEnd != settings.endSize &&
+                    hit.readEnd - hit.readStart >= settings.minTrimSize) {
+                trims[r].startTrimAmount = std::max(trims[r].startTrimAmount,
+                                                    hit.readEnd + settings.extraTrimSize);
+                startHits.push_back(hit);
+            }
+        }
+        for (int a = 0; a < endAdapterCount; ++a) {
+            EndAdapterHit hit = endAdapterHit(r, a, endResults[i * endAdapterCount + a]);
+            if (endIdentities != NULL)
+                endIdentities[r * endAdapterCount + a] = hit.fullAdapterPercentIdentity;
+            if (roundIdentity(hit.alignedRegionPercentIdentity) > settings.endThreshold &&
+                    hit.readStart != 0 &&
+                    hit.readEnd - hit.readStart >= settings.minTrimSize) {
+                trims[r].endTrimAmount = std::max(trims[r].endTrimAmount,
+                                                  settings.endSize - hit.readStart +
+                                                  settings.extraTrimSize);
+                endHits.push_back(hit);
+            }
+        }
+    }
+}
+
+
+EndAdapterHit endAdapterHit(int readIndex, int adapterIndex, AlignmentResult const & result) {
+    if (result.readStart == -1)
+        return {readIndex, adapterIndex, -1, 0, 0.0, 0.0};
+    return {readIndex, adapterIndex, result.readStart, result.readEnd + 1,
+            result.fullAdapterPercentIdentity, result.alignedRegionPercentIdentity};
+}
+
+
+// Rounds an identity to six decimal places, as Python does with the alignment results.
+double roundIdentity(double identity) {
+    return std::round(identity * 1000000.0) / 1000000.0;
+}
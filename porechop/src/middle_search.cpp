@@ -0,0 +1,375 @@
+#include "middle_search.h"
+#include "prefilter.h"
+#include "simd_align.h"
+#include "score_only_align.h"
+
+#include <seqan/find.h>
+#include <algorithm>
+#include <cmath>
+
+
+// Builds the k-mer index for a set of middle adapters. K-mers containing an N are left out.
+MiddleAdapterIndex * createMiddleAdapterIndex(char ** adapterSeqs, int adapterCount,
+                                              int kmerSize, int engine) {
+    MiddleAdapterIndex * index = new MiddleAdapterIndex;
+    index->kmerSize = kmerSize;
+    index->engine = AlignmentEngine(engine);
+    uint32_t kmerMask = (uint32_t(1) << (2 * kmerSize)) - 1;
+    for (int a = 0; a < adapterCount; ++a) {
+        index->adapters.push_back(Dna5String(adapterSeqs[a]));
+        index->adapterLengths.push_back(length(adapterSeqs[a]));
+        Dna5String & adapter = index->adapters.back();
+        uint32_t kmer = 0;
+        int validBases = 0;
+        for (int i = 0; i < index->adapterLengths.back(); ++i) {
+            int code = ordValue(adapter[i]);
+            validBases = (code < 4) ? validBases + 1 : 0;
+            kmer = ((kmer << 2) | (code & 3)) & kmerMask;
+            if (validBases >= kmerSize)
+                index->kmerPositions[kmer].push_back(std::make_pair(a, i - kmerSize + 1));
+        }
+    }
+    return index;
+}
+
+
+void deleteMiddleAdapterIndex(MiddleAdapterIndex * index) {
+    delete index;
+}
+
+
+// Searches a read for middle adapters, writing the hits to the given array and returning how many
+// there are. Like the full search, this takes the adapters in order and, for each, keeps finding
+// its best alignment and masking it out for as long as the alignment reaches the minimum identity.
+// But instead of aligning to the whole read, the adapter is only aligned to windows around its
+// k-mer seeds, and an adapter without seeds isn't aligned at all.
+int seededMiddleSearch(char * readSeq, MiddleAdapterIndex * index,
+                       int matchScore, int mismatchScore, int gapOpenScore,
+                       int gapExtensionScore, double minIdentity,
+                       MiddleAdapterHit * hits, int maxHits) {
+    Dna5String read = readSeq;
+    int readLength = length(readSeq);
+    int kmerSize = index->kmerSize;
+    int adapterCount = index->adapters.size();
+
+    // Every read k-mer found in the index gives a seed for that adapter.
+    std::vector<std::vector<Seed> > seeds(adapterCount);
+    uint32_t kmerMask = (uint32_t(1) << (2 * kmerSize)) - 1;
+    uint32_t kmer = 0;
+    int validBases = 0;
+    for (int j = 0; j < readLength; ++j) {
+        int code = ordValue(read[j]);
+        validBases = (code < 4) ? validBases + 1 : 0;
+        kmer = ((kmer << 2) | (code & 3)) & kmerMask;
+        if (validBases < kmerSize)
+            continue;
+        auto found = index->kmerPositions.find(kmer);
+        if (found == index->kmerPositions.end())
+            continue;
+        int readPos = j - kmerSize + 1;
+        for (auto const & adapterAndPos : found->second)
+            seeds[adapterAndPos.first].push_back({readPos - adapterAndPos.second, readPos});
+    }
+
+    std::vector<char> masked(readLength, 0);
+    int hitCount = 0;
+    for (int a = 0; a < adapterCount && hitCount < maxHits; ++a) {
+        Dna5String & adapter = index->adapters[a];
+        int adapterLength = index->adapterLengths[a];
+        int minScore = minScoreForIdentity(adapterLength, minIdentity, matchScore, mismatchScore,
+                                           gapOpenScore, gapExtensionScore);
+        while (hitCount < maxHits) {
+            std::vector<std::pair<int, int> > windows = seedWindows(seeds[a], adapterLength,
+                                                                    readLength, kmerSize, masked);
+            if (windows.empty())
+                break;
+
+            // The best scoring window alignment (the first, if tied) is the adapter's hit. Windows
+            // whose alignments can't reach the minimum identity are left out, as they could only
+            // be the best if no window reached it.
+            bool found = false;
+            int bestScore = 0;
+            AlignmentResult best;
+            for (auto const & window : windows) {
+                AlignmentResult result = alignAdapterInWindow(read, window.first, window.second,
+                                                              adapter, adapterLength,
+                                                              index->engine, matchScore,
+                                                              mismatchScore, gapOpenScore,
+                                                              gapExtensionScore, minScore);
+                if (result.readStart == -1)
+                    continue;
+                if (!found || result.rawScore > bestScore) {
+                    found = true;
+                    bestScore = result.rawScore;
+                    best = result;
+                }
+            }
+
+            // Identities are rounded as they are in Python before comparing to the threshold.
+            if (!found)
+                break;
+            double identity = std::round(best.fullAdapterPercentIdentity * 1000000.0) / 1000000.0;
+            if (identity < minIdentity)
+                break;
+            hits[hitCount++] = {a, best.readStart, best.readEnd + 1, identity};
+            for (int j = best.readStart; j <= best.readEnd; ++j) {
+                masked[j] = 1;
+                read[j] = 'N';
+            }
+        }
+    }
+    return hitCount;
+}
+
+
+// Turns an adapter's seeds into windows of the read to align it to. Each window spans the
+// adapter's position on the seed's diagonal, with room on both sides for indels, and overlapping
+// windows are merged. Seeds which overlap masked bases (earlier hits) are ignored.
+std::vector<std::pair<int, int> > seedWindows(std::vector<Seed> & seeds, int adapterLength,
+                                              int readLength, int kmerSize,
+                                              std::vector<char> & masked) {
+    std::vector<std::pair<int, int> > seedSpans;
+    int margin = adapterLength / 2 + kmerSize;
+    for (Seed const & seed : seeds) {
+        bool seedMasked = false;
+        for (int j = seed.readPos; j < seed.readPos + kmerSize; ++j)
+            seedMasked = seedMasked || masked[j];
+        if (!seedMasked)
+            seedSpans.push_back(std::make_pair(std::max(0, seed.diagonal - margin),
+                                               std::min(readLength, seed.diagonal + adapterLength +
+                                                                    margin)));
+    }
+    std::sort(seedSpans.begin(), seedSpans.end());
+    std::vector<std::pair<int, int> > windows;
+    for (auto const & span : seedSpans) {
+        if (!windows.empty() && span.first <= windows.back().second)
+            windows.back().second = std::max(windows.back().second, span.second);
+        else
+            windows.push_back(span);
+    }
+    return windows;
+}
+
+
+// Searches a read for the adapters in a panel, writing the hits to the given array and returning
+// how many there are. This is the default middle search: each adapter in turn is aligned to the
+// whole read, and for as long as its best alignment reaches the minimum identity, that hit is kept
+// and masked out of the read and the adapter is aligned again. The alignments are SeqAn's, so the
+// hits (including which of equally scoring alignments is taken) are those adapterAlignment gives.
+// Two lossless bounds make this cheaper without changing the hits. Before each alignment, Myers'
+// bit-parallel search checks that the whole adapter occurs in the read with few enough edits to
+// reach the minimum identity; if not, the alignment is skipped and counted in skippedCount. Then
+// the score-only DP, which leaves out cells that can't reach the matching minimum score, finds the
+// identity, so a traceback is only done for a hit.
+int fullMiddleSearch(char * readSeq, AdapterPanel * panel,
+                     int matchScore, int mismatchScore, int gapOpenScore,
+                     int gapExtensionScore, double minIdentity,
+                     MiddleAdapterHit * hits, int maxHits, int * skippedCount) {
+    Dna5String read = readSeq;
+    int readLength = length(readSeq);
+    int adapterCount = panel->adapters.size();
+    Score<int, Simple> scoringScheme(matchScore, mismatchScore, gapExtensionScore, gapOpenScore);
+    *skippedCount = 0;
+
+    int hitCount = 0;
+    for (int a = 0; a < adapterCount && hitCount < maxHits; ++a) {
+        Dna5String & adapter = panel->adapters[a];
+        int adapterLength = panel->adapterLengths[a];
+        int maxEdits = maxEditsForIdentity(adapterLength, minIdentity);
+        int minScore = minScoreForIdentity(adapterLength, minIdentity, matchScore, mismatchScore,
+                                           gapOpenScore, gapExtensionScore);
+        while (hitCount < maxHits) {
+            if (maxEdits < adapterLength && !adapterWithinEditDistance(read, adapter, maxEdits)) {
+                ++*skippedCount;
+                break;
+            }
+
+            // Identities are rounded as they are in Python before comparing to the threshold.
+            double identity = fullAdapterIdentity(read, readLength, adapter, adapterLength,
+                                                  matchScore, mismatchScore, gapOpenScore,
+                                                  gapExtensionScore, minScore);
+            if (identity == BELOW_MIN_SCORE ||
+                    std::round(identity * 1000000.0) / 1000000.0 < minIdentity)
+                break;
+            AlignmentResult result;
+            alignReadToAdapter(read, readLength, adapter, adapterLength,
+                               scoringScheme).getResult(&result);
+            if (result.readStart == -1)
+                break;
+            identity = std::round(result.fullAdapterPercentIdentity * 1000000.0) / 1000000.0;
+            hits[hitCount++] = {a, result.readStart, result.readEnd + 1, identity};
+            for (int j = result.readStart; j <= result.readEnd; ++j)
+                read[j] = 'N';
+        }
+    }
+    return hitCount;
+}
+
+
+// Searches a read for the adapters in a panel, writing the hits to the given array and returning
+// how many there are. This gives up the full search's exact hits for speed. Each adapter is found
+// in one pass over the read: Myers' bit-parallel search
+// reports every position where the whole adapter ends with few enough edits to reach the minimum
+// identity, and each run of such positions is one occurrence. Only the window around each
+// occurrence is aligned. The alignments are then taken best first, like the full search takes
+// them, and earlier hits are masked in the windows of later ones, so hits don't overlap. Adapters
+// which occur nowhere in the read are counted in skippedCount.
+//
+// The hits can differ from the full search's in two ways. An alignment within a window can break a
+// tie between equally scoring alignments differently from one over the whole read, moving a hit's
+// end by a base. And every occurrence reaching the minimum identity is a hit, whereas the full
+// search stops at an adapter's first alignment below it, so it can miss occurrences after that
+// (most often for short adapters like the GTG repeats, which have many near matches).
+int multiHitMiddleSearch(char * readSeq, AdapterPanel * panel,
+                         int matchScore, int mismatchScore, int gapOpenScore,
+                         int gapExtensionScore, double minIdentity,
+                         MiddleAdapterHit * hits, int maxHits, int * skippedCount) {
+    Dna5String read = readSeq;
+    int readLength = length(readSeq);
+    int adapterCount = panel->adapters.size();
+    *skippedCount = 0;
+
+    std::vector<char> masked(readLength, 0);
+    int hitCount = 0;
+    for (int a = 0; a < adapterCount && hitCount < maxHits; ++a) {
+        Dna5String & adapter = panel->adapters[a];
+        int adapterLength = panel->adapterLengths[a];
+        int maxEdits = maxEditsForIdentity(adapterLength, minIdentity);
+
+        // The windows have already passed the edit distance filter, so a score-only check before
+        // each SeqAn alignment would almost never leave one out. SIMD alignments just skip the
+        // traceback for a window below the minimum score, which costs nothing extra.
+        int minScore = NO_MIN_SCORE;
+        if (panel->engine != SEQAN_ENGINE)
+            minScore = minScoreForIdentity(adapterLength, minIdentity, matchScore, mismatchScore,
+                                           gapOpenScore, gapExtensionScore);
+        std::vector<std::pair<int, int> > windows = occurrenceWindows(read, readLength, adapter,
+                                                                      adapterLength, maxEdits);
+        if (windows.empty()) {
+            ++*skippedCount;
+            continue;
+        }
+
+        std::vector<std::pair<AlignmentResult, int> > candidates;
+        for (size_t w = 0; w < windows.size(); ++w) {
+            AlignmentResult result = alignAdapterInWindow(read, windows[w].first,
+                                                          windows[w].second, adapter,
+                                                          adapterLength, panel->engine,
+                                                          matchScore, mismatchScore,
+                                                          gapOpenScore, gapExtensionScore,
+                                                          minScore);
+            if (result.readStart != -1)
+                candidates.push_back(std::make_pair(result, int(w)));
+        }
+        std::stable_sort(candidates.begin(), candidates.end(),
+                         [](std::pair<AlignmentResult, int> const & x,
+                            std::pair<AlignmentResult, int> const & y) {
+                             return x.first.rawScore > y.first.rawScore; });
+
+        // A candidate overlapping an earlier hit is realigned with that hit's bases masked, as it
+        // would have been if it had been aligned after that hit was found. Masking can only lower
+        // a window's best score, so windows left out for their score would still be left out.
+        for (auto & candidate : candidates) {
+            if (hitCount >= maxHits)
+                break;
+            AlignmentResult & result = candidate.first;
+            bool overlapsHit = false;
+            for (int j = result.readStart; j <= result.readEnd; ++j)
+                overlapsHit = overlapsHit || masked[j];
+            if (overlapsHit) {
+                std::pair<int, int> const & window = windows[candidate.second];
+                result = alignAdapterInWindow(read, window.first, window.second, adapter,
+                                              adapterLength, panel->engine, matchScore,
+                                              mismatchScore, gapOpenScore, gapExtensionScore,
+                                              minScore);
+                if (result.readStart == -1)
+                    continue;
+            }
+
+            // Identities are rounded as they are in Python before comparing to the threshold.
+            double identity = std::round(result.fullAdapterPercentIdentity * 1000000.0) /
+                              1000000.0;
+            if (identity < minIdentity)
+                continue;
+            hits[hitCount++] = {a, result.readStart, result.readEnd + 1, identity};
+            for (int j = result.readStart; j <= result.readEnd; ++j) {
+                masked[j] = 1;
+                read[j] = 'N';
+            }
+        }
+    }
+    return hitCount;
+}
+
+
+// Finds where in a read the whole adapter occurs with at most the given number of edits, in a
+// single pass of Myers' bit-parallel search, and returns a window of the read to align the adapter
+// to for each occurrence. An occurrence shows up as a run of consecutive end positions, as its
+// edit distance rises above the maximum on either side of the best end. The window spans every
+// alignment of the adapter ending in the run with no more than the maximum edits, plus the same
+// again on both sides, so the best scoring alignment there isn't cut short.
+std::vector<std::pair<int, int> > occurrenceWindows(Dna5String & readSeq, int readLength,
+                                                    Dna5String & adapterSeq, int adapterLength,
+                                                    int maxEdits) {
+    std::vector<std::pair<int, int> > windows;
+    if (maxEdits < 0 || readLength == 0)
+        return windows;
+    Finder<Dna5String> finder(readSeq);
+    Pattern<Dna5String, MyersUkkonen> pattern(adapterSeq);
+    int runStart = -1, runEnd = -1;
+    while (true) {
+        bool found = find(finder, pattern, -maxEdits);
+        int endPos = found ? int(position(finder)) : -1;
+        if (found && runStart != -1 && endPos == runEnd + 1) {
+            runEnd = endPos;
+            continue;
+        }
+        if (runStart != -1) {
+            int windowStart = std::max(0, runStart - adapterLength - 2 * maxEdits + 1);
+            int windowEnd = std::min(readLength, runEnd + 1 + maxEdits);
+            windows.push_back(std::make_pair(windowStart, windowEnd));
+        }
+        if (!found)
+            break;
+        runStart = runEnd = endPos;
+    }
+    return windows;
+}
+
+
+// Aligns an adapter to the part of a read between windowStart and windowEnd, with the engine's
+// aligner if it can do the alignment and SeqAn's if not. The read coordinates in the result are
+// for the whole read. If the best alignment scores below minScore, the result is a failed one
+// (readStart of -1) and there is no traceback. Before a SeqAn alignment, this is checked with the
+// score-only DP, which leaves out cells that can't reach minScore.
+AlignmentResult alignAdapterInWindow(Dna5String & readSeq, int windowStart, int windowEnd,
+                                     Dna5String & adapterSeq, int adapterLength,
+                                     AlignmentEngine engine, int matchScore, int mismatchScore,
+                                     int gapOpenScore, int gapExtensionScore, int minScore) {
+    int windowLength = windowEnd - windowStart;
+    static thread_local Dna5String windowSeq;
+    windowSeq = infix(readSeq, windowStart, windowEnd);
+    AlignmentResult result;
+    if (engine != SEQAN_ENGINE &&
+            simdAlignmentPossible(windowLength, adapterLength, matchScore, mismatchScore,
+                                  gapOpenScore, gapExtensionScore))
+        simdAlignReadToAdapter(windowSeq, windowLength, adapterSeq, adapterLength, matchScore,
+                               mismatchScore, gapOpenScore, gapExtensionScore,
+                               minScore).getResult(&result);
+    else if (minScore != NO_MIN_SCORE &&
+             fullAdapterIdentity(windowSeq, windowLength, adapterSeq, adapterLength, matchScore,
+                                 mismatchScore, gapOpenScore, gapExtensionScore,
+                                 minScore) == BELOW_MIN_SCORE)
+        result.readStart = -1;
+    else {
+        Score<int, Simple> scoringScheme(matchScore, mismatchScore, gapExtensionScore,
+                                         gapOpenScore);
+        alignReadToAdapter(windowSeq, windowLength, adapterSeq, adapterLength,
+                           scoringScheme).getResult(&result);
+    }
+    if (result.readStart != -1) {
+        result.readStart += windowStart;
+        result.readEnd += windowStart;
+    }
+    return result;
+}
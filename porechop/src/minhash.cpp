@@ -0,0 +1,71 @@
+#include "minhash.h"
+
+#include <algorithm>
+#include <iterator>
+#include <set>
+
+
+// Adds the canonical k-mers of some reads to a bottom-k MinHash sketch: the sketchSize smallest
+// distinct k-mer hashes seen. The sketch array must have room for sketchSize hashes, and its first
+// sketchCount values are the sketch so far (in ascending order). The new sketch is written back to
+// it in ascending order and its size is returned. As the sketch of a union of reads is the bottom-k
+// of their sketches, reads can be added in any number of calls, in any order.
+//
+// A k-mer is canonical in the smaller (as two bits per base) of itself and its reverse complement,
+// so a read and its reverse complement give the same sketch. K-mers with bases other than
+// A/C/G/T are skipped.
+int addToMinHashSketch(char ** readSeqs, int readCount, int kmerSize, int sketchSize,
+                       uint64_t * sketch, int sketchCount) {
+    if (kmerSize < 1 || kmerSize > MAX_SKETCH_KMER_SIZE || sketchSize < 1)
+        return sketchCount;
+    std::set<uint64_t> hashes(sketch, sketch + sketchCount);
+    uint64_t mask = kmerSize == 32 ? ~uint64_t(0) : (uint64_t(1) << (2 * kmerSize)) - 1;
+    int reverseShift = 2 * (kmerSize - 1);
+
+    // Once the sketch is full, only hashes below its largest can get in.
+    uint64_t largest = hashes.empty() ? 0 : *hashes.rbegin();
+    bool full = int(hashes.size()) >= sketchSize;
+
+    for (int r = 0; r < readCount; ++r) {
+        uint64_t forward = 0, reverse = 0;
+        int validBases = 0;
+        for (char * base = readSeqs[r]; *base != '\0'; ++base) {
+            uint64_t code;
+            switch (*base) {
+                case 'A': case 'a': code = 0; break;
+                case 'C': case 'c': code = 1; break;
+                case 'G': case 'g': code = 2; break;
+                case 'T': case 't': code = 3; break;
+                default: validBases = 0; continue;
+            }
+            forward = ((forward << 2) | code) & mask;
+            reverse = (reverse >> 2) | ((3 - code) << reverseShift);
+            if (++validBases < kmerSize)
+                continue;
+            uint64_t hash = hashKmer(std::min(forward, reverse));
+            if (full && hash >= largest)
+                continue;
+            if (!hashes.insert(hash).second)
+                continue;
+            if (int(hashes.size()) > sketchSize)
+                hashes.erase(std::prev(hashes.end()));
+            full = int(hashes.size()) >= sketchSize;
+            largest = *hashes.rbegin();
+        }
+    }
+
+    std::copy(hashes.begin(), hashes.end(), sketch);
+    return hashes.size();
+}
+
+
+// MurmurHash3's 64-bit finaliser. It is a bijection, so distinct k-mers get distinct hashes, and
+// it spreads them evenly, which is all a bottom-k sketch needs.
+uint64_t hashKmer(uint64_t kmer) {
+    kmer ^= kmer >> 33;
+    kmer *= 0xff51afd7ed558ccdULL;
+    kmer ^= kmer >> 33;
+    kmer *= 0xc4ceb9fe1a85ec53ULL;
+    kmer ^= kmer >> 33;
+    return kmer;
+}
@@ -0,0 +1,58 @@
+#include "prefilter.h"
+#include "score_only_align.h"
+
+#include <seqan/find.h>
+#include <algorithm>
+#include <cmath>
+#include <limits>
+
+
+// An alignment's full adapter identity is M / (M + E), where M is the number of matches and E the
+// number of edits (mismatches and gaps) between the adapter's first and last bases. M can't be
+// more than the adapter length, so an identity of at least t needs E <= length * (100 - t) / t.
+// One extra edit is allowed so floating point rounding can never make this exclude a real hit.
+// A negative value means no alignment can reach the identity.
+int maxEditsForIdentity(int adapterLength, double minIdentity) {
+    if (minIdentity <= 0.0)
+        return adapterLength;
+    if (minIdentity > 100.0)
+        return -1;
+    double maxEdits = adapterLength * (100.0 - minIdentity) / minIdentity;
+    return std::min(adapterLength, int(std::floor(maxEdits)) + 1);
+}
+
+
+// The lowest raw score an alignment reaching the minimum full adapter identity can have. As above,
+// it has M matches and E <= M * (100 - t) / t edits, with M at least length * t / 100. Each match
+// gets the match score, and each edit (a mismatch or a gap column, free or not) gets no less than
+// the lowest of the other scores, so the score can't be below the smallest M * match + E * lowest.
+// One match fewer and one edit more are allowed for floating point rounding. Positive gap scores
+// give no minimum, and a minimum identity over 100 gives a score no alignment can reach.
+int minScoreForIdentity(int adapterLength, double minIdentity, int matchScore, int mismatchScore,
+                        int gapOpenScore, int gapExtensionScore) {
+    if (minIdentity <= 0.0 || gapOpenScore > 0 || gapExtensionScore > 0)
+        return NO_MIN_SCORE;
+    if (minIdentity > 100.0)
+        return std::max(std::max(matchScore, mismatchScore), 0) * adapterLength + 1;
+    int lowestEditScore = std::min(std::min(mismatchScore, gapOpenScore),
+                                   std::min(gapExtensionScore, 0));
+    int minMatches = std::max(0, int(std::ceil(adapterLength * minIdentity / 100.0)) - 1);
+    int minScore = std::numeric_limits<int>::max();
+    for (int matches = minMatches; matches <= adapterLength; ++matches) {
+        int maxEdits = int(std::floor(matches * (100.0 - minIdentity) / minIdentity)) + 1;
+        minScore = std::min(minScore, matches * matchScore + maxEdits * lowestEditScore);
+    }
+    return minScore;
+}
+
+
+// Returns whether the whole adapter matches some part of the read with at most the given number of
+// edits. The edits within any alignment of the adapter to the read are at least this minimum, so if
+// this returns false, every alignment has more edits.
+bool adapterWithinEditDistance(Dna5String & readSeq, Dna5String & adapterSeq, int maxEdits) {
+    if (maxEdits < 0)
+        return false;
+    Finder<Dna5String> finder(readSeq);
+    Pattern<Dna5String, MyersUkkonen> pattern(adapterSeq);
+    return find(finder, pattern, -maxEdits);
+}
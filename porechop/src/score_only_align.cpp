@@ -0,0 +1,231 @@
+#include "score_only_align.h"
+
+#include <vector>
+#include <limits>
+#include <stdint.h>
+
+
+// A score low enough to never win, with room to add gap penalties without overflowing.
+static const int NEG_INF = std::numeric_limits<int>::min() / 4;
+
+// The path statistics are packed into one integer, so they are cheap to copy from cell to cell.
+static const int READ_GAPS_SHIFT = 21;
+static const int TRAILING_GAPS_SHIFT = 42;
+static const PathStats STATS_FIELD_MASK = (PathStats(1) << 21) - 1;
+static const PathStats TRAILING_GAPS_MASK = STATS_FIELD_MASK << TRAILING_GAPS_SHIFT;
+static const PathStats ADAPTER_BEGUN = PathStats(1) << 63;
+static const PathStats READ_GAP_INCREMENT = (PathStats(1) << READ_GAPS_SHIFT) |
+                                            (PathStats(1) << TRAILING_GAPS_SHIFT);
+
+
+// An adapter base aligned to a read base (counting a match if they are equal).
+static inline PathStats diagonalStep(PathStats stats, bool match) {
+    return ((stats & ~TRAILING_GAPS_MASK) | ADAPTER_BEGUN) + match;
+}
+
+// An adapter base aligned to a gap.
+static inline PathStats verticalStep(PathStats stats) {
+    return (stats & ~TRAILING_GAPS_MASK) | ADAPTER_BEGUN;
+}
+
+// A read base aligned to a gap, which only counts once the adapter has begun.
+static inline PathStats horizontalStep(PathStats stats) {
+    return stats + (stats >> 63) * READ_GAP_INCREMENT;
+}
+
+
+// Aligns a read sequence to every adapter in the panel and returns only the full adapter percent
+// identities (the values used to decide which adapter sets are present in the reads), writing one
+// per adapter to the given array (in the panel's order). They are the same as adapterAlignment
+// gives, but no alignment or traceback is built. A trie engine panel (e.g. the GTG repeats, which
+// are all prefixes of the longest one) is instead aligned in one pass over its trie, as the shared
+// prefixes make that much cheaper than scoring each adapter on its own.
+void scoreOnlyPanelAlignment(char * readSeq, AdapterPanel * panel,
+                             int matchScore, int mismatchScore, int gapOpenScore,
+                             int gapExtensionScore, double * identities) {
+    static thread_local Dna5String sequenceH;
+    sequenceH = readSeq;
+    int readLength = length(readSeq);
+    if (panel->engine == TRIE_ENGINE &&
+            trieAlignmentPossible(readLength, gapOpenScore, gapExtensionScore)) {
+        static thread_local std::vector<AlignmentResult> results;
+        results.resize(panel->adapters.size());
+        alignReadToPanel(sequenceH, readLength, panel, matchScore, mismatchScore, gapOpenScore,
+                         gapExtensionScore, results.data());
+        for (size_t i = 0; i < panel->adapters.size(); ++i)
+            identities[i] = results[i].readStart == -1 ? 0.0 :
+                                                         results[i].fullAdapterPercentIdentity;
+        return;
+    }
+    for (size_t i = 0; i < panel->adapters.size(); ++i)
+        identities[i] = fullAdapterIdentity(sequenceH, readLength,
+                                            panel->adapters[i], panel->adapterLengths[i],
+                                            matchScore, mismatchScore, gapOpenScore,
+                                            gapExtensionScore, NO_MIN_SCORE);
+}
+
+
+// This runs the same Gotoh DP as SeqAn's globalAlignment (free end gaps, read horizontal, adapter
+// vertical), making the same choice as SeqAn wherever scores tie. Instead of storing a trace
+// matrix, each cell carries the statistics of the path SeqAn's traceback would follow from it, so
+// the identity comes straight from the best cell.
+//
+// If the best alignment scores less than minScore, BELOW_MIN_SCORE is returned instead. Cells
+// which can't be on the path of an alignment scoring minScore are then left out: a cell's score
+// can grow by at most the best step score for each diagonal step left, so a cell whose score
+// can't reach minScore that way is dead. Dead cells only ever lead to other dead cells, so each
+// column is only filled down to just past the previous column's last live row (and then as far
+// as live cells continue down it), like Ukkonen's cut-off for edit distance. The DP stops once
+// nothing left can reach minScore. Cells on the path of an alignment which does reach it keep
+// their true scores, and so do any cells tied with them, so the result is unchanged.
+double fullAdapterIdentity(Dna5String & readSeq, int readLength,
+                           Dna5String & adapterSeq, int adapterLength,
+                           int matchScore, int mismatchScore, int gapOpenScore,
+                           int gapExtensionScore, int minScore) {
+    int n = readLength, m = adapterLength;
+    if (n == 0 || m == 0)
+        return 0.0;
+
+    // With equal gap open and extension scores SeqAn uses linear gaps, whose ties are broken
+    // differently, so that case just uses the full alignment.
+    if (gapOpenScore == gapExtensionScore) {
+        Score<int, Simple> scoringScheme(matchScore, mismatchScore, gapExtensionScore,
+                                         gapOpenScore);
+        ScoredAlignment scoredAlignment = alignReadToAdapter(readSeq, n, adapterSeq, m,
+                                                             scoringScheme);
+        if (scoredAlignment.m_rawScore < minScore)
+            return BELOW_MIN_SCORE;
+        return scoredAlignment.m_readStartPos == -1 ? 0.0 :
+                                                      scoredAlignment.m_fullAdapterPercentIdentity;
+    }
+
+    // Positive gap scores would let a path's score grow without limit, so nothing is dead then.
+    if (gapOpenScore > 0 || gapExtensionScore > 0)
+        minScore = NO_MIN_SCORE;
+    int bestStepScore = std::max(std::max(matchScore, mismatchScore), 0);
+    auto isLive = [&](int score, int i, int j) {
+        return score + bestStepScore * std::min(m - i, n - j) >= minScore;
+    };
+
+    // The DP's vectors are kept for each thread, so they only grow for a longer adapter.
+    static thread_local std::vector<int> adapterCodes;
+    static thread_local std::vector<ColumnCell> column;
+    static thread_local std::vector<PartialCell> partial;
+    adapterCodes.resize(m);
+    for (int i = 0; i < m; ++i)
+        adapterCodes[i] = ordValue(adapterSeq[i]);
+
+    // Column j of the DP (one read base) is held in this, indexed by adapter position.
+    column.resize(m + 1);
+    for (int i = 0; i <= m; ++i)
+        column[i] = {0, NEG_INF, i > 0 ? ADAPTER_BEGUN : 0, 0};
+    partial.resize(m + 1);
+
+    // SeqAn looks for the best score along the last row and then down the last column, keeping the
+    // first of equal scores. Cell (m, 0) comes first, with a score of 0.
+    int bestScore = 0;
+    PathStats bestStats = column[m].stats;
+    int bestRow = m;
+
+    // Rows below lastLiveRow hold dead cells, given scores of NEG_INF. Row 0 is always free.
+    int lastLiveRow = m;
+    while (lastLiveRow > 0 && !isLive(0, lastLiveRow, 0))
+        --lastLiveRow;
+    int filledRows = m;
+
+    for (int j = 1; j <= n; ++j) {
+        for (int i = lastLiveRow + 1; i <= filledRows; ++i) {
+            column[i].score = NEG_INF;
+            column[i].horizontalScore = NEG_INF;
+        }
+        filledRows = std::min(m, lastLiveRow + 1);
+        int readCode = ordValue(readSeq[j-1]);
+
+        // The first pass finds the best of the diagonal and horizontal gap for each cell. These
+        // only depend on the previous column, so there is no dependency from one cell to the next.
+        for (int i = 1; i <= filledRows; ++i) {
+            ColumnCell & cell = column[i];
+
+            // Horizontal gap matrix (ties go to extending the gap).
+            int horizontalExtend = cell.horizontalScore + gapExtensionScore;
+            int horizontalOpen = cell.score + gapOpenScore;
+            bool horizontalOpens = horizontalExtend < horizontalOpen;
+            cell.horizontalScore = horizontalOpens ? horizontalOpen : horizontalExtend;
+            cell.horizontalStats = horizontalStep(horizontalOpens ? cell.stats :
+                                                                    cell.horizontalStats);
+
+            // The diagonal wins ties. The comparison score is lowered by one for a horizontal gap,
+            // so a vertical gap with the same score will beat it in the second pass.
+            bool match = (readCode == adapterCodes[i-1]);
+            int matchOrMismatch = column[i-1].score + (match ? matchScore : mismatchScore);
+            bool diagonalBest = cell.horizontalScore <= matchOrMismatch;
+            partial[i].score = diagonalBest ? matchOrMismatch : cell.horizontalScore;
+            partial[i].comparisonScore = diagonalBest ? matchOrMismatch :
+                                                        cell.horizontalScore - 1;
+            partial[i].stats = diagonalBest ? diagonalStep(column[i-1].stats, match) :
+                                              cell.horizontalStats;
+        }
+
+        // The second pass runs down the column with the vertical gap matrix. The first pass read
+        // the previous column's scores from each cell before this overwrites them. Below the first
+        // pass's rows, only a vertical gap can reach a cell, and the first dead one ends the pass.
+        int verticalScore = NEG_INF;
+        PathStats verticalStats = 0;
+        int aboveScore = column[0].score;
+        PathStats aboveStats = column[0].stats;
+        bool lastColumn = (j == n);
+        lastLiveRow = 0;
+        for (int i = 1; i <= m; ++i) {
+            if (i > filledRows) {
+                partial[i] = {NEG_INF, NEG_INF, 0};
+                filledRows = i;
+            }
+
+            // Vertical gap matrix (ties go to extending the gap).
+            int verticalExtend = verticalScore + gapExtensionScore;
+            int verticalOpen = aboveScore + gapOpenScore;
+            bool verticalOpens = verticalExtend < verticalOpen;
+            verticalScore = verticalOpens ? verticalOpen : verticalExtend;
+            verticalStats = verticalStep(verticalOpens ? aboveStats : verticalStats);
+
+            // The vertical gap beats a horizontal gap on ties, but not the diagonal.
+            bool verticalBest = verticalScore > partial[i].comparisonScore;
+            aboveScore = verticalBest ? verticalScore : partial[i].score;
+            aboveStats = verticalBest ? verticalStats : partial[i].stats;
+            column[i].score = aboveScore;
+            column[i].stats = aboveStats;
+
+            // At the best cell, SeqAn's traceback starts in a gap matrix if its score is the
+            // cell's score.
+            if ((i == m || lastColumn) && aboveScore > bestScore) {
+                bestScore = aboveScore;
+                bestRow = i;
+                if (verticalScore == aboveScore)
+                    bestStats = verticalStats;
+                else if (column[i].horizontalScore == aboveScore)
+                    bestStats = column[i].horizontalStats;
+                else
+                    bestStats = aboveStats;
+            }
+
+            if (isLive(aboveScore, i, j))
+                lastLiveRow = i;
+            else if (i >= filledRows)
+                break;
+        }
+
+        // With no live cells, only an alignment starting afresh from row 0 could reach minScore.
+        if (lastLiveRow == 0 && bestScore < minScore && !isLive(0, 0, j))
+            return BELOW_MIN_SCORE;
+    }
+    if (bestScore < minScore)
+        return BELOW_MIN_SCORE;
+
+    // The full adapter region runs from the adapter's first base to its last, so it includes the
+    // read gaps within the path, except those after the adapter's end.
+    int matches = bestStats & STATS_FIELD_MASK;
+    int fullAdapterLength = m + ((bestStats >> READ_GAPS_SHIFT) & STATS_FIELD_MASK);
+    if (bestRow == m)
+        fullAdapterLength -= (bestStats >> TRAILING_GAPS_SHIFT) & STATS_FIELD_MASK;
+    return 100.0 * matches / fullAdapterLength;
+}
@@ -0,0 +1,517 @@
+#include "simd_align.h"
+
+#include <vector>
+#include <cstring>
+#include <cstdlib>
+#include <algorithm>
+
+
+// This is an alternative to SeqAn's globalAlignment for aligning adapters to read ends. It fills
+// the DP matrix one anti-diagonal at a time, as all cells in an anti-diagonal can be computed at
+// once with SIMD instructions (16-bit scores, 8 lanes with SSE2 or 16 lanes with AVX2). The
+// recurrences and tie-breaking are the same as SeqAn's Gotoh algorithm with free end gaps, and the
+// traceback follows the same path, so the results are identical.
+
+#if defined(__GNUC__) && (defined(__x86_64__) || defined(__i386__))
+#define PORECHOP_AVX2_DISPATCH
+#endif
+
+// The AVX2 vector helpers are always inlined into code compiled for AVX2, so the ABI warning GCC
+// gives for them doesn't apply.
+#pragma GCC diagnostic ignored "-Wpsabi"
+
+typedef int16_t Vec8 __attribute__((vector_size(16)));
+typedef int16_t Vec16 __attribute__((vector_size(32)));
+
+#define ALWAYS_INLINE inline __attribute__((always_inline))
+
+// A score low enough to never win, with room to add a gap penalty without overflowing. Real
+// scores are kept within +/-12000 (see simdAlignmentPossible).
+static const int16_t SIMD_NEG_INF = -28672;
+static const int SIMD_SCORE_LIMIT = 12000;
+
+
+// Scores must fit in 16 bits and gaps must be affine (SeqAn uses linear gaps when the open and
+// extension scores are equal, which breaks ties differently).
+bool simdAlignmentPossible(int readLength, int adapterLength,
+                           int matchScore, int mismatchScore, int gapOpenScore,
+                           int gapExtensionScore) {
+    if (readLength == 0 || adapterLength == 0 || gapOpenScore == gapExtensionScore)
+        return false;
+    int maxAbsScore = std::max(std::max(std::abs(matchScore), std::abs(mismatchScore)),
+                               std::max(std::abs(gapOpenScore), std::abs(gapExtensionScore)));
+    return (long long)(readLength + adapterLength + 2) * maxAbsScore <= SIMD_SCORE_LIMIT;
+}
+
+
+template <typename TVec>
+static ALWAYS_INLINE TVec loadVec(int16_t const * p) {
+    TVec v;
+    memcpy(&v, p, sizeof(TVec));
+    return v;
+}
+
+template <typename TVec>
+static ALWAYS_INLINE void storeVec(int16_t * p, TVec const & v) {
+    memcpy(p, &v, sizeof(TVec));
+}
+
+
+// Buffers for one alignment. Anti-diagonal d holds the cells (i, d-i), indexed by i (the adapter
+// position). The read is stored reversed so each anti-diagonal's read bases are also in order.
+// Each thread keeps one set, which is prepared for each alignment without giving up its memory.
+struct SimdBuffers {
+    int lanes, traceStride;
+    std::vector<int16_t> reversedRead, adapter;
+    std::vector<int16_t> scores[3], horizontalScores[2], verticalScores[2];
+    std::vector<int16_t> trace, lastRowScores, lastColumnScores;
+
+    // The trace matrix isn't cleared, as the traceback only reads cells which the DP has filled.
+    void prepare(int readLength, int adapterLength, int simdLanes) {
+        lanes = simdLanes;
+        traceStride = adapterLength + lanes + 1;
+        reversedRead.assign(readLength + lanes, 0);
+        adapter.assign(adapterLength + lanes, 0);
+        for (int k = 0; k < 3; ++k)
+            scores[k].assign(adapterLength + lanes + 1, 0);
+        for (int k = 0; k < 2; ++k) {
+            horizontalScores[k].assign(adapterLength + lanes + 1, SIMD_NEG_INF);
+            verticalScores[k].assign(adapterLength + lanes + 1, SIMD_NEG_INF);
+        }
+        trace.resize((readLength + adapterLength + 1) * traceStride);
+        lastRowScores.assign(readLength, 0);
+        lastColumnScores.assign(adapterLength + 1, 0);
+    }
+};
+
+
+// The buffers for aligning a group of reads at once (see simdAlignReadsToAdapter), also kept for
+// each thread.
+struct SimdBatchBuffers {
+    std::vector<int16_t> readBases, adapter, columnScores, columnHorizontalScores, lastRowScores;
+    std::vector<int16_t> trace;
+};
+
+
+static thread_local SimdBuffers simdBuffers;
+static thread_local SimdBatchBuffers simdBatchBuffers;
+
+
+// Computes one DP cell in each lane, with SeqAn's recurrences and tie-breaking, and returns the
+// cells' trace bits.
+template <typename TVec>
+static ALWAYS_INLINE TVec computeCells(TVec const & leftScore, TVec const & leftHorizontal,
+                                       TVec const & upScore, TVec const & upVertical,
+                                       TVec const & diagonalScore, TVec const & matches,
+                                       int16_t matchScore, int16_t mismatchScore,
+                                       int16_t gapOpenScore, int16_t gapExtensionScore,
+                                       TVec & score, TVec & horizontal, TVec & vertical) {
+    // Gap matrices (ties go to extending the gap).
+    TVec horizontalExtend = leftHorizontal + gapExtensionScore;
+    TVec horizontalOpen = leftScore + gapOpenScore;
+    TVec horizontalExtends = horizontalExtend >= horizontalOpen;
+    horizontal = horizontalExtends ? horizontalExtend : horizontalOpen;
+    TVec verticalExtend = upVertical + gapExtensionScore;
+    TVec verticalOpen = upScore + gapOpenScore;
+    TVec verticalExtends = verticalExtend >= verticalOpen;
+    vertical = verticalExtends ? verticalExtend : verticalOpen;
+
+    // The main matrix: vertical beats horizontal on ties and the diagonal beats both.
+    TVec fromHorizontal = horizontal > vertical;
+    TVec gap = fromHorizontal ? horizontal : vertical;
+    TVec diagonal = diagonalScore + (matches ? (TVec() + matchScore) : (TVec() + mismatchScore));
+    TVec fromDiagonal = gap <= diagonal;
+    score = fromDiagonal ? diagonal : gap;
+
+    return (fromDiagonal & TRACE_DIAGONAL) |
+           (fromHorizontal & TRACE_FROM_HORIZONTAL) |
+           (horizontalExtends & TRACE_HORIZONTAL_EXTEND) |
+           (verticalExtends & TRACE_VERTICAL_EXTEND) |
+           ((vertical == score) & TRACE_VERTICAL_IS_MAX) |
+           ((horizontal == score) & TRACE_HORIZONTAL_IS_MAX);
+}
+
+
+template <typename TVec>
+static ALWAYS_INLINE void fillTraceMatrix(SimdBuffers & buffers, int n, int m,
+                                          int16_t matchScore, int16_t mismatchScore,
+                                          int16_t gapOpenScore, int16_t gapExtensionScore) {
+    int const lanes = sizeof(TVec) / sizeof(int16_t);
+    int16_t * s0 = buffers.scores[0].data();
+    int16_t * s1 = buffers.scores[1].data();
+    int16_t * s2 = buffers.scores[2].data();
+    int16_t * h1 = buffers.horizontalScores[0].data();
+    int16_t * h2 = buffers.horizontalScores[1].data();
+    int16_t * v1 = buffers.verticalScores[0].data();
+    int16_t * v2 = buffers.verticalScores[1].data();
+    int16_t const * reversedRead = buffers.reversedRead.data();
+    int16_t const * adapter = buffers.adapter.data();
+
+    // Anti-diagonal 0 is cell (0, 0).
+    s1[0] = 0;
+    h1[0] = v1[0] = SIMD_NEG_INF;
+
+    for (int d = 1; d <= m + n; ++d) {
+        int16_t * trace = buffers.trace.data() + d * buffers.traceStride;
+        int first = std::max(1, d - n), last = std::min(m, d - 1);
+        for (int i = first; i <= last; i += lanes) {
+            TVec leftScore = loadVec<TVec>(s1 + i);
+            TVec leftHorizontal = loadVec<TVec>(h1 + i);
+            TVec upScore = loadVec<TVec>(s1 + i - 1);
+            TVec upVertical = loadVec<TVec>(v1 + i - 1);
+            TVec diagonalScore = loadVec<TVec>(s0 + i - 1);
+            TVec readBases = loadVec<TVec>(reversedRead + n - d + i);
+            TVec adapterBases = loadVec<TVec>(adapter + i - 1);
+
+            TVec score, horizontal, vertical;
+            TVec traceBits = computeCells(leftScore, leftHorizontal, upScore, upVertical,
+                                          diagonalScore, readBases == adapterBases, matchScore,
+                                          mismatchScore, gapOpenScore, gapExtensionScore,
+                                          score, horizontal, vertical);
+            storeVec<TVec>(s2 + i, score);
+            storeVec<TVec>(h2 + i, horizontal);
+            storeVec<TVec>(v2 + i, vertical);
+            storeVec<TVec>(trace + i, traceBits);
+        }
+
+        // The first row and column are free (the vector loop may have written past the last cell,
+        // so these are set afterwards).
+        if (d <= n) {
+            s2[0] = 0;
+            h2[0] = v2[0] = SIMD_NEG_INF;
+        }
+        if (d <= m) {
+            s2[d] = 0;
+            h2[d] = v2[d] = SIMD_NEG_INF;
+        }
+        if (d >= m && d - m < n)
+            buffers.lastRowScores[d - m] = s2[m];
+        if (d >= n)
+            buffers.lastColumnScores[d - n] = s2[d - n];
+
+        int16_t * oldest = s0;
+        s0 = s1;
+        s1 = s2;
+        s2 = oldest;
+        std::swap(h1, h2);
+        std::swap(v1, v2);
+    }
+}
+
+
+static void fillTraceMatrixSse2(SimdBuffers & buffers, int n, int m,
+                                int16_t matchScore, int16_t mismatchScore,
+                                int16_t gapOpenScore, int16_t gapExtensionScore) {
+    fillTraceMatrix<Vec8>(buffers, n, m, matchScore, mismatchScore, gapOpenScore,
+                          gapExtensionScore);
+}
+
+#ifdef PORECHOP_AVX2_DISPATCH
+__attribute__((target("avx2")))
+static void fillTraceMatrixAvx2(SimdBuffers & buffers, int n, int m,
+                                int16_t matchScore, int16_t mismatchScore,
+                                int16_t gapOpenScore, int16_t gapExtensionScore) {
+    fillTraceMatrix<Vec16>(buffers, n, m, matchScore, mismatchScore, gapOpenScore,
+                           gapExtensionScore);
+}
+
+static bool cpuHasAvx2() {
+    __builtin_cpu_init();
+    return __builtin_cpu_supports("avx2");
+}
+static const bool CPU_HAS_AVX2 = cpuHasAvx2();
+#else
+static const bool CPU_HAS_AVX2 = false;
+#endif
+
+
+ScoredAlignment simdAlignReadToAdapter(Dna5String & readSeq, int readLength,
+                                       Dna5String & adapterSeq, int adapterLength,
+                                       int matchScore, int mismatchScore, int gapOpenScore,
+                                       int gapExtensionScore, int minScore) {
+    int n = readLength, m = adapterLength;
+    SimdBuffers & buffers = simdBuffers;
+    buffers.prepare(n, m, CPU_HAS_AVX2 ? 16 : 8);
+    for (int j = 0; j < n; ++j)
+        buffers.reversedRead[n - 1 - j] = ordValue(readSeq[j]);
+    for (int i = 0; i < m; ++i)
+        buffers.adapter[i] = ordValue(adapterSeq[i]);
+
+#ifdef PORECHOP_AVX2_DISPATCH
+    if (CPU_HAS_AVX2)
+        fillTraceMatrixAvx2(buffers, n, m, matchScore, mismatchScore, gapOpenScore,
+                            gapExtensionScore);
+    else
+#endif
+        fillTraceMatrixSse2(buffers, n, m, matchScore, mismatchScore, gapOpenScore,
+                            gapExtensionScore);
+
+    int stride = buffers.traceStride;
+    return traceBestAlignment([&](int i, int j) {return buffers.trace[(i + j) * stride + i];},
+                              [&](int j) {return buffers.lastRowScores[j];},
+                              [&](int i) {return buffers.lastColumnScores[i];},
+                              readSeq, n, adapterSeq, m, minScore);
+}
+
+
+// The functions below align a group of reads of the same length to one adapter at once, with each
+// read in its own lane. The DP is filled one column (read position) at a time, so there are no
+// dependencies between lanes and no per-diagonal bookkeeping. Arrays hold one value per lane for
+// each position: readBases[j * lanes + lane], columnScores[i * lanes + lane] and so on.
+template <typename TVec>
+static ALWAYS_INLINE void fillBatchTraceMatrix(int16_t const * readBases,
+                                               int16_t const * adapter, int n, int m,
+                                               int16_t matchScore, int16_t mismatchScore,
+                                               int16_t gapOpenScore, int16_t gapExtensionScore,
+                                               int16_t * columnScores,
+                                               int16_t * columnHorizontalScores,
+                                               int16_t * trace, int16_t * lastRowScores) {
+    int const lanes = sizeof(TVec) / sizeof(int16_t);
+    TVec const zero = TVec();
+    TVec const negInf = TVec() + SIMD_NEG_INF;
+
+    // Column 0 is free.
+    for (int i = 0; i <= m; ++i) {
+        storeVec<TVec>(columnScores + i * lanes, zero);
+        storeVec<TVec>(columnHorizontalScores + i * lanes, negInf);
+    }
+    storeVec<TVec>(lastRowScores, zero);
+
+    for (int j = 1; j <= n; ++j) {
+        TVec columnReadBases = loadVec<TVec>(readBases + (j - 1) * lanes);
+        int16_t * traceColumn = trace + j * (m + 1) * lanes;
+
+        // Row 0 is free, so the cells above and diagonal to row 1 have a score of zero.
+        TVec diagonalScore = zero, upScore = zero, vertical = negInf;
+        for (int i = 1; i <= m; ++i) {
+            TVec leftScore = loadVec<TVec>(columnScores + i * lanes);
+            TVec leftHorizontal = loadVec<TVec>(columnHorizontalScores + i * lanes);
+            TVec score, horizontal;
+            TVec traceBits = computeCells(leftScore, leftHorizontal, upScore, vertical,
+                                          diagonalScore, columnReadBases == adapter[i - 1],
+                                          matchScore, mismatchScore, gapOpenScore,
+                                          gapExtensionScore, score, horizontal, vertical);
+            storeVec<TVec>(columnScores + i * lanes, score);
+            storeVec<TVec>(columnHorizontalScores + i * lanes, horizontal);
+            storeVec<TVec>(traceColumn + i * lanes, traceBits);
+            diagonalScore = leftScore;
+            upScore = score;
+        }
+        storeVec<TVec>(lastRowScores + j * lanes, upScore);
+    }
+}
+
+
+static void fillBatchTraceMatrixSse2(int16_t const * readBases, int16_t const * adapter,
+                                     int n, int m,
+                                     int16_t matchScore, int16_t mismatchScore,
+                                     int16_t gapOpenScore, int16_t gapExtensionScore,
+                                     int16_t * columnScores, int16_t * columnHorizontalScores,
+                                     int16_t * trace, int16_t * lastRowScores) {
+    fillBatchTraceMatrix<Vec8>(readBases, adapter, n, m, matchScore, mismatchScore, gapOpenScore,
+                               gapExtensionScore, columnScores, columnHorizontalScores, trace,
+                               lastRowScores);
+}
+
+#ifdef PORECHOP_AVX2_DISPATCH
+__attribute__((target("avx2")))
+static void fillBatchTraceMatrixAvx2(int16_t const * readBases, int16_t const * adapter,
+                                     int n, int m,
+                                     int16_t matchScore, int16_t mismatchScore,
+                                     int16_t gapOpenScore, int16_t gapExtensionScore,
+                                     int16_t * columnScores, int16_t * columnHorizontalScores,
+                                     int16_t * trace, int16_t * lastRowScores) {
+    fillBatchTraceMatrix<Vec16>(readBases, adapter, n, m, matchScore, mismatchScore,
+                                gapOpenScore, gapExtensionScore, columnScores,
+                                columnHorizontalScores, trace, lastRowScores);
+}
+#endif
+
+
+// Fills one DP row of a trie alignment (see trie_align.cpp) for a group of reads, with each read in
+// its own lane. Row i is filled from row i - 1 for an adapter whose ith base is adapterBase. Rows
+// hold one value per lane for each read position: scores[j * lanes + lane] and so on.
+template <typename TVec>
+static ALWAYS_INLINE void fillTrieBatchRow(int16_t const * readBases, int n, int16_t adapterBase,
+                                           int16_t matchScore, int16_t mismatchScore,
+                                           int16_t gapOpenScore, int16_t gapExtensionScore,
+                                           int16_t const * upScores,
+                                           int16_t const * upVerticalScores,
+                                           int16_t * scores, int16_t * verticalScores,
+                                           int16_t * trace) {
+    int const lanes = sizeof(TVec) / sizeof(int16_t);
+    TVec const zero = TVec();
+    TVec const negInf = TVec() + SIMD_NEG_INF;
+
+    // The first column is free.
+    storeVec<TVec>(scores, zero);
+    storeVec<TVec>(verticalScores, negInf);
+    TVec leftScore = zero, leftHorizontal = negInf;
+
+    for (int j = 1; j <= n; ++j) {
+        TVec upScore = loadVec<TVec>(upScores + j * lanes);
+        TVec upVertical = loadVec<TVec>(upVerticalScores + j * lanes);
+        TVec diagonalScore = loadVec<TVec>(upScores + (j - 1) * lanes);
+        TVec readBasesHere = loadVec<TVec>(readBases + (j - 1) * lanes);
+        TVec score, horizontal, vertical;
+        TVec traceBits = computeCells(leftScore, leftHorizontal, upScore, upVertical,
+                                      diagonalScore, readBasesHere == adapterBase, matchScore,
+                                      mismatchScore, gapOpenScore, gapExtensionScore,
+                                      score, horizontal, vertical);
+        storeVec<TVec>(scores + j * lanes, score);
+        storeVec<TVec>(verticalScores + j * lanes, vertical);
+        storeVec<TVec>(trace + j * lanes, traceBits);
+        leftScore = score;
+        leftHorizontal = horizontal;
+    }
+}
+
+
+static void fillTrieBatchRowSse2(int16_t const * readBases, int n, int16_t adapterBase,
+                                 int16_t matchScore, int16_t mismatchScore,
+                                 int16_t gapOpenScore, int16_t gapExtensionScore,
+                                 int16_t const * upScores, int16_t const * upVerticalScores,
+                                 int16_t * scores, int16_t * verticalScores, int16_t * trace) {
+    fillTrieBatchRow<Vec8>(readBases, n, adapterBase, matchScore, mismatchScore, gapOpenScore,
+                           gapExtensionScore, upScores, upVerticalScores, scores, verticalScores,
+                           trace);
+}
+
+#ifdef PORECHOP_AVX2_DISPATCH
+__attribute__((target("avx2")))
+static void fillTrieBatchRowAvx2(int16_t const * readBases, int n, int16_t adapterBase,
+                                 int16_t matchScore, int16_t mismatchScore,
+                                 int16_t gapOpenScore, int16_t gapExtensionScore,
+                                 int16_t const * upScores, int16_t const * upVerticalScores,
+                                 int16_t * scores, int16_t * verticalScores, int16_t * trace) {
+    fillTrieBatchRow<Vec16>(readBases, n, adapterBase, matchScore, mismatchScore, gapOpenScore,
+                            gapExtensionScore, upScores, upVerticalScores, scores,
+                            verticalScores, trace);
+}
+#endif
+
+
+// Aligns up to simdLaneCount() reads, which must all have the given length, to every adapter in
+// the trie, with each read in its own lane. Read k's result for adapter a is written to
+// results[k] + a. The results are the same as aligning each read with trieAlignReadToAdapters.
+void simdTrieAlignReadsToAdapters(std::vector<Dna5String *> & readSeqs, int readLength,
+                                  AdapterTrie & trie, std::vector<Dna5String> & adapters,
+                                  int matchScore, int mismatchScore, int gapOpenScore,
+                                  int gapExtensionScore, std::vector<AlignmentResult *> & results) {
+    int n = readLength;
+    int lanes = simdLaneCount();
+    int readCount = std::min(int(readSeqs.size()), lanes);
+    int rowSize = (n + 1) * lanes;
+
+    // The rows for the current path through the trie, one for each depth. Unused lanes repeat
+    // the first read.
+    SimdBatchBuffers & buffers = simdBatchBuffers;
+    std::vector<int16_t> & readBases = buffers.readBases;
+    readBases.resize(n * lanes);
+    for (int j = 0; j < n; ++j) {
+        for (int lane = 0; lane < lanes; ++lane)
+            readBases[j * lanes + lane] = ordValue((*readSeqs[lane < readCount ? lane : 0])[j]);
+    }
+    std::vector<int16_t> & scores = buffers.columnScores;
+    std::vector<int16_t> & verticalScores = buffers.columnHorizontalScores;
+    scores.resize((trie.maxDepth + 1) * rowSize);
+    verticalScores.resize((trie.maxDepth + 1) * rowSize);
+    buffers.trace.resize((trie.maxDepth + 1) * rowSize);
+    int16_t * trace = buffers.trace.data();
+
+    // Row 0 is free.
+    std::fill(scores.begin(), scores.begin() + rowSize, 0);
+    std::fill(verticalScores.begin(), verticalScores.begin() + rowSize, SIMD_NEG_INF);
+
+    for (size_t node = 0; node < trie.nodeBases.size(); ++node) {
+        int m = trie.nodeDepths[node];
+        int16_t const * upScores = scores.data() + (m - 1) * rowSize;
+        int16_t const * upVerticalScores = verticalScores.data() + (m - 1) * rowSize;
+#ifdef PORECHOP_AVX2_DISPATCH
+        if (CPU_HAS_AVX2)
+            fillTrieBatchRowAvx2(readBases.data(), n, trie.nodeBases[node], matchScore,
+                                 mismatchScore, gapOpenScore, gapExtensionScore, upScores,
+                                 upVerticalScores, scores.data() + m * rowSize,
+                                 verticalScores.data() + m * rowSize, trace + m * rowSize);
+        else
+#endif
+            fillTrieBatchRowSse2(readBases.data(), n, trie.nodeBases[node], matchScore,
+                                 mismatchScore, gapOpenScore, gapExtensionScore, upScores,
+                                 upVerticalScores, scores.data() + m * rowSize,
+                                 verticalScores.data() + m * rowSize, trace + m * rowSize);
+
+        for (int a : trie.nodeAdapters[node]) {
+            for (int lane = 0; lane < readCount; ++lane) {
+                traceBestAlignment(
+                    [&](int i, int j) {return trace[(i * (n + 1) + j) * lanes + lane];},
+                    [&](int j) {return scores[(m * (n + 1) + j) * lanes + lane];},
+                    [&](int i) {return scores[(i * (n + 1) + n) * lanes + lane];},
+                    *readSeqs[lane], n, adapters[a], m, NO_MIN_SCORE).getResult(results[lane] + a);
+            }
+        }
+    }
+}
+
+
+// The number of reads simdAlignReadsToAdapter can align at once.
+int simdLaneCount() {
+    return CPU_HAS_AVX2 ? 16 : 8;
+}
+
+
+// Aligns up to simdLaneCount() reads, which must all have the given length, to one adapter. The
+// results are the same as aligning each read with simdAlignReadToAdapter.
+std::vector<ScoredAlignment> simdAlignReadsToAdapter(std::vector<Dna5String *> & readSeqs,
+                                                     int readLength,
+                                                     Dna5String & adapterSeq, int adapterLength,
+                                                     int matchScore, int mismatchScore,
+                                                     int gapOpenScore, int gapExtensionScore) {
+    int n = readLength, m = adapterLength;
+    int lanes = simdLaneCount();
+    int readCount = std::min(int(readSeqs.size()), lanes);
+
+    // Unused lanes repeat the first read. The trace matrix isn't initialised, as the traceback only
+    // reads cells which the DP has filled.
+    SimdBatchBuffers & buffers = simdBatchBuffers;
+    std::vector<int16_t> & readBases = buffers.readBases;
+    readBases.resize(n * lanes);
+    for (int j = 0; j < n; ++j) {
+        for (int lane = 0; lane < lanes; ++lane)
+            readBases[j * lanes + lane] = ordValue((*readSeqs[lane < readCount ? lane : 0])[j]);
+    }
+    std::vector<int16_t> & adapter = buffers.adapter;
+    adapter.resize(m);
+    for (int i = 0; i < m; ++i)
+        adapter[i] = ordValue(adapterSeq[i]);
+    std::vector<int16_t> & columnScores = buffers.columnScores;
+    std::vector<int16_t> & columnHorizontalScores = buffers.columnHorizontalScores;
+    std::vector<int16_t> & lastRowScores = buffers.lastRowScores;
+    columnScores.resize((m + 1) * lanes);
+    columnHorizontalScores.resize((m + 1) * lanes);
+    lastRowScores.resize((n + 1) * lanes);
+    buffers.trace.resize((n + 1) * (m + 1) * lanes);
+    int16_t * trace = buffers.trace.data();
+
+#ifdef PORECHOP_AVX2_DISPATCH
+    if (CPU_HAS_AVX2)
+        fillBatchTraceMatrixAvx2(readBases.data(), adapter.data(), n, m, matchScore, mismatchScore,
+                                 gapOpenScore, gapExtensionScore, columnScores.data(),
+                                 columnHorizontalScores.data(), trace, lastRowScores.data());
+    else
+#endif
+        fillBatchTraceMatrixSse2(readBases.data(), adapter.data(), n, m, matchScore, mismatchScore,
+                                 gapOpenScore, gapExtensionScore, columnScores.data(),
+                                 columnHorizontalScores.data(), trace, lastRowScores.data());
+
+    std::vector<ScoredAlignment> alignments;
+    alignments.reserve(readCount);
+    for (int lane = 0; lane < readCount; ++lane) {
+        int16_t const * laneTrace = trace + lane;
+        alignments.push_back(traceBestAlignment(
+            [&](int i, int j) {return laneTrace[(j * (m + 1) + i) * lanes];},
+            [&](int j) {return lastRowScores[j * lanes + lane];},
+            [&](int i) {return columnScores[i * lanes + lane];},
+            *readSeqs[lane], n, adapterSeq, m, NO_MIN_SCORE));
+    }
+    return alignments;
+}
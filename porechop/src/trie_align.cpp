@@ -0,0 +1,163 @@
+#include "trie_align.h"
+#include "simd_align.h"
+
+#include <limits>
+#include <algorithm>
+
+
+// This aligns a read to all of a panel's adapters at once. The DP is filled one row (adapter
+// position) at a time instead of one column at a time: a row only depends on the row above and on
+// one adapter base, so walking the adapter trie depth-first, each node's row is filled once from
+// its parent's row and is shared by every adapter with that prefix. The recurrences and trace bits
+// are the same as the SIMD engine's, and so is the traceback, so the results are identical to
+// SeqAn's.
+
+// A score low enough to never win, with room to add a gap penalty without overflowing.
+static const int TRIE_NEG_INF = std::numeric_limits<int>::min() / 2;
+
+
+AdapterTrie buildAdapterTrie(std::vector<Dna5String> & adapters) {
+    // First the trie is built with child links (node 0 is the root)...
+    std::vector<std::vector<int> > children(1, std::vector<int>(ValueSize<Dna5>::VALUE, -1));
+    std::vector<int> bases(1, -1);
+    std::vector<std::vector<int> > endingAdapters(1);
+    for (size_t a = 0; a < adapters.size(); ++a) {
+        int node = 0;
+        for (size_t i = 0; i < length(adapters[a]); ++i) {
+            int base = ordValue(adapters[a][i]);
+            if (children[node][base] == -1) {
+                children[node][base] = children.size();
+                children.push_back(std::vector<int>(ValueSize<Dna5>::VALUE, -1));
+                bases.push_back(base);
+                endingAdapters.push_back(std::vector<int>());
+            }
+            node = children[node][base];
+        }
+        if (node != 0)
+            endingAdapters[node].push_back(a);
+    }
+
+    // ... and then its nodes are put in depth-first order.
+    AdapterTrie trie;
+    trie.maxDepth = 0;
+    std::vector<std::pair<int, int> > stack(1, std::make_pair(0, 0));
+    while (!stack.empty()) {
+        int node = stack.back().first, depth = stack.back().second;
+        stack.pop_back();
+        if (node != 0) {
+            trie.nodeBases.push_back(bases[node]);
+            trie.nodeDepths.push_back(depth);
+            trie.nodeAdapters.push_back(endingAdapters[node]);
+            trie.maxDepth = std::max(trie.maxDepth, depth);
+        }
+        for (int base = ValueSize<Dna5>::VALUE - 1; base >= 0; --base) {
+            if (children[node][base] != -1)
+                stack.push_back(std::make_pair(children[node][base], depth + 1));
+        }
+    }
+    return trie;
+}
+
+
+// Like the SIMD engine, the trie engine uses SeqAn's affine gap tie-breaking, so it can't stand in
+// for SeqAn when the gaps are linear (equal open and extension scores).
+bool trieAlignmentPossible(int readLength, int gapOpenScore, int gapExtensionScore) {
+    return readLength > 0 && gapOpenScore != gapExtensionScore;
+}
+
+
+// The DP rows for the current path through the trie, one for each depth (row 0 is the free first
+// row). Each thread keeps its own, which only grow for a longer read or adapter.
+struct TrieBuffers {
+    std::vector<int> readBases, scores, verticalScores;
+    std::vector<int16_t> trace;
+};
+
+static thread_local TrieBuffers trieBuffers;
+
+
+// Fills DP row i from row i - 1, for an adapter whose ith base is adapterBase. The cells are
+// computed like the SIMD engine's computeCells, one at a time along the row, as each cell's
+// horizontal gap depends on the cell to its left.
+static void fillTrieRow(TrieBuffers & buffers, int n, int i, int adapterBase,
+                        int matchScore, int mismatchScore, int gapOpenScore,
+                        int gapExtensionScore) {
+    int const * readBases = buffers.readBases.data();
+    int const * upScores = buffers.scores.data() + (i - 1) * (n + 1);
+    int const * upVerticals = buffers.verticalScores.data() + (i - 1) * (n + 1);
+    int * scores = buffers.scores.data() + i * (n + 1);
+    int * verticals = buffers.verticalScores.data() + i * (n + 1);
+    int16_t * trace = buffers.trace.data() + i * (n + 1);
+
+    // The first column is free.
+    scores[0] = 0;
+    verticals[0] = TRIE_NEG_INF;
+    int horizontal = TRIE_NEG_INF;
+
+    for (int j = 1; j <= n; ++j) {
+        // Gap matrices (ties go to extending the gap).
+        int horizontalExtend = horizontal + gapExtensionScore;
+        int horizontalOpen = scores[j-1] + gapOpenScore;
+        bool horizontalExtends = horizontalExtend >= horizontalOpen;
+        horizontal = horizontalExtends ? horizontalExtend : horizontalOpen;
+        int verticalExtend = upVerticals[j] + gapExtensionScore;
+        int verticalOpen = upScores[j] + gapOpenScore;
+        bool verticalExtends = verticalExtend >= verticalOpen;
+        int vertical = verticalExtends ? verticalExtend : verticalOpen;
+
+        // The main matrix: vertical beats horizontal on ties and the diagonal beats both.
+        bool fromHorizontal = horizontal > vertical;
+        int gap = fromHorizontal ? horizontal : vertical;
+        int diagonal = upScores[j-1] + (readBases[j-1] == adapterBase ? matchScore :
+                                                                         mismatchScore);
+        bool fromDiagonal = gap <= diagonal;
+        int score = fromDiagonal ? diagonal : gap;
+
+        scores[j] = score;
+        verticals[j] = vertical;
+        trace[j] = (fromDiagonal ? TRACE_DIAGONAL : 0) |
+                   (fromHorizontal ? TRACE_FROM_HORIZONTAL : 0) |
+                   (horizontalExtends ? TRACE_HORIZONTAL_EXTEND : 0) |
+                   (verticalExtends ? TRACE_VERTICAL_EXTEND : 0) |
+                   (vertical == score ? TRACE_VERTICAL_IS_MAX : 0) |
+                   (horizontal == score ? TRACE_HORIZONTAL_IS_MAX : 0);
+    }
+}
+
+
+// Aligns a read to every adapter in the trie, writing each adapter's result to results at the
+// adapter's index. Adapters which aren't in the trie (empty ones) are left for the caller.
+void trieAlignReadToAdapters(Dna5String & readSeq, int readLength, AdapterTrie & trie,
+                             std::vector<Dna5String> & adapters,
+                             int matchScore, int mismatchScore, int gapOpenScore,
+                             int gapExtensionScore, AlignmentResult * results) {
+    int n = readLength;
+    TrieBuffers & buffers = trieBuffers;
+    buffers.readBases.resize(n);
+    for (int j = 0; j < n; ++j)
+        buffers.readBases[j] = ordValue(readSeq[j]);
+    buffers.scores.resize((trie.maxDepth + 1) * (n + 1));
+    buffers.verticalScores.resize((trie.maxDepth + 1) * (n + 1));
+    buffers.trace.resize((trie.maxDepth + 1) * (n + 1));
+
+    // Row 0 is free.
+    std::fill(buffers.scores.begin(), buffers.scores.begin() + n + 1, 0);
+    std::fill(buffers.verticalScores.begin(), buffers.verticalScores.begin() + n + 1,
+              TRIE_NEG_INF);
+
+    int const * scores = buffers.scores.data();
+    int16_t const * trace = buffers.trace.data();
+    for (size_t node = 0; node < trie.nodeBases.size(); ++node) {
+        int m = trie.nodeDepths[node];
+        fillTrieRow(buffers, n, m, trie.nodeBases[node], matchScore, mismatchScore, gapOpenScore,
+                    gapExtensionScore);
+        for (int a : trie.nodeAdapters[node]) {
+            ScoredAlignment alignment = traceBestAlignment(
+                [&](int i, int j) {return trace[i * (n + 1) + j];},
+                [&](int j) {return scores[m * (n + 1) + j];},
+                [&](int i) {return scores[i * (n + 1) + n];},
+                readSeq, n, adapters[a], m, NO_MIN_SCORE);
+            alignment.getResult(results + a);
+        }
+    }
+}
@@ -10,6 +10,7 @@ if sys.version_info.major != 3 or sys.version_info.minor < 4:
     sys.exit(1)
 
 import os
+import glob
 import shutil
 from distutils.command.build import build
 from distutils.core import Command
@@ -46,6 +47,7 @@ class PorechopBuild(build):
             make_cmd = ['make', '-j', str(min(8, multiprocessing.cpu_count()))]
         except NotImplementedError:
             make_cmd = ['make']
+        make_cmd.append('PYTHON=' + sys.executable)  # build the extension module for this Python
 
         def clean_cpp():
             subprocess.call(clean_cmd)
@@ -59,13 +61,17 @@ class PorechopBuild(build):
 
 class PorechopInstall(install):
     """
-    The install process copies the C++ shared library to the install location.
+    The install process copies the C++ shared library (and the extension module, if it was built)
+    to the install location.
     """
 
     def run(self):
         install.run(self)  # Run original install code
         shutil.copyfile(os.path.join('porechop', 'cpp_functions.so'),
                         os.path.join(self.install_lib, 'porechop', 'cpp_functions.so'))
+        for extension_file in glob.glob(os.path.join('porechop', 'cpp_extension*')):
+            shutil.copyfile(extension_file, os.path.join(self.install_lib, 'porechop',
+                                                         os.path.basename(extension_file)))
 
 
 class PorechopClean(Command):
@@ -0,0 +1,614 @@
+"""
+Copyright 2017 Ryan Wick (rrwick@gmail.com)
+https://github.com/rrwick/Porechop
+
+This module contains some tests for Porechop. To run them, execute `python3 -m unittest` from the
+root Porechop directory.
+
+This file is part of Porechop. Porechop is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. Porechop is distributed in
+the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with Porechop. If
+not, see <http://www.gnu.org/licenses/>.
+"""
+
+import unittest
+import os
+import random
+from multiprocessing.dummy import Pool as ThreadPool
+import porechop.misc
+import porechop.cpp_function_wrappers
+from porechop.adapters import ADAPTERS
+from porechop.cpp_function_wrappers import adapter_alignment, score_only_panel_alignment, \
+    full_middle_search, multi_hit_middle_search, seeded_middle_search, trim_read_ends, \
+    add_to_minhash_sketch, AdapterPanel, MiddleAdapterIndex, \
+    ALIGNMENT_RESULT_FIELDS
+
+
+def full_adapter_identity(read_seq, adapter_seq, scoring_scheme_vals):
+    result = adapter_alignment(read_seq, adapter_seq, scoring_scheme_vals)
+    return 0.0 if result.read_start == -1 else result.full_adapter_percent_identity
+
+
+def result_values(result):
+    """
+    An alignment result's values as strings, so NaN identities count as equal.
+    """
+    return [str(getattr(result, x)) for x in ALIGNMENT_RESULT_FIELDS]
+
+
+def panel_results(read_seqs, adapter_seqs, engine, scoring_scheme_vals, end_size=None,
+                  threads=1):
+    """
+    Aligns each read to every adapter in a panel through trim_read_ends, returning a list (one per
+    read) of the alignments' values as strings. The read ends are longer than the reads and there
+    are no thresholds, so every alignment at the read start is a hit (apart from those whose
+    aligned region identity is NaN, which still have their full adapter identity).
+    """
+    if end_size is None:
+        end_size = max(len(x) for x in read_seqs) + 1
+    panel = AdapterPanel(adapter_seqs, engine)
+    _, start_hits, _, start_identities, _ = \
+        trim_read_ends(read_seqs, panel, AdapterPanel([], engine), end_size, 0, -1.0, -1,
+                       scoring_scheme_vals, threads, True)
+    results = [[] for _ in read_seqs]
+    for hit in start_hits:
+        results[hit[0]].append(str(hit[1:]))
+    for r in range(len(read_seqs)):
+        results[r] += [str(x) for x in
+                       start_identities[r * len(adapter_seqs):(r + 1) * len(adapter_seqs)]]
+    return results
+
+
+def random_read_and_adapter(rng):
+    """
+    Makes a short adapter and a read which sometimes contains a mutated copy of it. The alphabets
+    are small so there are plenty of tied scores.
+    """
+    alphabet = rng.choice(['ACGT', 'AC', 'ACGTN', 'AcgTN', 'A'])
+    adapter_seq = ''.join(rng.choice(alphabet) for _ in range(rng.randint(1, 12)))
+    read_seq = [rng.choice(alphabet) for _ in range(rng.randint(1, 30))]
+    if rng.random() < 0.5:
+        pos = rng.randint(-len(adapter_seq) // 2, len(read_seq))
+        for i, base in enumerate(adapter_seq):
+            if 0 <= pos + i < len(read_seq) and rng.random() < 0.85:
+                read_seq[pos + i] = base
+    return ''.join(read_seq), adapter_seq
+
+
+class TestScoreOnlyAlignment(unittest.TestCase):
+    """
+    The score-only alignment (used for finding adapter sets) must give exactly the same full
+    adapter identity as the full alignment.
+    """
+    scoring_schemes = [[3, -6, -5, -2], [2, -3, -4, -4], [1, -1, -2, -1], [5, -4, -8, -6],
+                       [1, -2, -3, -1], [2, -2, -2, -1]]
+
+    def test_random_sequences(self):
+        rng = random.Random(0)
+        for _ in range(5000):
+            read_seq, adapter_seq = random_read_and_adapter(rng)
+            scoring_scheme_vals = rng.choice(self.scoring_schemes)
+            panel = AdapterPanel([adapter_seq])
+            self.assertEqual(score_only_panel_alignment(read_seq, panel, scoring_scheme_vals)[0],
+                             full_adapter_identity(read_seq, adapter_seq, scoring_scheme_vals))
+
+    def test_read_ends(self):
+        reads, _ = porechop.misc.load_fasta_or_fastq(
+            os.path.join(os.path.dirname(__file__), 'test_two_adapter_sets.fastq'))
+        adapter_seqs = [x.start_sequence[1] for x in ADAPTERS[:30]]
+        panel = AdapterPanel(adapter_seqs)
+        for read in reads:
+            for read_end in (read[1][:150], read[1][-150:]):
+                identities = score_only_panel_alignment(read_end, panel, [3, -6, -5, -2])
+                for i, adapter_seq in enumerate(adapter_seqs):
+                    self.assertEqual(identities[i],
+                                     full_adapter_identity(read_end, adapter_seq,
+                                                           [3, -6, -5, -2]))
+
+    def test_repeat_trie_panel(self):
+        adapter_seqs = ['GTG' * n for n in reversed(range(1, 31))]
+        panel = AdapterPanel(adapter_seqs, 'trie')
+        rng = random.Random(0)
+        for _ in range(200):
+            read_seq = list('GTG' * rng.randint(0, 40) +
+                            ''.join(rng.choice('ACGT') for _ in range(rng.randint(0, 60))))
+            for i in range(len(read_seq)):
+                if rng.random() < 0.05:
+                    read_seq[i] = rng.choice('ACGT')
+            read_seq = ''.join(read_seq)
+            scoring_scheme_vals = rng.choice(self.scoring_schemes)
+            identities = score_only_panel_alignment(read_seq, panel, scoring_scheme_vals)
+            for i, adapter_seq in enumerate(adapter_seqs):
+                self.assertEqual(identities[i],
+                                 full_adapter_identity(read_seq, adapter_seq, scoring_scheme_vals))
+
+    def test_empty_read(self):
+        panel = AdapterPanel(['ACGT'])
+        self.assertEqual(score_only_panel_alignment('', panel, [3, -6, -5, -2])[0], 0.0)
+
+
+class TestSimdAlignment(unittest.TestCase):
+    """
+    The SIMD alignment engine must give exactly the same alignment results as SeqAn.
+    """
+    scoring_schemes = TestScoreOnlyAlignment.scoring_schemes
+
+    def assert_same_results(self, read_seq, adapter_seqs, scoring_scheme_vals):
+        self.assertEqual(panel_results([read_seq], adapter_seqs, 'seqan', scoring_scheme_vals),
+                         panel_results([read_seq], adapter_seqs, 'simd', scoring_scheme_vals))
+
+    def test_random_sequences(self):
+        rng = random.Random(0)
+        for _ in range(5000):
+            read_seq, adapter_seq = random_read_and_adapter(rng)
+            self.assert_same_results(read_seq, [adapter_seq], rng.choice(self.scoring_schemes))
+
+    def test_read_ends(self):
+        reads, _ = porechop.misc.load_fasta_or_fastq(
+            os.path.join(os.path.dirname(__file__), 'test_two_adapter_sets.fastq'))
+        adapter_seqs = [x.start_sequence[1] for x in ADAPTERS[:30]]
+        for read in reads:
+            for read_end in (read[1][:150], read[1][-150:]):
+                self.assert_same_results(read_end, adapter_seqs, [3, -6, -5, -2])
+
+    def test_empty_read(self):
+        self.assert_same_results('', ['ACGT'], [3, -6, -5, -2])
+
+
+class TestTrieAlignment(unittest.TestCase):
+    """
+    The trie alignment engine must give exactly the same alignment results as SeqAn, for adapters
+    which share prefixes and adapters which don't.
+    """
+    scoring_schemes = TestScoreOnlyAlignment.scoring_schemes + [[2, -3, -2, -2]]
+
+    def assert_same_results(self, read_seq, adapter_seqs, scoring_scheme_vals):
+        self.assertEqual(panel_results([read_seq], adapter_seqs, 'seqan', scoring_scheme_vals),
+                         panel_results([read_seq], adapter_seqs, 'trie', scoring_scheme_vals))
+
+    def test_random_sequences(self):
+        rng = random.Random(0)
+        for _ in range(2000):
+            read_seq, adapter_seq = random_read_and_adapter(rng)
+            adapter_seqs = [adapter_seq]
+            for _ in range(rng.randint(0, 4)):
+                other_seq = random_read_and_adapter(rng)[1]
+                adapter_seqs.append(rng.choice([adapter_seq[:rng.randint(0, len(adapter_seq))],
+                                                adapter_seq + other_seq, other_seq]))
+            rng.shuffle(adapter_seqs)
+            self.assert_same_results(read_seq, adapter_seqs, rng.choice(self.scoring_schemes))
+
+    def test_repeat_adapters(self):
+        adapter_seqs = ['GTG' * n for n in reversed(range(2, 21))] + \
+            ['CAC' * n for n in reversed(range(2, 21))]
+        rng = random.Random(0)
+        for _ in range(100):
+            read_seq = ''.join(rng.choice('ACGT') for _ in range(rng.randint(0, 20))) + \
+                'GTG' * rng.randint(0, 25) + ''.join(rng.choice('ACGT') for _ in range(100))
+            self.assert_same_results(read_seq, adapter_seqs, [3, -6, -5, -2])
+
+    def test_read_ends(self):
+        reads, _ = porechop.misc.load_fasta_or_fastq(
+            os.path.join(os.path.dirname(__file__), 'test_two_adapter_sets.fastq'))
+        adapter_seqs = [x.start_sequence[1] for x in ADAPTERS] + \
+            [x.end_sequence[1] for x in ADAPTERS if x.end_sequence]
+        for read in reads:
+            for read_end in (read[1][:150], read[1][-150:]):
+                self.assert_same_results(read_end, adapter_seqs, [3, -6, -5, -2])
+
+    def test_empty_read_and_adapter(self):
+        self.assert_same_results('', ['ACGT', 'AC'], [3, -6, -5, -2])
+        self.assert_same_results('ACGT', ['', 'ACGT', 'AC'], [3, -6, -5, -2])
+
+
+class TestBatchAlignment(unittest.TestCase):
+    """
+    Aligning many reads at once (in SIMD lanes, for reads of the same length) must give the same
+    results as aligning each read on its own.
+    """
+    def assert_same_results(self, read_seqs, adapter_seqs, scoring_scheme_vals):
+        end_size = max(len(x) for x in read_seqs) + 1
+        for engine in ('seqan', 'simd', 'trie'):
+            batch_results = panel_results(read_seqs, adapter_seqs, engine, scoring_scheme_vals)
+            for r, read_seq in enumerate(read_seqs):
+                self.assertEqual(panel_results([read_seq], adapter_seqs, engine,
+                                               scoring_scheme_vals, end_size)[0],
+                                 batch_results[r])
+
+    def test_random_sequences(self):
+        rng = random.Random(0)
+        for _ in range(300):
+            adapter_seqs = [random_read_and_adapter(rng)[1] for _ in range(rng.randint(1, 4))]
+            read_length = rng.randint(0, 25)
+            read_seqs = [random_read_and_adapter(rng)[0] for _ in range(rng.randint(1, 40))]
+            read_seqs = [(x * 30)[:read_length] if rng.random() < 0.8 else x for x in read_seqs]
+            self.assert_same_results(read_seqs, adapter_seqs,
+                                     rng.choice(TestScoreOnlyAlignment.scoring_schemes))
+
+    def test_read_ends(self):
+        reads, _ = porechop.misc.load_fasta_or_fastq(
+            os.path.join(os.path.dirname(__file__), 'test_two_adapter_sets.fastq'))
+        adapter_seqs = [x.start_sequence[1] for x in ADAPTERS[:30]]
+        read_ends = [x[1][:150] for x in reads] + [x[1][-150:] for x in reads]
+        self.assert_same_results(read_ends, adapter_seqs, [3, -6, -5, -2])
+
+
+class TestScratchReuse(unittest.TestCase):
+    """
+    The aligners keep their buffers between calls (one set per thread), so the results mustn't
+    depend on what was aligned before or on which thread does the alignment.
+    """
+    def all_results(self, alignments):
+        results = []
+        for read_seq, adapter_seqs, engine, scoring_scheme_vals in alignments:
+            results.append(panel_results([read_seq], adapter_seqs, engine, scoring_scheme_vals))
+            results.append([result_values(adapter_alignment(read_seq, x, scoring_scheme_vals))
+                            for x in adapter_seqs])
+            results.append(score_only_panel_alignment(read_seq,
+                                                      AdapterPanel(adapter_seqs, engine),
+                                                      scoring_scheme_vals))
+        return results
+
+    def random_alignments(self, rng):
+        alignments = []
+        for _ in range(300):
+            read_seq, adapter_seq = random_read_and_adapter(rng)
+            if rng.random() < 0.2:
+                read_seq *= rng.randint(10, 40)
+            alignments.append((read_seq, [adapter_seq, adapter_seq[::-1]],
+                               rng.choice(['seqan', 'simd', 'trie']),
+                               rng.choice(TestScoreOnlyAlignment.scoring_schemes)))
+        return alignments
+
+    def test_order(self):
+        alignments = self.random_alignments(random.Random(0))
+        expected = self.all_results(alignments)
+        order = list(range(len(alignments)))
+        random.Random(1).shuffle(order)
+        shuffled_results = self.all_results([alignments[i] for i in order])
+        for i, j in enumerate(order):
+            for k in range(3):
+                self.assertEqual(shuffled_results[3 * i + k], expected[3 * j + k])
+
+    def test_threads(self):
+        alignments = self.random_alignments(random.Random(2))
+        expected = self.all_results(alignments)
+        chunks = [alignments[i::4] for i in range(4)]
+        with ThreadPool(4) as pool:
+            chunk_results = pool.map(self.all_results, chunks)
+        for i, results in enumerate(chunk_results):
+            for j in range(len(chunks[i])):
+                for k in range(3):
+                    self.assertEqual(results[3 * j + k], expected[3 * (i + 4 * j) + k])
+
+
+class TestMiddleSearchBounds(unittest.TestCase):
+    """
+    The full middle search skips alignments with a prefilter and a score bound. Neither may change
+    the hits: an alignment must be left out exactly when its full adapter identity is below the
+    threshold, and otherwise give the alignment's coordinates unchanged. This is checked with
+    one-adapter panels, stopped at the first hit, so only the first alignment is done.
+    """
+    def test_random_sequences(self):
+        rng = random.Random(0)
+        below, skipped = 0, 0
+        for _ in range(5000):
+            read_seq, adapter_seq = random_read_and_adapter(rng)
+            if rng.random() < 0.2:
+                read_seq *= rng.randint(2, 10)
+            scoring_scheme_vals = rng.choice(TestScoreOnlyAlignment.scoring_schemes)
+            threshold = rng.choice([0.0, 50.0, 75.0, 85.0, 90.0, 100.0])
+            expected = adapter_alignment(read_seq, adapter_seq, scoring_scheme_vals)
+            identity = full_adapter_identity(read_seq, adapter_seq, scoring_scheme_vals)
+            hits, skipped_count = full_middle_search(read_seq, AdapterPanel([adapter_seq]),
+                                                     scoring_scheme_vals, threshold,
+                                                     first_hit_only=True)
+            if skipped_count:
+                skipped += 1
+                self.assertLess(identity, threshold)
+            if round(identity, 6) < threshold:
+                below += 1
+                self.assertEqual(hits, [])
+            elif expected.read_start != -1:
+                self.assertEqual(hits, [(0, expected.read_start, expected.read_end + 1,
+                                         round(identity, 6))])
+        self.assertGreater(skipped, 0)
+        self.assertGreater(below, skipped)
+
+    def test_exact_hit_is_kept(self):
+        adapter_seq = 'AATGTACTTCGTTCAGTTACGTATTGCT'
+        panel = AdapterPanel([adapter_seq])
+        read_seq = 'GATTACAGATTACA' * 20 + adapter_seq + 'CCGGTTAACCGGTTAA' * 20
+        hits, _ = full_middle_search(read_seq, panel, [3, -6, -5, -2], 100.0,
+                                     first_hit_only=True)
+        self.assertEqual(hits, [(0, 280, 308, 100.0)])
+        hits, skipped_count = full_middle_search(read_seq.replace(adapter_seq, ''), panel,
+                                                 [3, -6, -5, -2], 85.0)
+        self.assertEqual(hits, [])
+        self.assertEqual(skipped_count, 1)
+
+    def test_read_ends(self):
+        reads, _ = porechop.misc.load_fasta_or_fastq(
+            os.path.join(os.path.dirname(__file__), 'test_two_adapter_sets.fastq'))
+        adapter_seqs = [x.start_sequence[1] for x in ADAPTERS[:30]]
+        for read in reads:
+            for read_end in (read[1][:150], read[1][-150:]):
+                for adapter_seq in adapter_seqs:
+                    identity = full_adapter_identity(read_end, adapter_seq, [3, -6, -5, -2])
+                    hits, _ = full_middle_search(read_end, AdapterPanel([adapter_seq]),
+                                                 [3, -6, -5, -2], 85.0, first_hit_only=True)
+                    self.assertEqual(hits == [], round(identity, 6) < 85.0)
+
+
+def masking_middle_search(read_seq, adapter_seqs, scoring_scheme_vals, threshold):
+    """
+    The original middle search: each adapter is aligned to the whole read over and over, masking
+    each hit, until its alignment falls below the threshold.
+    """
+    hits = []
+    for i, adapter_seq in enumerate(adapter_seqs):
+        while True:
+            result = adapter_alignment(read_seq, adapter_seq, scoring_scheme_vals)
+            identity = round(result.full_adapter_percent_identity, 6)
+            if result.read_start == -1 or identity < threshold:
+                break
+            read_start, read_end = result.read_start, result.read_end + 1
+            read_seq = read_seq[:read_start] + '-' * (read_end - read_start) + \
+                read_seq[read_end:]
+            hits.append((i, read_start, read_end, identity))
+    return hits
+
+
+def random_middle_adapter_read(rng, adapter_seqs):
+    """
+    Returns a random read with up to four of the adapters (with a few substitutions) in it.
+    """
+    read_seq = ''.join(rng.choice('ACGT') for _ in range(rng.randint(100, 3000)))
+    for _ in range(rng.randint(0, 4)):
+        adapter_seq = list(rng.choice(adapter_seqs))
+        for _ in range(rng.randint(0, 3)):
+            adapter_seq[rng.randrange(len(adapter_seq))] = rng.choice('ACGT')
+        pos = rng.randint(0, len(read_seq))
+        read_seq = read_seq[:pos] + ''.join(adapter_seq) + read_seq[pos:]
+    return read_seq
+
+
+class TestFullMiddleSearch(unittest.TestCase):
+    """
+    The full middle search must give exactly the hits of the original search, even where equally
+    scoring alignments tie. The prefilter and score bound may only skip alignments which would
+    have ended an adapter's search.
+    """
+    adapter_seqs = ['AATGTACTTCGTTCAGTTACGTATTGCT', 'GCAATACGTAACTGAACGAAGT',
+                    'TTTTTTTTCCTGTACTTCGTTCAGTTACGTATTGCT']
+    repeat_seqs = ['GTG' * 3, 'CAC' * 3, 'GTG' * 8, 'CAC' * 8, 'GTG' * 20]
+
+    def check_random_reads(self, adapter_seqs, scoring_schemes):
+        rng = random.Random(0)
+        panel = AdapterPanel(adapter_seqs)
+        for _ in range(100):
+            read_seq = random_middle_adapter_read(rng, adapter_seqs)
+            threshold = rng.choice([75.0, 85.0, 90.0])
+            scoring_scheme_vals = rng.choice(scoring_schemes)
+            expected = masking_middle_search(read_seq, adapter_seqs, scoring_scheme_vals,
+                                             threshold)
+            hits, _ = full_middle_search(read_seq, panel, scoring_scheme_vals, threshold)
+            self.assertEqual(hits, expected)
+
+    def test_random_reads(self):
+        self.check_random_reads(self.adapter_seqs, TestScoreOnlyAlignment.scoring_schemes)
+
+    def test_repeat_adapters(self):
+        # Short repeat adapters have many near matches in a repeat run, where equally scoring
+        # alignments tie and an adapter's search can stop before its last occurrence.
+        self.check_random_reads(self.adapter_seqs + self.repeat_seqs, [[3, -6, -5, -2]])
+
+    def test_skipped_count(self):
+        adapter_seqs = self.adapter_seqs[:2]
+        read_seq = 'GATTACAGATTACA' * 20 + adapter_seqs[0] * 2 + 'CCGGTTAACCGGTTAA' * 20
+        hits, skipped_count = full_middle_search(read_seq, AdapterPanel(adapter_seqs),
+                                                 [3, -6, -5, -2], 90.0)
+        self.assertEqual(hits, [(0, 280, 308, 100.0), (0, 308, 336, 100.0)])
+
+        # Both adapters' last alignments were ruled out by the prefilter.
+        self.assertEqual(skipped_count, 2)
+
+    def test_first_hit_only(self):
+        adapter_seqs = self.adapter_seqs[:2]
+        read_seq = 'GATTACAGATTACA' * 20 + adapter_seqs[1] + adapter_seqs[0] * 2 + \
+            'CCGGTTAACCGGTTAA' * 20
+        hits, _ = full_middle_search(read_seq, AdapterPanel(adapter_seqs), [3, -6, -5, -2],
+                                     90.0, first_hit_only=True)
+        self.assertEqual(hits, [(0, 302, 330, 100.0)])
+
+
+class TestMultiHitMiddleSearch(unittest.TestCase):
+    """
+    The single-pass middle search must find every hit that aligning each adapter to the whole read
+    over and over (masking each hit) finds.
+    """
+    adapter_seqs = TestFullMiddleSearch.adapter_seqs
+
+    def test_random_reads(self):
+        rng = random.Random(0)
+        panel = AdapterPanel(self.adapter_seqs)
+        for _ in range(100):
+            read_seq = random_middle_adapter_read(rng, self.adapter_seqs)
+            threshold = rng.choice([75.0, 85.0, 90.0])
+            expected = masking_middle_search(read_seq, self.adapter_seqs, [3, -6, -5, -2],
+                                             threshold)
+            hits, _ = multi_hit_middle_search(read_seq, panel, [3, -6, -5, -2], threshold)
+            for hit in expected:
+                self.assertIn(hit, hits)
+            for _, _, _, identity in hits:
+                self.assertGreaterEqual(identity, threshold)
+
+    def test_adjacent_copies(self):
+        adapter_seq = self.adapter_seqs[0]
+        read_seq = 'GATTACAGATTACA' * 20 + adapter_seq * 3 + 'CCGGTTAACCGGTTAA' * 20
+        hits, skipped_count = multi_hit_middle_search(read_seq, AdapterPanel([adapter_seq]),
+                                                      [3, -6, -5, -2], 90.0)
+        self.assertEqual(sorted(hits), [(0, 280 + i * 28, 308 + i * 28, 100.0) for i in range(3)])
+        self.assertEqual(skipped_count, 0)
+        _, skipped_count = multi_hit_middle_search(read_seq.replace(adapter_seq, ''),
+                                                   AdapterPanel([adapter_seq]), [3, -6, -5, -2],
+                                                   90.0)
+        self.assertEqual(skipped_count, 1)
+
+    def test_first_hit_only(self):
+        adapter_seqs = self.adapter_seqs[:2]
+        read_seq = 'GATTACAGATTACA' * 20 + adapter_seqs[1] + adapter_seqs[0] * 2 + \
+            'CCGGTTAACCGGTTAA' * 20
+        hits, _ = multi_hit_middle_search(read_seq, AdapterPanel(adapter_seqs), [3, -6, -5, -2],
+                                          90.0, first_hit_only=True)
+        self.assertEqual(len(hits), 1)
+        self.assertEqual(hits[0][0], 0)
+
+
+def reference_end_trim(read_end_seq, adapter_seqs, end_size, extra_trim_size, end_threshold,
+                       min_trim_size, scoring_scheme_vals, at_start):
+    """
+    The original read end trimming: each adapter is aligned to the read end in turn, and those
+    alignments which pass the thresholds (and don't run to the read end's inner edge) set the trim
+    amount. Returns the trim amount and the hits as (adapter index, full score, partial score, read
+    start, read end).
+    """
+    trim_amount, hits = 0, []
+    for i, adapter_seq in enumerate(adapter_seqs):
+        result = adapter_alignment(read_end_seq, adapter_seq, scoring_scheme_vals)
+        if result.read_start == -1:
+            continue
+        read_start, read_end = result.read_start, result.read_end + 1
+        partial_score = round(result.aligned_region_percent_identity, 6)
+        if at_start:
+            inside_end, amount = read_end != end_size, read_end + extra_trim_size
+        else:
+            inside_end, amount = read_start != 0, end_size - read_start + extra_trim_size
+        if partial_score > end_threshold and inside_end and \
+                read_end - read_start >= min_trim_size:
+            trim_amount = max(trim_amount, amount)
+            hits.append((i, round(result.full_adapter_percent_identity, 6), partial_score,
+                         read_start, read_end))
+    return trim_amount, hits
+
+
+class TestTrimReadEnds(unittest.TestCase):
+    """
+    Trimming many reads' ends in C++ must give the same trim amounts and alignments as aligning
+    each adapter to each read end in turn, with any number of threads.
+    """
+    def assert_same_trims(self, read_seqs, adapters, end_size, extra_trim_size, end_threshold,
+                          min_trim_size, threads):
+        scoring_scheme_vals = [3, -6, -5, -2]
+        end_adapters = [x for x in adapters if x.end_sequence]
+        start_panel = AdapterPanel([x.start_sequence[1] for x in adapters])
+        end_panel = AdapterPanel([x.end_sequence[1] for x in end_adapters])
+        trims, start_hits, end_hits, start_identities, end_identities = \
+            trim_read_ends(read_seqs, start_panel, end_panel, end_size, extra_trim_size,
+                           end_threshold, min_trim_size, scoring_scheme_vals, threads, True)
+        for r, read_seq in enumerate(read_seqs):
+            start_trim, expected_start_hits = \
+                reference_end_trim(read_seq[:end_size], [x.start_sequence[1] for x in adapters],
+                                   end_size, extra_trim_size, end_threshold, min_trim_size,
+                                   scoring_scheme_vals, True)
+            end_trim, expected_end_hits = \
+                reference_end_trim(read_seq[-end_size:], [x.end_sequence[1] for x in end_adapters],
+                                   end_size, extra_trim_size, end_threshold, min_trim_size,
+                                   scoring_scheme_vals, False)
+            self.assertEqual(trims[r], (start_trim, end_trim))
+            self.assertEqual([(x[1], round(x[4], 6), round(x[5], 6), x[2], x[3])
+                              for x in start_hits if x[0] == r], expected_start_hits)
+            self.assertEqual([(x[1], round(x[4], 6), round(x[5], 6), x[2], x[3])
+                              for x in end_hits if x[0] == r], expected_end_hits)
+            for i, adapter in enumerate(adapters):
+                self.assertEqual(start_identities[r * len(adapters) + i],
+                                 full_adapter_identity(read_seq[:end_size],
+                                                       adapter.start_sequence[1],
+                                                       scoring_scheme_vals))
+            for i, adapter in enumerate(end_adapters):
+                self.assertEqual(end_identities[r * len(end_adapters) + i],
+                                 full_adapter_identity(read_seq[-end_size:],
+                                                       adapter.end_sequence[1],
+                                                       scoring_scheme_vals))
+
+    def test_test_reads(self):
+        reads, _ = porechop.misc.load_fasta_or_fastq(
+            os.path.join(os.path.dirname(__file__), 'test_two_adapter_sets.fastq'))
+        read_seqs = [x[1] for x in reads]
+        for threads in (1, 3):
+            self.assert_same_trims(read_seqs, ADAPTERS[:12], 150, 2, 75.0, 4, threads)
+
+    def test_random_reads(self):
+        rng = random.Random(0)
+        adapters = ADAPTERS[:6]
+        read_seqs = []
+        for _ in range(300):
+            read_seq = ''.join(rng.choice('ACGT') for _ in range(rng.randint(0, 400)))
+            adapter = rng.choice(adapters)
+            if rng.random() < 0.5:
+                read_seq = adapter.start_sequence[1][rng.randint(0, 10):] + read_seq
+            if adapter.end_sequence and rng.random() < 0.5:
+                read_seq += adapter.end_sequence[1][:-rng.randint(1, 10)]
+            read_seqs.append(read_seq)
+        for threads in (1, 4):
+            self.assert_same_trims(read_seqs, adapters, rng.choice([50, 150]), rng.randint(0, 5),
+                                   rng.choice([60.0, 75.0, 90.0]), rng.randint(1, 8), threads)
+
+
+@unittest.skipIf(porechop.cpp_function_wrappers.EXTENSION is None,
+                 'the extension module has not been built')
+class TestExtensionModule(unittest.TestCase):
+    """
+    The extension module must give the same results as the ctypes library.
+    """
+    def setUp(self):
+        self.extension = porechop.cpp_function_wrappers.EXTENSION
+
+    def tearDown(self):
+        porechop.cpp_function_wrappers.EXTENSION = self.extension
+
+    def run_all_functions(self, read_seqs, adapter_seqs, scoring_scheme_vals):
+        """
+        Runs every wrapped function, using the extension module or ctypes as currently set.
+        """
+        panel = AdapterPanel(adapter_seqs)
+        index = MiddleAdapterIndex(adapter_seqs, 8)
+        outputs = []
+        for read_seq in read_seqs:
+            for adapter_seq in adapter_seqs:
+                outputs.append(result_values(adapter_alignment(read_seq, adapter_seq,
+                                                               scoring_scheme_vals)))
+            outputs.append(list(score_only_panel_alignment(read_seq, panel,
+                                                           scoring_scheme_vals)))
+            outputs.append(full_middle_search(read_seq, panel, scoring_scheme_vals, 75.0))
+            outputs.append(multi_hit_middle_search(read_seq, panel, scoring_scheme_vals, 75.0))
+            outputs.append(multi_hit_middle_search(read_seq, panel, scoring_scheme_vals, 75.0,
+                                                   first_hit_only=True))
+            outputs.append(seeded_middle_search(read_seq, index, scoring_scheme_vals, 75.0))
+        outputs.append(trim_read_ends(read_seqs, panel, panel, 150, 2, 75.0, 4,
+                                      scoring_scheme_vals, 2, True))
+        outputs.append(add_to_minhash_sketch(read_seqs, 11, 50, []))
+        outputs.append(add_to_minhash_sketch(read_seqs[10:], 11, 50,
+                                             add_to_minhash_sketch(read_seqs[:10], 11, 50, [])))
+        return outputs
+
+    def test_same_results(self):
+        rng = random.Random(0)
+        adapter_seqs = TestMultiHitMiddleSearch.adapter_seqs
+        read_seqs = [''.join(rng.choice('ACGT') for _ in range(rng.randint(0, 500)))
+                     for _ in range(20)]
+        read_seqs = [x[:100] + rng.choice(adapter_seqs) + x[100:] for x in read_seqs] + ['']
+        extension_outputs = self.run_all_functions(read_seqs, adapter_seqs, [3, -6, -5, -2])
+        porechop.cpp_function_wrappers.EXTENSION = None
+        ctypes_outputs = self.run_all_functions(read_seqs, adapter_seqs, [3, -6, -5, -2])
+        self.assertEqual(str(extension_outputs), str(ctypes_outputs))
+
+    def test_bytes_sequences(self):
+        result = self.extension.adapter_alignment(b'GATTACAACGTACGTGATTACA', b'ACGTACGT',
+                                                  3, -6, -5, -2)
+        self.assertEqual((result.read_start, result.read_end), (7, 14))
+        self.assertEqual(result, self.extension.adapter_alignment('GATTACAACGTACGTGATTACA',
+                                                                  'ACGTACGT', 3, -6, -5, -2))
@@ -0,0 +1,255 @@
+"""
+Copyright 2017 Ryan Wick (rrwick@gmail.com)
+https://github.com/rrwick/Porechop
+
+This module contains some tests for Porechop. To run them, execute `python3 -m unittest` from the
+root Porechop directory.
+
+This file is part of Porechop. Porechop is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. Porechop is distributed in
+the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with Porechop. If
+not, see <http://www.gnu.org/licenses/>.
+"""
+
+import unittest
+import os
+import shutil
+import json
+import subprocess
+import porechop.misc
+from porechop.cpp_function_wrappers import add_to_minhash_sketch
+
+
+class TestFingerprint(unittest.TestCase):
+    """
+    The reads in this test are the barcoded reads of test_barcodes.fastq, with GTG and CAC repeats
+    added inside the adapters. A --fingerprint run must give the same bin files as binning the
+    reads and then running Porechop with --fp2ndrun on each bin file.
+    """
+    def run_command(self, command):
+        runner_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'porechop-runner.py')
+        input_path = os.path.join(os.path.dirname(__file__), 'test_fingerprint.fastq')
+        command = command.replace('porechop', runner_path)
+        command = command.replace('INPUT', input_path)
+        command = command.replace('TEMP_DIR', self.temp_dir)
+        p = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True)
+        out, err = p.communicate()
+        return out.decode(), err.decode()
+
+    def setUp(self):
+        self.temp_dir = 'TEMP_' + str(os.getpid())
+
+    def tearDown(self):
+        if os.path.isdir(self.temp_dir):
+            shutil.rmtree(self.temp_dir)
+
+    def two_run_bins(self, options=''):
+        """
+        Does the two-run procedure, returning the contents of the final bin files.
+        """
+        self.run_command('porechop -i INPUT -b TEMP_DIR/bins ' + options)
+        os.makedirs(os.path.join(self.temp_dir, 'final'))
+        for bin_filename in os.listdir(os.path.join(self.temp_dir, 'bins')):
+            self.run_command('porechop -i TEMP_DIR/bins/' + bin_filename +
+                             ' -o TEMP_DIR/final/' + bin_filename + ' --fp2ndrun ' + options)
+        return self.load_bins('final')
+
+    def load_bins(self, dir_name):
+        bin_dir = os.path.join(self.temp_dir, dir_name)
+        bins = {}
+        for bin_filename in os.listdir(bin_dir):
+            with open(os.path.join(bin_dir, bin_filename), 'rt') as bin_file:
+                bins[bin_filename] = bin_file.read()
+        return bins
+
+    def test_same_as_two_runs(self):
+        final_bins = self.two_run_bins()
+        self.run_command('porechop -i INPUT -b TEMP_DIR/fingerprint --fingerprint')
+        self.assertEqual(self.load_bins('fingerprint'), final_bins)
+        self.assertEqual(len(final_bins), 4)
+
+        # The GTG repeats were trimmed in the second phase.
+        binned_bins = self.load_bins('bins')
+        for bin_filename, bin_contents in final_bins.items():
+            self.assertLess(len(bin_contents), len(binned_bins[bin_filename]))
+
+    def test_same_as_two_runs_in_chunks(self):
+        final_bins = self.two_run_bins('-t 2')
+        self.run_command('porechop -i INPUT -b TEMP_DIR/fingerprint --fingerprint -t 2 '
+                         '--chunk_size 3')
+        self.assertEqual(self.load_bins('fingerprint'), final_bins)
+
+        # The bins' temporary files are removed once the bins are saved.
+        self.assertEqual(sorted(os.listdir(os.path.join(self.temp_dir, 'fingerprint'))),
+                         sorted(final_bins))
+
+    def test_requires_barcode_dir(self):
+        _, err = self.run_command('porechop -i INPUT -o TEMP_DIR/out.fastq --fingerprint')
+        self.assertTrue('--fingerprint can only be used with --barcode_dir' in err)
+
+
+class TestBinQuota(unittest.TestCase):
+    """
+    Tests the barcode bin quotas, using the same reads. Without a quota, they are binned as
+    follows: 1 and 4 in BC01, 2 and 5 in BC02, 3 in BC03 and 6 and 8 in none (7 has a middle
+    adapter).
+    """
+    run_command = TestFingerprint.run_command
+    setUp = TestFingerprint.setUp
+    tearDown = TestFingerprint.tearDown
+
+    def bin_read_names(self):
+        """
+        Returns the read names in each bin file, as a sorted list of lists.
+        """
+        bin_read_names = []
+        for bin_filename in os.listdir(self.temp_dir):
+            reads, _ = porechop.misc.load_fasta_or_fastq(os.path.join(self.temp_dir,
+                                                                      bin_filename))
+            bin_read_names.append([x[0] for x in reads])
+        return sorted(bin_read_names)
+
+    def test_read_quota(self):
+        self.run_command('porechop -i INPUT -b TEMP_DIR --bin_read_quota 1')
+        bins = self.bin_read_names()
+        self.assertEqual(bins, [['1'], ['2'], ['3'], ['6']])
+
+    def test_base_quota(self):
+        out, _ = self.run_command('porechop -i INPUT -b TEMP_DIR --bin_base_quota 1 '
+                                  '--chunk_size 2')
+
+        # Every barcode bin is full after the second chunk, so the other reads aren't loaded.
+        self.assertTrue('Barcode bins are full' in out)
+        bins = self.bin_read_names()
+        self.assertEqual(bins, [['1'], ['2'], ['3']])
+
+    def test_quota_barcodes(self):
+        # Only BC01 has to be full, which it is after the first chunk.
+        self.run_command('porechop -i INPUT -b TEMP_DIR --bin_read_quota 1 --chunk_size 2 '
+                         '--quota_barcodes repBC01')
+        bins = self.bin_read_names()
+        self.assertEqual(bins, [['1'], ['2']])
+
+    def test_requires_barcode_dir(self):
+        _, err = self.run_command('porechop -i INPUT -o TEMP_DIR/out.fastq --bin_read_quota 10')
+        self.assertTrue('bin quotas can only be used with --barcode_dir' in err)
+
+
+class TestLengthProfile(unittest.TestCase):
+    """
+    The read length profile must match the lengths of the reads in the bin files.
+    """
+    run_command = TestFingerprint.run_command
+    setUp = TestFingerprint.setUp
+    tearDown = TestFingerprint.tearDown
+
+    def bin_read_lengths(self, bin_size):
+        """
+        Returns {barcode: {range start: read count}} for the reads in the bin files.
+        """
+        bin_dir = os.path.join(self.temp_dir, 'bins')
+        lengths = {}
+        for bin_filename in os.listdir(bin_dir):
+            reads, _ = porechop.misc.load_fasta_or_fastq(os.path.join(bin_dir, bin_filename))
+            histogram = lengths.setdefault(bin_filename.split('.')[0], {})
+            for read in reads:
+                range_start = len(read[1]) // bin_size * bin_size
+                histogram[range_start] = histogram.get(range_start, 0) + 1
+        return lengths
+
+    def test_tsv(self):
+        self.run_command('porechop -i INPUT -b TEMP_DIR/bins --length_profile TEMP_DIR/lengths.tsv '
+                         '--length_profile_bin_size 100')
+        with open(os.path.join(self.temp_dir, 'lengths.tsv'), 'rt') as profile_file:
+            lines = profile_file.read().splitlines()
+        self.assertEqual(lines[0], 'barcode\tlength\treads')
+        profile = {}
+        for line in lines[1:]:
+            barcode_name, range_start, read_count = line.split('\t')
+            profile.setdefault(barcode_name, {})[int(range_start)] = int(read_count)
+        self.assertEqual(profile, self.bin_read_lengths(100))
+
+    def test_json(self):
+        self.run_command('porechop -i INPUT -b TEMP_DIR/bins --fingerprint '
+                         '--length_profile TEMP_DIR/lengths.json')
+        with open(os.path.join(self.temp_dir, 'lengths.json'), 'rt') as profile_file:
+            profile = json.load(profile_file)
+        self.assertEqual(profile['bin_size'], 10)
+        bin_read_lengths = self.bin_read_lengths(10)
+        self.assertEqual(sorted(profile['barcodes']), sorted(bin_read_lengths))
+        for barcode_name, barcode_profile in profile['barcodes'].items():
+            self.assertEqual({x: y for x, y in barcode_profile['lengths']},
+                             bin_read_lengths[barcode_name])
+            self.assertEqual(barcode_profile['reads'],
+                             sum(bin_read_lengths[barcode_name].values()))
+
+
+def reference_sketch(seqs, kmer_size, sketch_size):
+    """
+    A slow pure-Python bottom-k sketch of the canonical k-mers, to check the C++ one against.
+    """
+    codes = {'A': 0, 'C': 1, 'G': 2, 'T': 3}
+    hashes = set()
+    for seq in seqs:
+        seq = seq.upper()
+        for i in range(len(seq) - kmer_size + 1):
+            kmer = seq[i:i + kmer_size]
+            if any(x not in codes for x in kmer):
+                continue
+            forward = sum(codes[x] << (2 * (kmer_size - j - 1)) for j, x in enumerate(kmer))
+            reverse = sum((3 - codes[x]) << (2 * j) for j, x in enumerate(kmer))
+            hashes.add(fmix64(min(forward, reverse)))
+    return sorted(hashes)[:sketch_size]
+
+
+def fmix64(k):
+    mask = 0xFFFFFFFFFFFFFFFF
+    k ^= k >> 33
+    k = (k * 0xff51afd7ed558ccd) & mask
+    k ^= k >> 33
+    k = (k * 0xc4ceb9fe1a85ec53) & mask
+    k ^= k >> 33
+    return k
+
+
+class TestBinSketches(unittest.TestCase):
+    """
+    The sketch saved for each barcode bin must be the sketch of the reads in the bin file.
+    """
+    run_command = TestFingerprint.run_command
+    setUp = TestFingerprint.setUp
+    tearDown = TestFingerprint.tearDown
+
+    def test_reference_sketch(self):
+        seqs = ['ACGTTGCAAGGCTTAACCGGTTNACGTACGGATCCAT', 'acgttgcaaggcttaa', 'TTAACCGGTTGCA', '']
+        for kmer_size in (1, 4, 11, 32):
+            self.assertEqual(add_to_minhash_sketch(seqs, kmer_size, 10, []),
+                             reference_sketch(seqs, kmer_size, 10))
+
+    def test_reverse_complement(self):
+        seq = 'ACGTTGCAAGGCTTAACCGGTTACGTACGGATCCATGG'
+        rev_comp = seq[::-1].translate(str.maketrans('ACGT', 'TGCA'))
+        self.assertEqual(add_to_minhash_sketch([seq], 7, 20, []),
+                         add_to_minhash_sketch([rev_comp], 7, 20, []))
+
+    def test_bin_sketches(self):
+        self.run_command('porechop -i INPUT -b TEMP_DIR --sketch_size 40 --sketch_kmer_size 15 '
+                         '-t 2 --chunk_size 3')
+        bin_filenames = [x for x in os.listdir(self.temp_dir) if x.endswith('.fastq')]
+        self.assertEqual(len(bin_filenames), 4)
+        for bin_filename in bin_filenames:
+            reads, _ = porechop.misc.load_fasta_or_fastq(os.path.join(self.temp_dir,
+                                                                      bin_filename))
+            sketch_filename = os.path.join(self.temp_dir,
+                                           bin_filename.split('.')[0] + '.sketch.json')
+            with open(sketch_filename, 'rt') as sketch_file:
+                sketch = json.load(sketch_file)
+            self.assertEqual(sketch['kmer_size'], 15)
+            self.assertEqual(sketch['hashes'], reference_sketch([x[1] for x in reads], 15, 40))
+
+    def test_requires_barcode_dir(self):
+        _, err = self.run_command('porechop -i INPUT -o TEMP_DIR/out.fastq --sketch_size 100')
+        self.assertTrue('--sketch_size can only be used with --barcode_dir' in err)
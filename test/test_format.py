@@ -240,3 +240,72 @@ class TestOutputFormatBarcodes(unittest.TestCase):
                          'test_format_barcodes.fasta.gz')
         self.check_output_file_formats(['BC01.fasta.gz', 'BC02.fasta.gz', 'BC03.fasta.gz',
                                         'none.fasta.gz'], 'fasta.gz')
+
+
+class TestGzipInput(unittest.TestCase):
+    """
+    Checks that reading gzipped input through an external decompressor (as is done with pigz)
+    gives the same data as the uncompressed file.
+    """
+    def check_decompressor(self, input_filename):
+        input_path = os.path.join(os.path.dirname(__file__), input_filename)
+        reader = porechop.misc.PrefetchDecompressor(input_path, ['gzip', '-dc'],
+                                                    prefetch_blocks=1)
+        with open(input_path[:-3], 'rb') as plain_file:
+            self.assertEqual(reader.read(), plain_file.read())
+        reader.close()
+
+    def test_decompressor_fastq(self):
+        self.check_decompressor('test_format.fastq.gz')
+
+    def test_decompressor_fasta(self):
+        self.check_decompressor('test_format_barcodes.fasta.gz')
+
+    def test_decompressor_closed_early(self):
+        input_path = os.path.join(os.path.dirname(__file__), 'test_format.fastq.gz')
+        reader = porechop.misc.PrefetchDecompressor(input_path, ['gzip', '-dc'],
+                                                    prefetch_blocks=1)
+        self.assertEqual(reader.read(1), b'@')
+        reader.close()
+        self.assertTrue(reader.closed)
+
+
+class TestFastaParsing(unittest.TestCase):
+    """
+    FASTA files are parsed in blocks, so these check records that span many blocks and record
+    starts that fall on a block boundary.
+    """
+    def setUp(self):
+        self.fasta_filename = 'TEMP_' + str(os.getpid()) + '.fasta'
+        self.block_size = porechop.misc.PARSE_BLOCK_SIZE
+
+    def tearDown(self):
+        porechop.misc.PARSE_BLOCK_SIZE = self.block_size
+        if os.path.isfile(self.fasta_filename):
+            os.remove(self.fasta_filename)
+
+    def check_records(self, records):
+        with open(self.fasta_filename, 'wt') as fasta:
+            for name, seq in records:
+                fasta.write('>' + name + ' description\n')
+                for i in range(0, len(seq), 70):
+                    fasta.write(seq[i:i + 70] + '\n')
+        loaded = porechop.misc.load_fasta(self.fasta_filename)
+        self.assertEqual([(x[0], x[1]) for x in loaded], records)
+
+    def test_record_larger_than_block(self):
+        # With small blocks, this record spans thousands of them.
+        porechop.misc.PARSE_BLOCK_SIZE = 64
+        records = [('small_1', 'ACGT' * 10), ('large', 'GATTACA' * 150000),
+                   ('small_2', 'TTGCA' * 7)]
+        self.check_records(records)
+
+    def test_record_start_at_block_boundary(self):
+        # The first record takes exactly 32 bytes, so the second starts right at the next block.
+        porechop.misc.PARSE_BLOCK_SIZE = 32
+        records = [('read_1', 'ACGTACGTACGTACGTACGTACG'), ('read_2', 'TTTT'), ('read_3', 'GGG')]
+        with open(self.fasta_filename, 'wt') as fasta:
+            for name, seq in records:
+                fasta.write('>' + name + '\n' + seq + '\n')
+        loaded = porechop.misc.load_fasta(self.fasta_filename)
+        self.assertEqual([(x[0], x[1]) for x in loaded], records)
@@ -137,6 +137,56 @@ class TestTwoAdapterSets(unittest.TestCase):
         self.assertEqual(read_type, 'FASTQ')
         self.assertEqual(porechop.misc.get_compression_type(self.output_file), 'plain')
 
+    def test_results_chunked_fastq(self):
+        self.run_command('porechop -i INPUT -o OUTPUT.fastq --chunk_size 3')
+        read_type = self.check_trimmed_reads()
+        self.assertEqual(read_type, 'FASTQ')
+        self.assertEqual(porechop.misc.get_compression_type(self.output_file), 'plain')
+
+    def test_results_chunked_piped_fastq(self):
+        self.run_command('porechop -i INPUT --chunk_size 1 > OUTPUT.fastq')
+        read_type = self.check_trimmed_reads()
+        self.assertEqual(read_type, 'FASTQ')
+        self.assertEqual(porechop.misc.get_compression_type(self.output_file), 'plain')
+
+    def test_results_seeded_middle_search(self):
+        self.run_command('porechop -i INPUT -o OUTPUT.fastq --middle_search seeded')
+        read_type = self.check_trimmed_reads()
+        self.assertEqual(read_type, 'FASTQ')
+
+    def test_results_discard_middle(self):
+        """
+        Read 4 has middle adapters, so it is thrown out. The other reads are trimmed as usual.
+        """
+        for search in ['full', 'seeded']:
+            self.run_command('porechop -i INPUT -o OUTPUT.fastq --discard_middle '
+                             '--middle_search ' + search)
+            trimmed_reads, _ = self.load_trimmed_reads()
+            self.assertEqual([x[0] for x in trimmed_reads], ['1', '2', '3'])
+            self.assertEqual([len(x[1]) for x in trimmed_reads], [10000, 10970, 7970])
+
+    def test_discard_middle_verbose(self):
+        """
+        At verbosity 2, both of read 4's middle adapters are displayed, even though the read would
+        be discarded after the first.
+        """
+        out, _ = self.run_command('porechop -i INPUT -o OUTPUT.fastq --discard_middle -v 2')
+        self.assertTrue('SQK-NSK007_Y_Bottom (read coords: 5000-5022, identity: 100.0%)' in out)
+        self.assertTrue('SQK-MAP006_Y_Bottom_SK64 (read coords: 2000-2022, identity: 100.0%)'
+                        in out)
+        trimmed_reads, _ = self.load_trimmed_reads()
+        self.assertEqual([x[0] for x in trimmed_reads], ['1', '2', '3'])
+
+    def test_middle_search_summary(self):
+        """
+        The summary describes what each middle search counts.
+        """
+        out, _ = self.run_command('porechop -i INPUT -o OUTPUT.fastq')
+        self.assertTrue('were skipped by the prefilter' in out)
+        out, _ = self.run_command('porechop -i INPUT -o OUTPUT.fastq --middle_search multi_hit')
+        self.assertTrue('found no occurrence in the read' in out)
+        self.assertFalse('prefilter' in out)
+
     def test_check_reads_1(self):
         """
         When only one read is checked, no adapters are found and nothing is trimmed.